@@ -0,0 +1,18 @@
+#!/bin/bash
+set -x
+
+# The trigger and the pipeline modules must import within budget: fail if
+# one of them imports aiplatform or the pipeline components eagerly again
+PIPELINE_MODULES=$(python -c "from src.pipelines.trigger import compile_all; print(*compile_all.discover_pipeline_modules())")
+python -m src.pipelines.trigger.importtime --budget_ms "${IMPORT_BUDGET_MS:-1500}" \
+    src.pipelines.trigger.pipeline $PIPELINE_MODULES
+IMPORT_STATUS=$?
+
+# Compare against a baseline if there is one, otherwise record it
+BASELINE="${1:-benchmark_baseline.json}"
+if [ -f "$BASELINE" ]; then
+    python -m src.pipelines.trigger.benchmark compare --baseline "$BASELINE"
+else
+    python -m src.pipelines.trigger.benchmark run --output "$BASELINE"
+fi || exit $?
+exit $IMPORT_STATUS
@@ -0,0 +1,5 @@
+#!/bin/bash
+set -x
+
+# Build every pipeline spec under src/pipelines in parallel
+python -m src.pipelines.trigger.compile_all --output_dir "${1:-.}"
@@ -0,0 +1,176 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import Dict, NamedTuple
+
+from kfp.v2.dsl import Artifact, component, Output
+
+from src.components.helpers import with_helpers
+
+
+class ShardOutputs(NamedTuple):
+    shards: list
+    explained_shards: list
+    staging_dataset: str
+
+
+@with_helpers(ShardOutputs)
+@component(base_image="python:3.9", packages_to_install=["google-cloud-bigquery"])
+def shard_batch_prediction_input(
+    bigquery_source_input_uri: str,
+    bigquery_destination_output_uri: str,
+    id_column: str,
+    run_id: str,
+    num_shards: int = 1,
+    explained_shards: int = 1,
+) -> ShardOutputs:
+    """Split a batch prediction input into views by a hash of `id_column`.
+
+    All the rows of a time series land in the same shard. The views are
+    created in a staging dataset `batch_predict_<run_id>` of the destination
+    project, in the location of the source. Each shard is a dict of its
+    `source` view and `destination` table URIs; the first `explained_shards`
+    shards are returned apart, to be predicted with explanations.
+    """
+    from google.cloud import bigquery
+
+    if num_shards < 1:
+        raise ValueError(f"num_shards must be at least 1, got {num_shards}")
+
+    def table_id(uri: str) -> str:
+        # bq://project.dataset.table or bq://project:dataset.table
+        return uri[len("bq://") :].replace(":", ".")
+
+    source = table_id(bigquery_source_input_uri)
+    destination_project = table_id(bigquery_destination_output_uri).split(".")[0]
+    client = bigquery.Client(project=destination_project)
+
+    source_project, source_dataset, _ = source.split(".")
+    location = client.get_dataset(f"{source_project}.{source_dataset}").location
+    staging = bigquery.Dataset(
+        f"{destination_project}.batch_predict_{run_id.replace('-', '_')}"
+    )
+    staging.location = location
+    staging = client.create_dataset(staging, exists_ok=True)
+    staging_id = f"{staging.project}.{staging.dataset_id}"
+
+    shards = []
+    for i in range(num_shards):
+        view = bigquery.Table(f"{staging_id}.shard_{i}")
+        view.view_query = (
+            f"SELECT * FROM `{source}` "
+            f"WHERE MOD(ABS(FARM_FINGERPRINT(CAST(`{id_column}` AS STRING))), "
+            f"{num_shards}) = {i}"
+        )
+        client.create_table(view, exists_ok=True)
+        prefix = "explained" if i < explained_shards else "predictions"
+        shards.append(
+            {
+                "source": f"bq://{staging_id}.shard_{i}",
+                "destination": f"bq://{staging_id}.{prefix}_{i}",
+            }
+        )
+    print(f"{num_shards} shards of {source} in {staging_id}")
+
+    return ShardOutputs(
+        shards[explained_shards:], shards[:explained_shards], staging_id
+    )
+
+
+@component(base_image="python:3.9", packages_to_install=["google-cloud-bigquery"])
+def merge_batch_predictions(
+    staging_dataset: str,
+    predictions: Output[Artifact],
+    predictions_table: str = "",
+) -> None:
+    """Merge the shard outputs of `shard_batch_prediction_input` into one table.
+
+    The predictions of every shard are unioned, on the columns they all
+    have, into `predictions_table`; the full outputs of the explained shards
+    into `<predictions_table>_explanations`. The staging dataset is then
+    deleted. Without a `predictions_table`, the merged tables are
+    `predictions` and `explanations` in the staging dataset, which is kept.
+    """
+    from google.cloud import bigquery
+
+    project = staging_dataset.split(".")[0]
+    client = bigquery.Client(project=project)
+    outputs: Dict[str, list] = {"predictions": [], "explained": []}
+    for table in client.list_tables(staging_dataset):
+        kind = table.table_id.rsplit("_", 1)[0]
+        if kind in outputs and table.table_id.rsplit("_", 1)[1].isdigit():
+            outputs[kind].append(client.get_table(table))
+    shard_tables = outputs["predictions"] + outputs["explained"]
+    if not shard_tables:
+        raise RuntimeError(f"No shard predictions in {staging_dataset}")
+
+    # explanation columns only exist in the explained shards
+    columns = [field.name for field in shard_tables[0].schema]
+    for table in shard_tables[1:]:
+        names = {field.name for field in table.schema}
+        columns = [c for c in columns if c in names]
+
+    destination = predictions_table or f"{staging_dataset}.predictions"
+    # queries write in the location of the tables they read
+    location = client.get_dataset(staging_dataset).location
+    output_dataset = bigquery.Dataset(destination.rsplit(".", 1)[0])
+    output_dataset.location = location
+    client.create_dataset(output_dataset, exists_ok=True)
+    merges = [
+        (
+            destination,
+            [
+                f"SELECT {', '.join(f'`{c}`' for c in columns)} "
+                f"FROM `{t.full_table_id.replace(':', '.')}`"
+                for t in shard_tables
+            ],
+        )
+    ]
+    if outputs["explained"]:
+        merges.append(
+            (
+                f"{predictions_table}_explanations"
+                if predictions_table
+                else f"{staging_dataset}.explanations",
+                [
+                    f"SELECT * FROM `{t.full_table_id.replace(':', '.')}`"
+                    for t in outputs["explained"]
+                ],
+            )
+        )
+
+    for table_id, selects in merges:
+        job_config = bigquery.QueryJobConfig(
+            destination=table_id,
+            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        )
+        client.query(
+            "\nUNION ALL\n".join(selects), job_config=job_config, location=location
+        ).result()
+        print(f"Merged {len(selects)} shards into {table_id}")
+
+    if predictions_table:
+        client.delete_dataset(staging_dataset, delete_contents=True)
+
+    project_id, dataset_id, table_id = destination.split(".")
+    predictions.uri = f"bq://{destination}"
+    predictions.metadata.update(
+        {
+            "projectId": project_id,
+            "datasetId": dataset_id,
+            "tableId": table_id,
+            "shards": len(shard_tables),
+            "explained_shards": len(outputs["explained"]),
+        }
+    )
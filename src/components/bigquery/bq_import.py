@@ -12,41 +12,102 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from typing import Any, Callable
+
 from kfp.v2.dsl import Artifact, component, Output
 
+from src.components.helpers import with_helpers
+
+
+def make_job_config(source_format: str, schema_json: str) -> Any:
+    """Load job config for a source format, with an explicit or inferred schema"""
+    import json
+
+    from google.cloud import bigquery
+
+    job_config = bigquery.LoadJobConfig(
+        source_format=getattr(bigquery.SourceFormat, source_format.upper())
+    )
+    if schema_json:
+        # explicit schema: no type inference pass over the data
+        job_config.schema = [
+            bigquery.SchemaField.from_api_repr(field)
+            for field in json.loads(schema_json)
+        ]
+        if job_config.source_format == bigquery.SourceFormat.CSV:
+            job_config.skip_leading_rows = 1
+    elif job_config.source_format == bigquery.SourceFormat.CSV:
+        # only CSV needs inference: Parquet, Avro and ORC carry their schema
+        job_config.autodetect = True
+    return job_config
+
 
-@component(base_image="python:3.9", packages_to_install=["google-cloud-bigquery"])
-def import_csv_to_bigquery(
+@with_helpers(make_job_config)
+@component(
+    base_image="python:3.9",
+    packages_to_install=["google-cloud-bigquery", "google-cloud-storage"],
+)
+def import_csv_to_bigquery(  # noqa: C901
     project: str,
     bq_location: str,
     bq_dataset: str,
     gcs_csv_uri: str,
     raw_dataset: Output[Artifact],
     table_name_prefix: str = "abalone",
+    skip_if_unchanged: bool = True,
+    source_format: str = "CSV",
+    schema_json: str = "",
 ) -> None:
+    import hashlib
+    import json
+
+    from google.api_core.exceptions import NotFound
     from google.cloud import bigquery
+    import google.cloud.storage as storage
+
+    fingerprint_label = "source_fingerprint"
 
     # Construct a BigQuery client object.
     client = bigquery.Client(project=project, location=bq_location)
 
-    def load_dataset(gcs_uri: str, table_id: str) -> None:
-        job_config = bigquery.LoadJobConfig(
-            autodetect=True,
-            # schema=[
-            #     bigquery.SchemaField("Sex", "STRING"),
-            #     bigquery.SchemaField("Length", "NUMERIC"),
-            #     bigquery.SchemaField("Diameter", "NUMERIC"),
-            #     bigquery.SchemaField("Height", "NUMERIC"),
-            #     bigquery.SchemaField("Whole_weight", "NUMERIC"),
-            #     bigquery.SchemaField("Shucked_weight", "NUMERIC"),
-            #     bigquery.SchemaField("Viscera_weight", "NUMERIC"),
-            #     bigquery.SchemaField("Shell_weight", "NUMERIC"),
-            #     bigquery.SchemaField("Rings", "NUMERIC"),
-            # ],
-            # skip_leading_rows=1,
-            # The source format defaults to CSV, so the line below is optional.
-            source_format=bigquery.SourceFormat.CSV,
-        )
+    def source_fingerprint(gcs_uri: str, job_config: bigquery.LoadJobConfig) -> str:
+        # the object generation changes on every overwrite, md5/crc32c on every
+        # content change (composite objects have no md5)
+        bucket_name, blob_name = gcs_uri[len("gs://") :].split("/", 1)
+        blob = storage.Client(project=project).bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
+            raise FileNotFoundError(gcs_uri)
+        source = {
+            "uri": gcs_uri,
+            "generation": blob.generation,
+            "md5": blob.md5_hash,
+            "crc32c": blob.crc32c,
+            "size": blob.size,
+            "load_config": job_config.to_api_repr(),
+        }
+        digest = hashlib.sha256(json.dumps(source, sort_keys=True).encode())
+        # label values are limited to 63 lowercase characters
+        return digest.hexdigest()[:40]
+
+    def record_schema(table_id: str) -> None:
+        # cache-able with `python -m src.pipelines.trigger.schema_cache`
+        table = client.get_table(table_id)
+        raw_dataset.metadata["schema"] = [field.to_api_repr() for field in table.schema]
+
+    def loaded_fingerprint(table_id: str) -> str:
+        try:
+            return client.get_table(table_id).labels.get(fingerprint_label, "")
+        except NotFound:
+            return ""
+
+    def save_fingerprint(table_id: str, fingerprint: str) -> None:
+        table = client.get_table(table_id)
+        table.labels = {**table.labels, fingerprint_label: fingerprint}
+        client.update_table(table, ["labels"])
+
+    def load_dataset(
+        gcs_uri: str, table_id: str, job_config: bigquery.LoadJobConfig
+    ) -> None:
         print(f"Loading {gcs_uri} into {table_id}")
         load_job = client.load_table_from_uri(
             gcs_uri, table_id, job_config=job_config
@@ -70,10 +131,182 @@ def import_csv_to_bigquery(
 
     raw_table_name = f"{table_name_prefix}_raw"
     table_id = f"{project}.{bq_dataset}.{raw_table_name}"
+    raw_dataset_uri = f"bq://{table_id}"
+
+    job_config = make_job_config(source_format, schema_json)
+    fingerprint = source_fingerprint(gcs_csv_uri, job_config)
+    if skip_if_unchanged and loaded_fingerprint(table_id) == fingerprint:
+        print(f"{gcs_csv_uri} is unchanged since the last load, skipping")
+        raw_dataset.uri = raw_dataset_uri
+        record_schema(table_id)
+        return
+
     print("Deleting any tables that might have the same name on the dataset")
     client.delete_table(table_id, not_found_ok=True)
     print("will load data to table")
-    load_dataset(gcs_csv_uri, table_id)
+    load_dataset(gcs_csv_uri, table_id, job_config)
+    save_fingerprint(table_id, fingerprint)
 
-    raw_dataset_uri = f"bq://{table_id}"
     raw_dataset.uri = raw_dataset_uri
+    record_schema(table_id)
+
+
+@with_helpers(make_job_config)
+@component(
+    base_image="python:3.9",
+    packages_to_install=["google-cloud-bigquery", "google-cloud-storage"],
+)
+def append_new_csvs_to_bigquery(  # noqa: C901
+    project: str,
+    bq_location: str,
+    bq_dataset: str,
+    gcs_csv_pattern: str,
+    raw_dataset: Output[Artifact],
+    table_name_prefix: str = "abalone",
+    max_files_per_job: int = 1000,
+    source_format: str = "CSV",
+    schema_json: str = "",
+) -> None:
+    """Append the files matching a gs:// bucket, prefix or wildcard not loaded yet.
+
+    Loaded objects are recorded in a `<prefix>_raw_manifest` table, new files
+    are appended in batches of `max_files_per_job` URIs per load job into an
+    ingestion-time partitioned `<prefix>_raw` table.
+
+    Files are append-only: a loaded file that was overwritten since fails the
+    component, as appending it again would duplicate its rows. Load and
+    manifest jobs get IDs derived from their batch of files and the creation
+    time of the manifest, so a retry after a failure between the two finds
+    the earlier load job instead of appending the same files again.
+    """
+    import datetime
+    import fnmatch
+    import hashlib
+    import json
+
+    from google.api_core.exceptions import Conflict
+    from google.cloud import bigquery
+    import google.cloud.storage as storage
+
+    # Construct a BigQuery client object.
+    client = bigquery.Client(project=project, location=bq_location)
+
+    def list_objects(pattern: str) -> list:
+        # gs://bucket, gs://bucket/prefix/ or gs://bucket/prefix/*.csv
+        bucket_name, _, path = pattern[len("gs://") :].partition("/")
+        # list by the literal prefix, then filter with the full wildcard pattern
+        prefix = path.split("*", 1)[0].split("?", 1)[0]
+        blobs = storage.Client(project=project).list_blobs(bucket_name, prefix=prefix)
+        return [
+            (f"gs://{bucket_name}/{blob.name}", blob.generation)
+            for blob in blobs
+            if not blob.name.endswith("/")
+            and (path == prefix or fnmatch.fnmatchcase(blob.name, path))
+        ]
+
+    def create_manifest(manifest_id: str) -> Any:
+        return client.create_table(
+            bigquery.Table(
+                manifest_id,
+                schema=[
+                    bigquery.SchemaField("uri", "STRING", mode="REQUIRED"),
+                    bigquery.SchemaField("generation", "INTEGER", mode="REQUIRED"),
+                    bigquery.SchemaField("load_job_id", "STRING"),
+                    bigquery.SchemaField("loaded_at", "TIMESTAMP"),
+                ],
+            ),
+            exists_ok=True,
+        )
+
+    def loaded_objects(manifest_id: str) -> dict:
+        rows = client.query(
+            f"SELECT uri, MAX(generation) AS generation FROM `{manifest_id}` "
+            "GROUP BY uri"
+        ).result()
+        return {row["uri"]: row["generation"] for row in rows}
+
+    def run_job(job_id: str, start_job: Callable[[str], Any]) -> None:
+        try:
+            job = start_job(job_id)
+        except Conflict:
+            print(f"Job {job_id} was started by an earlier attempt")
+            job = client.get_job(job_id)
+        job.result()  # Waits for the job to complete.
+
+    def batch_job_id(batch: list, table_id: str, manifest: Any) -> str:
+        # tied to the manifest: a rebuilt table and manifest get new job IDs,
+        # instead of finding the jobs that loaded the dropped table
+        digest = hashlib.sha256(
+            json.dumps([table_id, manifest.created.isoformat(), batch]).encode()
+        )
+        return f"append_{table_name_prefix}_{digest.hexdigest()[:32]}"
+
+    def load_batch(batch: list, table_id: str, job_id: str) -> None:
+        job_config = make_job_config(source_format, schema_json)
+        job_config.write_disposition = bigquery.WriteDisposition.WRITE_APPEND
+        # no field: partitioned by ingestion time
+        job_config.time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY
+        )
+        uris = [uri for uri, _ in batch]
+        print(f"Appending {len(uris)} files into {table_id}")
+        run_job(
+            job_id,
+            lambda job_id: client.load_table_from_uri(
+                uris, table_id, job_config=job_config, job_id=job_id
+            ),
+        )
+
+    def record_batch(batch: list, load_job_id: str, manifest_id: str) -> None:
+        loaded_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        rows = [
+            {
+                "uri": uri,
+                "generation": generation,
+                "load_job_id": load_job_id,
+                "loaded_at": loaded_at,
+            }
+            for uri, generation in batch
+        ]
+        # a load job rather than streaming inserts: free, and no streaming buffer
+        job_config = bigquery.LoadJobConfig(
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND
+        )
+        run_job(
+            f"{load_job_id}_manifest",
+            lambda job_id: client.load_table_from_json(
+                rows, manifest_id, job_config=job_config, job_id=job_id
+            ),
+        )
+
+    dataset = bigquery.Dataset(f"{project}.{bq_dataset}")
+    dataset.location = bq_location
+    client.create_dataset(dataset, exists_ok=True, timeout=300)
+
+    table_id = f"{project}.{bq_dataset}.{table_name_prefix}_raw"
+    manifest_id = f"{table_id}_manifest"
+
+    manifest = create_manifest(manifest_id)
+    already_loaded = loaded_objects(manifest_id)
+    objects = list_objects(gcs_csv_pattern)
+    overwritten = sorted(
+        uri
+        for uri, generation in objects
+        if uri in already_loaded and already_loaded[uri] != generation
+    )
+    if overwritten:
+        raise ValueError(
+            f"{len(overwritten)} files were overwritten after they were loaded, "
+            f"appending them again would duplicate their rows: {overwritten[:10]}"
+        )
+    new_objects = sorted(obj for obj in objects if obj[0] not in already_loaded)
+    print(f"{len(new_objects)} new files, {len(already_loaded)} already loaded")
+
+    for start in range(0, len(new_objects), max_files_per_job):
+        batch = new_objects[start : start + max_files_per_job]
+        load_job_id = batch_job_id(batch, table_id, manifest)
+        load_batch(batch, table_id, load_job_id)
+        record_batch(batch, load_job_id, manifest_id)
+
+    raw_dataset.uri = f"bq://{table_id}"
+    raw_dataset.metadata["files_loaded"] = len(new_objects)
@@ -0,0 +1,144 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from kfp.v2.dsl import Artifact, component, Input, Output
+
+
+@component(base_image="python:3.9", packages_to_install=["google-cloud-bigquery"])
+def predict_bqml_incremental(  # noqa: C901
+    project: str,
+    bq_location: str,
+    model: Input[Artifact],
+    source_table: str,
+    destination_table: str,
+    predictions: Output[Artifact],
+    watermark_column: str = "",
+    partition_column: str = "",
+    cluster_columns: str = "",
+    prune_features: bool = False,
+    passthrough_columns: str = "",
+) -> None:
+    """Score a table with ML.PREDICT, only the rows not scored yet.
+
+    With a `watermark_column`, only the source rows whose value is strictly
+    greater than the largest value already in `destination_table` are
+    scored, and appended. The destination is partitioned by day on
+    `partition_column` (default: the watermark column if it is a DATE,
+    DATETIME or TIMESTAMP, else ingestion time) and clustered on
+    `cluster_columns` (comma-separated, at most 4).
+
+    Without a watermark column the whole table is scored and the destination
+    overwritten, partitioned and clustered only if asked to.
+
+    With `prune_features`, only the model features, the watermark, partition
+    and cluster columns and `passthrough_columns` (e.g. an id) are read.
+    """
+    from google.api_core.exceptions import NotFound
+    from google.cloud import bigquery
+
+    time_types = {"DATE", "DATETIME", "TIMESTAMP"}
+    # legacy SQL type names of the table schema -> query parameter types
+    parameter_types = {"INTEGER": "INT64", "FLOAT": "FLOAT64", "BOOLEAN": "BOOL"}
+
+    def split(columns: str) -> list:
+        return [c.strip() for c in columns.split(",") if c.strip()]
+
+    client = bigquery.Client(project=project, location=bq_location)
+    model_id = "{projectId}.{datasetId}.{modelId}".format(**model.metadata)
+    source_types = {
+        field.name: field.field_type for field in client.get_table(source_table).schema
+    }
+
+    clustering = split(cluster_columns)
+    if len(clustering) > 4:
+        raise ValueError(f"At most 4 clustering columns, got {clustering}")
+    partition_field = partition_column or (
+        watermark_column if source_types.get(watermark_column) in time_types else ""
+    )
+    for column in [watermark_column, partition_field] + clustering:
+        if column and column not in source_types:
+            raise ValueError(f"No column {column} in {source_table}")
+
+    columns = ["*"]
+    if prune_features:
+        features = [field.name for field in client.get_model(model_id).feature_columns]
+        kept = (
+            features
+            + [watermark_column, partition_field]
+            + clustering
+            + split(passthrough_columns)
+        )
+        columns = [f"`{c}`" for c in dict.fromkeys(c for c in kept if c)]
+    statement = f"SELECT {', '.join(columns)} FROM `{source_table}`"
+
+    watermark = None
+    query_parameters = []
+    if watermark_column:
+        try:
+            client.get_table(destination_table)
+        except NotFound:
+            pass  # first run: score everything
+        else:
+            rows = client.query(
+                f"SELECT MAX(`{watermark_column}`) AS watermark "
+                f"FROM `{destination_table}`"
+            ).result()
+            watermark = next(iter(rows))["watermark"]
+        if watermark is not None:
+            field_type = source_types[watermark_column]
+            statement += f" WHERE `{watermark_column}` > @watermark"
+            query_parameters.append(
+                bigquery.ScalarQueryParameter(
+                    "watermark", parameter_types.get(field_type, field_type), watermark
+                )
+            )
+
+    job_config = bigquery.QueryJobConfig(
+        destination=destination_table,
+        create_disposition=bigquery.CreateDisposition.CREATE_IF_NEEDED,
+        write_disposition=(
+            bigquery.WriteDisposition.WRITE_APPEND
+            if watermark_column
+            else bigquery.WriteDisposition.WRITE_TRUNCATE
+        ),
+        query_parameters=query_parameters,
+    )
+    if watermark_column or partition_field:
+        # no field: partitioned by ingestion time, i.e. by scoring day
+        job_config.time_partitioning = bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY, field=partition_field or None
+        )
+    if clustering:
+        job_config.clustering_fields = clustering
+
+    query = f"SELECT * FROM ML.PREDICT(MODEL `{model_id}`, ({statement}))"
+    print(query)
+    job = client.query(query, job_config=job_config)
+    scored = job.result().total_rows
+    print(
+        f"Scored {scored} rows "
+        f"({job.total_bytes_processed} bytes processed) into {destination_table}"
+    )
+
+    project_id, dataset_id, table_id = destination_table.split(".")
+    predictions.uri = f"bq://{destination_table}"
+    predictions.metadata.update(
+        {
+            "projectId": project_id,
+            "datasetId": dataset_id,
+            "tableId": table_id,
+            "rows_scored": scored,
+            "previous_watermark": None if watermark is None else str(watermark),
+        }
+    )
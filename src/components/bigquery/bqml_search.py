@@ -0,0 +1,202 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import NamedTuple
+
+from kfp.v2.dsl import Artifact, component, Input, Metrics, Output
+
+from src.components.helpers import with_helpers
+
+
+class CandidateOutputs(NamedTuple):
+    candidates: list
+    leaderboard_table: str
+
+
+@with_helpers(CandidateOutputs)
+@component(base_image="python:3.9")
+def bqml_candidates(
+    project: str,
+    model: str,
+    bq_table: str,
+    label: str,
+    candidates: list,
+    leaderboard_table: str = "",
+) -> CandidateOutputs:
+    """CREATE MODEL queries of the candidates of a BQML model search.
+
+    Each candidate is a dict with a `model_type`, optional `options` (e.g.
+    `{"max_iterations": 50}`) and an optional `name`. Candidate models are
+    named `<model>_<name or index>`, except a single unnamed candidate,
+    which is `model` itself. The leaderboard table defaults to
+    `<model>_leaderboard`, in the dataset of the model.
+    """
+    import re
+
+    def sql_value(value: object) -> str:
+        if isinstance(value, bool):
+            return "TRUE" if value else "FALSE"
+        if isinstance(value, (int, float)):
+            return str(value)
+        if isinstance(value, (list, tuple)):
+            return "[" + ", ".join(sql_value(v) for v in value) + "]"
+        return "'" + str(value).replace("'", "\\'") + "'"
+
+    if not candidates:
+        raise ValueError("No candidate models to search")
+
+    queries = []
+    for i, candidate in enumerate(candidates):
+        name = candidate.get("name") or str(i)
+        if not re.fullmatch(r"\w+", name):
+            raise ValueError(f"Candidate names are letters, digits and _: {name}")
+        model_id = (
+            model
+            if len(candidates) == 1 and "name" not in candidate
+            else f"{model}_{name}"
+        )
+        options = {"model_type": candidate["model_type"], "labels": [label]}
+        options.update(candidate.get("options", {}))
+        option_list = ", ".join(f"{k}={sql_value(v)}" for k, v in options.items())
+        queries.append(
+            {
+                "name": name,
+                "query": f"CREATE OR REPLACE MODEL {model_id} "
+                f"OPTIONS ({option_list}) AS SELECT * FROM `{bq_table}`",
+            }
+        )
+
+    if not leaderboard_table:
+        leaderboard_table = f"{model}_leaderboard"
+    if leaderboard_table.count(".") == 1:
+        leaderboard_table = f"{project}.{leaderboard_table}"
+
+    return CandidateOutputs(queries, leaderboard_table)
+
+
+@component(base_image="python:3.9", packages_to_install=["google-cloud-bigquery"])
+def record_bqml_candidate(
+    project: str,
+    bq_location: str,
+    leaderboard_table: str,
+    run_id: str,
+    candidate: str,
+    model: Input[Artifact],
+    metrics: Input[Metrics],
+) -> None:
+    """Append the evaluation metrics of a candidate model to the leaderboard"""
+    import datetime
+    import json
+
+    from google.cloud import bigquery
+
+    client = bigquery.Client(project=project, location=bq_location)
+    schema = [
+        bigquery.SchemaField("run_id", "STRING"),
+        bigquery.SchemaField("candidate", "STRING"),
+        bigquery.SchemaField("model_id", "STRING"),
+        bigquery.SchemaField("metrics", "STRING"),
+        bigquery.SchemaField("recorded_at", "TIMESTAMP"),
+    ]
+    client.create_table(
+        bigquery.Table(leaderboard_table, schema=schema), exists_ok=True
+    )
+    row = {
+        "run_id": run_id,
+        "candidate": candidate,
+        "model_id": "{projectId}.{datasetId}.{modelId}".format(**model.metadata),
+        "metrics": json.dumps(
+            {
+                k: v
+                for k, v in metrics.metadata.items()
+                if isinstance(v, (int, float)) and not isinstance(v, bool)
+            }
+        ),
+        "recorded_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    # a load job rather than streaming: the row is readable right away
+    client.load_table_from_json(
+        [row],
+        leaderboard_table,
+        job_config=bigquery.LoadJobConfig(schema=schema),
+    ).result()
+    print(row)
+
+
+@component(base_image="python:3.9", packages_to_install=["google-cloud-bigquery"])
+def select_bqml_champion(
+    project: str,
+    bq_location: str,
+    leaderboard_table: str,
+    run_id: str,
+    metric: str,
+    champion: Output[Artifact],
+    metrics: Output[Metrics],
+) -> None:
+    """Pick the best candidate of a run by `metric` from the leaderboard.
+
+    Error metrics are minimized; scores (r2_score, explained_variance,
+    accuracy, precision, recall, f1_score, roc_auc) are maximized. The
+    champion artifact has the metadata of a BQML model artifact.
+    """
+    import json
+
+    from google.cloud import bigquery
+
+    higher_is_better = {
+        "r2_score",
+        "explained_variance",
+        "accuracy",
+        "precision",
+        "recall",
+        "f1_score",
+        "roc_auc",
+    }
+
+    client = bigquery.Client(project=project, location=bq_location)
+    rows = client.query(
+        f"SELECT candidate, model_id, metrics FROM `{leaderboard_table}` "
+        "WHERE run_id = @run_id",
+        job_config=bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("run_id", "STRING", run_id)]
+        ),
+    ).result()
+    scores = []
+    for row in rows:
+        candidate_metrics = json.loads(row["metrics"])
+        if metric in candidate_metrics:
+            scores.append(
+                (candidate_metrics[metric], row["candidate"], row["model_id"])
+            )
+        else:
+            print(f"{row['candidate']} has no {metric}: {sorted(candidate_metrics)}")
+    if not scores:
+        raise ValueError(f"No candidate of run {run_id} has a {metric} metric")
+
+    scores.sort(reverse=metric in higher_is_better)
+    value, name, model_id = scores[0]
+    for rank, (score, candidate, _) in enumerate(scores, 1):
+        print(f"{rank}. {candidate}: {metric}={score}")
+
+    project_id, dataset_id, model_name = model_id.split(".")
+    champion.uri = (
+        f"https://www.googleapis.com/bigquery/v2/projects/{project_id}"
+        f"/datasets/{dataset_id}/models/{model_name}"
+    )
+    champion.metadata.update(
+        {"projectId": project_id, "datasetId": dataset_id, "modelId": model_name}
+    )
+    metrics.log_metric("candidates", len(scores))
+    metrics.log_metric("champion", name)
+    metrics.log_metric(metric, value)
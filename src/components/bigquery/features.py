@@ -0,0 +1,186 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import NamedTuple
+
+from kfp.v2.dsl import Artifact, component, Output
+
+from src.components.helpers import with_helpers
+
+
+class FeatureOutputs(NamedTuple):
+    feature_table: str
+
+
+@with_helpers(FeatureOutputs)
+@component(base_image="python:3.9", packages_to_install=["google-cloud-bigquery"])
+def materialize_features(  # noqa: C901
+    project: str,
+    bq_table: str,
+    features: Output[Artifact],
+    transforms: dict = {},  # noqa: B006
+    drop_columns: str = "",
+    partition_column: str = "",
+    cluster_columns: str = "",
+    feature_dataset: str = "features",
+    expiration_days: int = 30,
+) -> FeatureOutputs:
+    """Materialize the feature table of a snapshot of `bq_table`, once.
+
+    `transforms` maps feature columns to SQL expressions over the source
+    columns, e.g. `{"length": "ML.STANDARD_SCALER(length) OVER ()"}`; a
+    feature named like a source column replaces it. Other source columns
+    are kept, except `drop_columns`. The table is named by a hash of the
+    source table id, its last modification time and the transformation, in
+    `<project>.<feature_dataset>`: an existing version is reused as is, so
+    every model trained on the same snapshot shares one transformation.
+    Each use pushes its expiration `expiration_days` further. Without
+    transforms or dropped columns, `bq_table` itself is the feature table.
+
+    The snapshot is read with time travel while it is within the time travel
+    window of the source dataset (7 days by default); an older snapshot is
+    the current table, checked to be unchanged once the table is created.
+    `partition_column` must be a DATE, TIMESTAMP or DATETIME column.
+    """
+    import datetime
+    import hashlib
+    import json
+
+    from google.api_core.exceptions import NotFound
+    from google.cloud import bigquery
+
+    source_id = bq_table[len("bq://") :] if bq_table.startswith("bq://") else bq_table
+    client = bigquery.Client(project=project)
+    source = client.get_table(source_id)
+    source_id = f"{source.project}.{source.dataset_id}.{source.table_id}"
+    columns = {field.name: field.field_type for field in source.schema}
+    drop = [c.strip() for c in drop_columns.split(",") if c.strip()]
+    cluster = [c.strip() for c in cluster_columns.split(",") if c.strip()]
+    missing = [c for c in [*drop, partition_column] if c and c not in columns]
+    if missing:
+        raise ValueError(f"No column {', '.join(missing)} in {source_id}")
+    if partition_column and columns[partition_column] not in (
+        "DATE",
+        "TIMESTAMP",
+        "DATETIME",
+    ):
+        raise ValueError(
+            f"Cannot partition by {partition_column}: its type is "
+            f"{columns[partition_column]}, not DATE, TIMESTAMP or DATETIME"
+        )
+
+    if not transforms and not drop:
+        print(f"No feature transformation: training on {source_id}")
+        features.uri = f"bq://{source_id}"
+        features.metadata.update(
+            {
+                "projectId": source.project,
+                "datasetId": source.dataset_id,
+                "tableId": source.table_id,
+                "reused": True,
+            }
+        )
+        return FeatureOutputs(source_id)
+
+    snapshot = source.modified.isoformat()
+    version = hashlib.sha256(
+        json.dumps(
+            [source_id, snapshot, transforms, drop, partition_column, cluster],
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()[:12]
+    feature_table = f"{project}.{feature_dataset}.{source.table_id}_{version}"
+    expires = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        days=expiration_days
+    )
+
+    try:
+        table = client.get_table(feature_table)
+        reused = True
+        print(f"{feature_table} has the features of {source_id} at {snapshot}")
+    except NotFound:
+        reused = False
+        dataset = bigquery.Dataset(f"{project}.{feature_dataset}")
+        dataset.location = source.location
+        client.create_dataset(dataset, exists_ok=True)
+
+        replaced = {name: sql for name, sql in transforms.items() if name in columns}
+        added = {name: sql for name, sql in transforms.items() if name not in columns}
+        star = "*"
+        if drop:
+            star += f" EXCEPT ({', '.join(f'`{c}`' for c in drop)})"
+        if replaced:
+            star += (
+                " REPLACE ("
+                + ", ".join(f"{sql} AS `{name}`" for name, sql in replaced.items())
+                + ")"
+            )
+        select = ", ".join([star] + [f"{sql} AS `{n}`" for n, sql in added.items()])
+        # the snapshot the version is named after, even if the table changes,
+        # with an hour of margin for the query to start
+        window_hours = (
+            getattr(
+                client.get_dataset(f"{source.project}.{source.dataset_id}"),
+                "max_time_travel_hours",
+                None,
+            )
+            or 168
+        )
+        time_travel_since = datetime.datetime.now(
+            datetime.timezone.utc
+        ) - datetime.timedelta(hours=int(window_hours) - 1)
+        time_travel = (
+            f" FOR SYSTEM_TIME AS OF TIMESTAMP '{snapshot}'"
+            if source.table_type != "VIEW" and source.modified > time_travel_since
+            else ""
+        )
+        ddl = f"CREATE TABLE IF NOT EXISTS `{feature_table}`"
+        if partition_column:
+            partition = f"`{partition_column}`"
+            if columns[partition_column] in ("TIMESTAMP", "DATETIME"):
+                partition = f"DATE({partition})"
+            ddl += f"\nPARTITION BY {partition}"
+        if cluster:
+            ddl += f"\nCLUSTER BY {', '.join(f'`{c}`' for c in cluster)}"
+        query = f"{ddl}\nAS SELECT {select}\nFROM `{source_id}`{time_travel}"
+        print(query)
+        job = client.query(query, location=source.location)
+        job.result()
+        print(f"Materialized {feature_table}: {job.total_bytes_processed} bytes")
+        if not time_travel and source.table_type != "VIEW":
+            modified = client.get_table(source_id).modified
+            if modified != source.modified:
+                client.delete_table(feature_table, not_found_ok=True)
+                raise RuntimeError(
+                    f"{source_id} was modified at {modified.isoformat()}, while "
+                    f"its snapshot at {snapshot} was materialized: retry"
+                )
+        table = client.get_table(feature_table)
+
+    table.expires = expires
+    client.update_table(table, ["expires"])
+
+    features.uri = f"bq://{feature_table}"
+    features.metadata.update(
+        {
+            "projectId": project,
+            "datasetId": feature_dataset,
+            "tableId": feature_table.rsplit(".", 1)[1],
+            "version": version,
+            "source": source_id,
+            "snapshot": snapshot,
+            "reused": reused,
+        }
+    )
+    return FeatureOutputs(feature_table)
@@ -0,0 +1,144 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import NamedTuple
+
+from kfp.v2.dsl import component, Dataset, Output
+
+from src.components.helpers import with_helpers
+
+
+class SampleOutputs(NamedTuple):
+    bq_source: str
+    labels: dict
+    fraction: float
+
+
+@with_helpers(SampleOutputs)
+@component(base_image="python:3.9", packages_to_install=["google-cloud-bigquery"])
+def sample_training_table(  # noqa: C901
+    project: str,
+    bq_table: str,
+    label: str,
+    run_id: str,
+    sample: Output[Dataset],
+    target_rows: int = 0,
+    method: str = "stratified",
+    label_bins: int = 0,
+    time_column: str = "",
+    min_rows_per_stratum: int = 1000,
+    staging_dataset: str = "automl_staging",
+    seed: str = "0",
+) -> SampleOutputs:
+    """Sample about `target_rows` rows of a training table in one query.
+
+    Rows are sampled with the same fraction in every stratum, but at least
+    `min_rows_per_stratum` rows (or all of them) are kept per stratum, so
+    rare classes survive. Strata are the `label` values (`stratified`), its
+    `label_bins` quantile bins for a numeric label, or the days of
+    `time_column` (`time`), which keeps every period of a time-split table.
+    Sampling hashes the rows with `seed`, so reruns pick the same rows.
+
+    The sample is written to `<staging_dataset>.<table>_sample_<run_id>` in
+    `project`; its tables expire after 30 days. Without `target_rows`, or
+    if the table is no larger, `bq_table` is returned as is. `labels` are
+    Vertex AI dataset labels recording the sampling.
+    """
+    from google.cloud import bigquery
+
+    source = bq_table[len("bq://") :] if bq_table.startswith("bq://") else bq_table
+    client = bigquery.Client(project=project)
+
+    table = client.get_table(source)
+    source_rows = table.num_rows
+    if not source_rows:  # views have no row count
+        query = f"SELECT COUNT(*) AS n FROM `{source}`"
+        source_rows = next(iter(client.query(query).result()))["n"]
+    if not target_rows or source_rows <= target_rows:
+        print(f"Training on all {source_rows} rows of {source}")
+        sample.uri = f"bq://{source}"
+        sample.metadata.update({"source_rows": source_rows, "fraction": 1.0})
+        return SampleOutputs(bq_table, {"sampling": "none"}, 1.0)
+
+    columns = {field.name: field.field_type for field in table.schema}
+    if method == "stratified":
+        if label not in columns:
+            raise ValueError(f"No label column {label} in {source}")
+        stratum = f"`{label}`"
+        if label_bins:
+            stratum = f"RANGE_BUCKET(`{label}`, (SELECT bounds FROM quantiles))"
+    elif method == "time":
+        if time_column not in columns:
+            raise ValueError(f"No time column {time_column!r} in {source}")
+        stratum = f"DATE(`{time_column}`)"
+    else:
+        raise ValueError(f"Unknown sampling method {method}: stratified or time")
+
+    quantiles = (
+        f"quantiles AS (SELECT APPROX_QUANTILES(`{label}`, {label_bins}) AS bounds "
+        f"FROM `{source}`),\n"
+        if method == "stratified" and label_bins
+        else ""
+    )
+    query = (
+        f"WITH {quantiles}"
+        f"strata AS (SELECT *, {stratum} AS _sample_stratum FROM `{source}`),\n"
+        "counted AS (SELECT *, COUNT(*) OVER (PARTITION BY _sample_stratum) "
+        "AS _sample_stratum_rows FROM strata)\n"
+        "SELECT * EXCEPT (_sample_stratum, _sample_stratum_rows) FROM counted AS t\n"
+        "WHERE MOD(ABS(FARM_FINGERPRINT(CONCAT(@seed, TO_JSON_STRING(t)))), 1000000)"
+        " < 1000000 * GREATEST(@fraction, LEAST(1.0, @min_rows / _sample_stratum_rows))"
+    )
+
+    dataset = bigquery.Dataset(f"{project}.{staging_dataset}")
+    dataset.location = client.get_dataset(
+        f"{table.project}.{table.dataset_id}"
+    ).location
+    dataset.default_table_expiration_ms = 30 * 24 * 3600 * 1000
+    client.create_dataset(dataset, exists_ok=True)
+    destination = (
+        f"{project}.{staging_dataset}."
+        f"{table.table_id}_sample_{run_id.replace('-', '_')}"
+    )
+
+    fraction = target_rows / source_rows
+    job_config = bigquery.QueryJobConfig(
+        destination=destination,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        query_parameters=[
+            bigquery.ScalarQueryParameter("seed", "STRING", seed),
+            bigquery.ScalarQueryParameter("fraction", "FLOAT64", fraction),
+            bigquery.ScalarQueryParameter("min_rows", "INT64", min_rows_per_stratum),
+        ],
+    )
+    sample_rows = client.query(query, job_config=job_config).result().total_rows
+    sample_fraction = sample_rows / source_rows
+    print(f"Sampled {sample_rows} of {source_rows} rows of {source} into {destination}")
+
+    sample.uri = f"bq://{destination}"
+    sample.metadata.update(
+        {
+            "source": source,
+            "source_rows": source_rows,
+            "sample_rows": sample_rows,
+            "fraction": sample_fraction,
+            "method": method,
+        }
+    )
+    # label values are lowercase letters, digits, _ and -: no decimal point
+    labels = {
+        "sampling": method,
+        "sampling_ppm": str(round(sample_fraction * 1_000_000)),
+    }
+    return SampleOutputs(f"bq://{destination}", labels, sample_fraction)
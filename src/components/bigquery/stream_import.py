@@ -0,0 +1,334 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Stream a local file or a row generator into BigQuery with bounded memory.
+
+The input is read in fixed-size chunks as Arrow record batches and each chunk
+is handed to a sink, with at most `max_in_flight` chunks being uploaded at
+once. The reader blocks while all upload slots are busy, so peak memory is
+about `max_in_flight` chunks whatever the size of the input.
+
+    python -m src.components.bigquery.stream_import \\
+        --source abalone.csv --table svc-demo-vertex.pipeline_us.abalone
+"""
+
+import abc
+import argparse
+from concurrent.futures import Future, ThreadPoolExecutor
+import dataclasses
+import itertools
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+
+_default_chunk_bytes = 8 * 1024 * 1024
+_default_chunk_rows = 50_000
+
+
+def iter_file_batches(
+    path: str,
+    source_format: str = "CSV",
+    chunk_bytes: int = _default_chunk_bytes,
+    chunk_rows: int = _default_chunk_rows,
+) -> Iterator[pa.RecordBatch]:
+    """Read a CSV, Parquet or Arrow IPC file chunk by chunk"""
+    source_format = source_format.upper()
+    if source_format == "CSV":
+        from pyarrow import csv
+
+        reader = csv.open_csv(
+            path, read_options=csv.ReadOptions(block_size=chunk_bytes)
+        )
+        yield from reader
+    elif source_format == "PARQUET":
+        from pyarrow import parquet
+
+        yield from parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows)
+    elif source_format == "ARROW":
+        from pyarrow import ipc
+
+        with pa.memory_map(path) as source:
+            reader = ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+    else:
+        raise ValueError(f"Unsupported source format: {source_format}")
+
+
+def iter_row_batches(
+    rows: Iterable[Dict[str, Any]],
+    schema: Optional[pa.Schema] = None,
+    chunk_rows: int = _default_chunk_rows,
+) -> Iterator[pa.RecordBatch]:
+    """Group an iterable of dict rows into record batches of `chunk_rows` rows"""
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_rows))
+        if not chunk:
+            return
+        batch = pa.RecordBatch.from_pylist(chunk, schema=schema)
+        # infer the schema from the first chunk only, so chunks stay consistent
+        schema = batch.schema
+        yield batch
+
+
+class Sink(abc.ABC):
+    """Destination of the record batches. `write` must be thread-safe."""
+
+    @abc.abstractmethod
+    def write(self, batch: pa.RecordBatch) -> None:
+        """Upload one batch"""
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """Release the sink, once every batch is written or on error"""
+
+
+class ArrowFileSink(Sink):
+    """Append the batches to a local Arrow IPC file"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._writer: Optional[pa.ipc.RecordBatchFileWriter] = None
+        self._lock = threading.Lock()
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        with self._lock:
+            if self._writer is None:
+                self._writer = pa.ipc.new_file(self.path, batch.schema)
+            self._writer.write_batch(batch)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+class BigQueryWriteSink(Sink):
+    """Append the batches to a table with the BigQuery Storage Write API
+
+    Rows go to the table's `_default` stream (at-least-once semantics) over
+    one long-lived AppendRows connection per Arrow schema: every chunk is one
+    request of proto rows on that connection, and concurrent chunks are
+    pipelined on it rather than each opening a stream. The proto descriptor is
+    derived from the Arrow schema. Keep chunks under the 10 MB request limit.
+    """
+
+    def __init__(self, table_id: str) -> None:
+        from google.cloud import bigquery_storage_v1
+
+        project, dataset, table = table_id.split(".")
+        self._client = bigquery_storage_v1.BigQueryWriteClient()
+        self._stream_name = (
+            self._client.table_path(project, dataset, table) + "/streams/_default"
+        )
+        self._streams: Dict[pa.Schema, Tuple[Any, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _stream(self, schema: pa.Schema) -> Tuple[Any, Any]:
+        """The message class and the open append stream for a schema"""
+        from google.cloud.bigquery_storage_v1 import types, writer
+
+        if schema not in self._streams:
+            message_class, descriptor_proto = _proto_message_class(schema)
+            template = types.AppendRowsRequest(
+                write_stream=self._stream_name,
+                proto_rows=types.AppendRowsRequest.ProtoData(
+                    writer_schema=types.ProtoSchema(proto_descriptor=descriptor_proto)
+                ),
+            )
+            self._streams[schema] = (
+                message_class,
+                writer.AppendRowsStream(self._client, template),
+            )
+        return self._streams[schema]
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        from google.cloud.bigquery_storage_v1 import types
+
+        proto_rows = types.ProtoRows()
+        with self._lock:
+            message_class, stream = self._stream(batch.schema)
+        for row in batch.to_pylist():
+            message = message_class(
+                **{name: value for name, value in row.items() if value is not None}
+            )
+            proto_rows.serialized_rows.append(message.SerializeToString())
+
+        request = types.AppendRowsRequest(
+            proto_rows=types.AppendRowsRequest.ProtoData(rows=proto_rows)
+        )
+        # requests are queued on the connection in order, so only the send
+        # is serialized; the acknowledgements are awaited concurrently
+        with self._lock:
+            future = stream.send(request)
+        response = future.result()
+        if response.row_errors or response.error.code:
+            raise RuntimeError(f"AppendRows failed: {response}")
+
+    def close(self) -> None:
+        with self._lock:
+            for _, stream in self._streams.values():
+                stream.close()
+            self._streams.clear()
+
+
+# Arrow type predicate -> proto2 field type. Other types (timestamps, decimals,
+# nested) are rejected rather than silently converted.
+_proto_types = {
+    pa.types.is_boolean: "TYPE_BOOL",
+    pa.types.is_integer: "TYPE_INT64",
+    pa.types.is_floating: "TYPE_DOUBLE",
+    pa.types.is_string: "TYPE_STRING",
+    pa.types.is_large_string: "TYPE_STRING",
+    pa.types.is_binary: "TYPE_BYTES",
+}
+
+
+def _proto_message_class(schema: pa.Schema) -> Tuple[Any, Any]:
+    """Build a proto2 message class, and its descriptor, matching an Arrow schema"""
+    from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+    descriptor_proto = descriptor_pb2.DescriptorProto(name="Row")
+    for number, field in enumerate(schema, start=1):
+        proto_type = next(
+            (t for check, t in _proto_types.items() if check(field.type)), None
+        )
+        if proto_type is None:
+            raise TypeError(f"Unsupported Arrow type for {field.name}: {field.type}")
+        descriptor_proto.field.add(
+            name=field.name,
+            number=number,
+            type=descriptor_pb2.FieldDescriptorProto.Type.Value(proto_type),
+            label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL,
+        )
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(
+        descriptor_pb2.FileDescriptorProto(
+            name="row.proto", syntax="proto2", message_type=[descriptor_proto]
+        )
+    )
+    descriptor = pool.FindMessageTypeByName("Row")
+    if hasattr(message_factory, "GetMessageClass"):
+        message_class = message_factory.GetMessageClass(descriptor)
+    else:  # older protobuf, such as the locked 3.20
+        message_class = message_factory.MessageFactory(pool).GetPrototype(descriptor)
+    return message_class, descriptor_proto
+
+
+@dataclasses.dataclass
+class StreamStats:
+    batches: int = 0
+    rows: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    max_in_flight: int = 0
+
+
+def stream_to_sink(
+    batches: Iterable[pa.RecordBatch],
+    sink: Sink,
+    max_in_flight: int = 4,
+) -> StreamStats:
+    """Write the batches to the sink with up to `max_in_flight` concurrent uploads"""
+    stats = StreamStats()
+    start = time.perf_counter()
+    slots = threading.BoundedSemaphore(max_in_flight)
+    lock = threading.Lock()
+    in_flight = 0
+
+    def upload(batch: pa.RecordBatch) -> None:
+        nonlocal in_flight
+        try:
+            sink.write(batch)
+        finally:
+            with lock:
+                in_flight -= 1
+            slots.release()
+
+    futures: List[Future] = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for batch in batches:
+                # blocks the reader until an upload finishes: bounded memory
+                slots.acquire()
+                with lock:
+                    in_flight += 1
+                    stats.max_in_flight = max(stats.max_in_flight, in_flight)
+                stats.batches += 1
+                stats.rows += batch.num_rows
+                stats.bytes += batch.nbytes
+                futures.append(executor.submit(upload, batch))
+                # surface upload errors early and drop references to done chunks
+                for future in [f for f in futures if f.done()]:
+                    future.result()
+                    futures.remove(future)
+            for future in futures:
+                future.result()
+    finally:
+        # also on upload errors: the sink may hold open connections
+        sink.close()
+
+    stats.seconds = time.perf_counter() - start
+    return stats
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description="Stream a local file into BigQuery in bounded-memory chunks"
+    )
+    parser.add_argument("--source", required=True, help="local input file.")
+    parser.add_argument(
+        "--source_format",
+        default="CSV",
+        choices=["CSV", "PARQUET", "ARROW"],
+        help="input file format.",
+    )
+    parser.add_argument(
+        "--table", required=True, help="destination table: project.dataset.table"
+    )
+    parser.add_argument(
+        "--chunk_bytes",
+        type=int,
+        default=_default_chunk_bytes,
+        help="CSV read block size.",
+    )
+    parser.add_argument(
+        "--chunk_rows",
+        type=int,
+        default=_default_chunk_rows,
+        help="rows per chunk for Parquet input.",
+    )
+    parser.add_argument(
+        "--max_in_flight", type=int, default=4, help="concurrent uploads."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    stats = stream_to_sink(
+        iter_file_batches(
+            args.source, args.source_format, args.chunk_bytes, args.chunk_rows
+        ),
+        BigQueryWriteSink(args.table),
+        max_in_flight=args.max_in_flight,
+    )
+    print(
+        f"Streamed {stats.rows} rows in {stats.batches} chunks "
+        f"({stats.bytes / 1e6:.1f} MB) in {stats.seconds:.1f}s"
+    )
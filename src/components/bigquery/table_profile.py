@@ -0,0 +1,194 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from kfp.v2.dsl import Artifact, component, Metrics, Output
+
+
+@component(base_image="python:3.9", packages_to_install=["google-cloud-bigquery"])
+def profile_bigquery_table(  # noqa: C901
+    project: str,
+    bq_table: str,
+    profile: Output[Artifact],
+    statistics: Output[Metrics],
+    label: str = "",
+    rules: dict = {},  # noqa: B006
+    cache_table: str = "",
+    top_k: int = 5,
+    num_quantiles: int = 4,
+) -> None:
+    """Profile every column of a table in one query, then validate the profile.
+
+    Null rates, approximate distinct counts, approximate quantiles (numeric
+    and time columns), means (numeric) and top values (groupable columns)
+    are all computed by a single generated query. Profiles are cached in
+    `cache_table` (default `<project>.data_profiles.profiles`) by table id
+    and last modification time, so an unchanged table is not scanned again.
+
+    The pipeline fails if a rule is broken. `rules` may set `min_rows`,
+    `required_columns`, `max_null_rate` (a rate, or a dict of rates per
+    column, `*` for any column) and `min_distinct` (a dict per column).
+    A `label` must exist, have no nulls and at least two distinct values.
+    """
+    import datetime
+    import json
+
+    from google.cloud import bigquery
+
+    numeric_types = {"INTEGER", "INT64", "FLOAT", "FLOAT64", "NUMERIC", "BIGNUMERIC"}
+    ordered_types = numeric_types | {"DATE", "DATETIME", "TIMESTAMP", "TIME"}
+    ungroupable_types = {"GEOGRAPHY", "JSON"}
+    # the most frequent values of a float column say little
+    no_top_types = ungroupable_types | {"FLOAT", "FLOAT64"}
+
+    def profile_query(table: bigquery.Table) -> str:
+        selects = ["COUNT(*) AS _rows"]
+        for i, field in enumerate(table.schema):
+            column = f"`{field.name}`"
+            selects.append(f"COUNTIF({column} IS NULL) AS c{i}_nulls")
+            if field.mode == "REPEATED" or field.field_type in ("RECORD", "STRUCT"):
+                continue
+            if field.field_type not in ungroupable_types:
+                selects.append(f"APPROX_COUNT_DISTINCT({column}) AS c{i}_distinct")
+            if field.field_type in ordered_types:
+                selects.append(
+                    f"APPROX_QUANTILES({column}, {num_quantiles}) AS c{i}_quantiles"
+                )
+            if field.field_type in numeric_types:
+                selects.append(f"AVG({column}) AS c{i}_mean")
+            if field.field_type not in no_top_types:
+                selects.append(f"APPROX_TOP_COUNT({column}, {top_k}) AS c{i}_top")
+        return (
+            "SELECT\n  "
+            + ",\n  ".join(selects)
+            + f"\nFROM `{table.project}.{table.dataset_id}.{table.table_id}`"
+        )
+
+    def parse(table: bigquery.Table, row: bigquery.Row) -> dict:
+        rows = row["_rows"]
+        columns = {}
+        for i, field in enumerate(table.schema):
+            stats = {"type": field.field_type, "nulls": row[f"c{i}_nulls"]}
+            stats["null_rate"] = stats["nulls"] / rows if rows else 0.0
+            for stat in ("distinct", "quantiles", "mean"):
+                if f"c{i}_{stat}" in row.keys():
+                    stats[stat] = row[f"c{i}_{stat}"]
+            if f"c{i}_top" in row.keys():
+                stats["top"] = [
+                    {"value": top["value"], "count": top["count"]}
+                    for top in row[f"c{i}_top"]
+                ]
+            columns[field.name] = stats
+        return {"rows": rows, "columns": columns}
+
+    def violations(result: dict) -> list:
+        columns = result["columns"]
+        broken = []
+        if result["rows"] < rules.get("min_rows", 1):
+            broken.append(
+                f"{result['rows']} rows, fewer than {rules.get('min_rows', 1)}"
+            )
+        required = list(rules.get("required_columns", [])) + ([label] if label else [])
+        broken += [f"no column {c}" for c in required if c not in columns]
+        max_null_rate = rules.get("max_null_rate", {})
+        if isinstance(max_null_rate, dict):
+            max_null_rate = dict(max_null_rate)
+        else:
+            max_null_rate = {"*": max_null_rate}
+        min_distinct = dict(rules.get("min_distinct", {}))
+        if label in columns:
+            max_null_rate[label] = 0.0
+            min_distinct[label] = max(min_distinct.get(label, 0), 2)
+        for name, stats in columns.items():
+            limit = max_null_rate.get(name, max_null_rate.get("*"))
+            if limit is not None and stats["null_rate"] > limit:
+                broken.append(f"{name}: null rate {stats['null_rate']:.4f} > {limit}")
+            if name in min_distinct and stats.get("distinct", 0) < min_distinct[name]:
+                broken.append(
+                    f"{name}: {stats.get('distinct', 0)} distinct values"
+                    f" < {min_distinct[name]}"
+                )
+        return broken
+
+    table_id = bq_table[len("bq://") :] if bq_table.startswith("bq://") else bq_table
+    client = bigquery.Client(project=project)
+    table = client.get_table(table_id)
+    last_modified = table.modified.isoformat()
+    options = json.dumps({"top_k": top_k, "num_quantiles": num_quantiles})
+
+    if not cache_table:
+        cache_table = f"{project}.data_profiles.profiles"
+    cache_dataset = bigquery.Dataset(cache_table.rsplit(".", 1)[0])
+    cache_dataset.location = table.location
+    client.create_dataset(cache_dataset, exists_ok=True)
+    schema = [
+        bigquery.SchemaField("table_id", "STRING"),
+        bigquery.SchemaField("last_modified", "STRING"),
+        bigquery.SchemaField("options", "STRING"),
+        bigquery.SchemaField("profile", "STRING"),
+        bigquery.SchemaField("profiled_at", "TIMESTAMP"),
+    ]
+    client.create_table(bigquery.Table(cache_table, schema=schema), exists_ok=True)
+
+    key = [
+        bigquery.ScalarQueryParameter("table_id", "STRING", table_id),
+        bigquery.ScalarQueryParameter("last_modified", "STRING", last_modified),
+        bigquery.ScalarQueryParameter("options", "STRING", options),
+    ]
+    cached = list(
+        client.query(
+            f"SELECT profile FROM `{cache_table}` WHERE table_id = @table_id "
+            "AND last_modified = @last_modified AND options = @options LIMIT 1",
+            job_config=bigquery.QueryJobConfig(query_parameters=key),
+        ).result()
+    )
+    if cached:
+        print(f"{table_id} is unchanged since {last_modified}: cached profile")
+        result = json.loads(cached[0]["profile"])
+    else:
+        query = profile_query(table)
+        print(query)
+        job = client.query(query)
+        # dates and decimals of the quantiles as strings, as in the cache
+        row = next(iter(job.result()))
+        result = json.loads(json.dumps(parse(table, row), default=str))
+        print(f"Profiled {table_id}: {job.total_bytes_processed} bytes processed")
+        client.load_table_from_json(
+            [
+                {
+                    "table_id": table_id,
+                    "last_modified": last_modified,
+                    "options": options,
+                    "profile": json.dumps(result),
+                    "profiled_at": datetime.datetime.now(
+                        datetime.timezone.utc
+                    ).isoformat(),
+                }
+            ],
+            cache_table,
+            job_config=bigquery.LoadJobConfig(schema=schema),
+        ).result()
+
+    broken = violations(result)
+    profile.uri = f"bq://{table_id}"
+    profile.metadata.update(
+        {"table_id": table_id, "last_modified": last_modified, **result}
+    )
+    statistics.log_metric("rows", result["rows"])
+    statistics.log_metric("columns", len(result["columns"]))
+    statistics.log_metric("cached", bool(cached))
+    statistics.log_metric("violations", len(broken))
+    if broken:
+        raise ValueError(
+            f"{table_id} failed validation:\n" + "\n".join(f"- {b}" for b in broken)
+        )
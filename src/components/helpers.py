@@ -0,0 +1,49 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper functions shared by several lightweight components.
+
+KFP only ships the source of the component function itself, so a component
+cannot import other modules of this repository at run time. `with_helpers`
+appends the source of module-level helper functions to the component program,
+where the component calls them as globals, as it does when its `python_func`
+is called directly. Like components, helpers import what they need in their
+body and only use `typing` names in their annotations.
+
+    @with_helpers(make_job_config)
+    @component(base_image="python:3.9", packages_to_install=[...])
+    def load(...) -> None:
+        job_config = make_job_config(...)
+"""
+
+import inspect
+import textwrap
+from typing import Any, Callable
+
+
+def with_helpers(*helpers: Callable) -> Callable[[Any], Any]:
+    """Ship the source of `helpers` in the program of a lightweight component"""
+
+    def decorate(component_op: Any) -> Any:
+        command = component_op.component_spec.implementation.container.command
+        definition = f"\ndef {component_op.python_func.__name__}("
+        if definition not in command[-1]:
+            raise ValueError(f"{component_op} is not a lightweight component")
+        sources = "".join(
+            textwrap.dedent(inspect.getsource(helper)) + "\n\n" for helper in helpers
+        )
+        command[-1] = command[-1].replace(definition, f"\n{sources}{definition}", 1)
+        return component_op
+
+    return decorate
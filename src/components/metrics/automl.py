@@ -1,3 +1,5 @@
+from typing import Any
+
 from kfp.v2.dsl import (
     Artifact,
     ClassificationMetrics,
@@ -7,61 +9,146 @@ from kfp.v2.dsl import (
     Output,
 )
 
+from src.components.helpers import with_helpers
+
+
+def get_eval_info(
+    client: Any, model_name: str, evaluation_id: str, cache_dir: str
+) -> dict:
+    """Fetch the metrics of one evaluation (default: the first one listed)
 
+    Evaluations are immutable, so their metrics are cached as JSON under
+    `cache_dir` (e.g. a /gcs/... path), keyed by the evaluation resource
+    name. An evaluation given by ID is then read without any API call; the
+    default one is still listed, as which one is first can change, but its
+    metrics are not converted from protobuf again.
+    """
+    import hashlib
+    import json
+    import logging
+    import os
+
+    from google.protobuf.json_format import MessageToDict
+
+    def cache_path(evaluation_name: str) -> str:
+        key = hashlib.sha256(evaluation_name.encode()).hexdigest()[:16]
+        return os.path.join(cache_dir, f"{key}.json") if cache_dir else ""
+
+    def read_cache(path: str) -> Any:
+        if not path or not os.path.exists(path):
+            return None
+        logging.info("evaluation metrics read from cache: %s", path)
+        with open(path) as f:
+            return json.load(f)
+
+    if evaluation_id:
+        evaluation_name = f"{model_name}/evaluations/{evaluation_id}"
+        cached = read_cache(cache_path(evaluation_name))
+        if cached is not None:
+            return cached
+        evaluation = client.get_model_evaluation(name=evaluation_name)
+    else:
+        # one evaluation per page, and stop after the first page
+        response = client.list_model_evaluations(
+            request={"parent": model_name, "page_size": 1}
+        )
+        evaluation = next(iter(response))
+        cached = read_cache(cache_path(evaluation.name))
+        if cached is not None:
+            return cached
+    print("model_evaluation")
+    print(" name:", evaluation.name)
+    print(" metrics_schema_uri:", evaluation.metrics_schema_uri)
+    metrics = MessageToDict(evaluation._pb.metrics)
+
+    path = cache_path(evaluation.name)
+    if path:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(metrics, f)
+    return metrics
+
+
+@with_helpers(get_eval_info)
 @component(
     base_image="python:3.9",
     packages_to_install=[
         "google-cloud-aiplatform",
+        "numpy",
     ],
 )
-def interpret_automl_classification_metrics(
-    project: str,
+def interpret_automl_classification_metrics(  # noqa: C901
     region: str,
     model: Input[Artifact],
     metrics: Output[Metrics],
     classificationMetrics: Output[ClassificationMetrics],
+    max_roc_points: int = 200,
+    evaluation_id: str = "",
+    cache_dir: str = "",
 ) -> None:
     import json
     import logging
 
     from google.cloud import aiplatform as aip
-
-    def get_eval_info(
-        client: aip.gapic.ModelServiceClient, model_name: str
-    ) -> list[dict]:
-        from google.protobuf.json_format import MessageToDict
-
-        response = client.list_model_evaluations(parent=model_name)
-        metrics_list = []
-        for evaluation in response:
-            print("model_evaluation")
-            print(" name:", evaluation.name)
-            print(" metrics_schema_uri:", evaluation.metrics_schema_uri)
-            metrics = MessageToDict(evaluation._pb.metrics)
-            for metric in metrics.keys():
-                logging.info("metric: %s, value: %s", metric, metrics[metric])
-            metrics_list.append(metrics)
-
-        return metrics_list
+    import numpy as np
+
+    def roc_curve(confidence_metrics: list[dict]) -> np.ndarray:
+        """Return the (fpr, tpr, threshold) columns sorted by fpr, then tpr"""
+        keys = ("falsePositiveRate", "recall", "confidenceThreshold")
+        curve = np.fromiter(
+            (point.get(key, 0.0) for point in confidence_metrics for key in keys),
+            dtype=np.float64,
+            count=len(confidence_metrics) * len(keys),
+        ).reshape(-1, len(keys))
+        return curve[np.lexsort((curve[:, 1], curve[:, 0]))]
+
+    def auc(curve: np.ndarray) -> float:
+        fpr, tpr = curve[:, 0], curve[:, 1]
+        return float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+
+    def downsample(curve: np.ndarray, max_points: int) -> np.ndarray:
+        """Keep points evenly spaced along the curve length, and both ends
+
+        Spacing by arc length rather than by index keeps the points where the
+        curve bends, so its shape and area are preserved.
+        """
+        if max_points < 2 or len(curve) <= max_points:
+            return curve
+        steps = np.hypot(np.diff(curve[:, 0]), np.diff(curve[:, 1]))
+        arc_length = np.concatenate(([0.0], np.cumsum(steps)))
+        targets = np.linspace(0.0, arc_length[-1], max_points)
+        indices = np.unique(
+            np.searchsorted(arc_length, targets).clip(0, len(curve) - 1)
+        )
+        return curve[indices]
 
     def log_metrics(
-        metrics_list: list[dict], classificationMetrics: Output[ClassificationMetrics]
+        eval_metrics: dict, classificationMetrics: Output[ClassificationMetrics]
     ) -> None:
-        test_confusion_matrix = metrics_list[0]["confusionMatrix"]
+        for metric in eval_metrics.keys():
+            if metric == "confidenceMetrics":
+                # thousands of points: only log how many there are
+                logging.info("metric: %s, %d points", metric, len(eval_metrics[metric]))
+            else:
+                logging.info("metric: %s, value: %s", metric, eval_metrics[metric])
+
+        test_confusion_matrix = eval_metrics["confusionMatrix"]
         logging.info("rows: %s", test_confusion_matrix["rows"])
 
         # log the ROC curve
-        fpr = []
-        tpr = []
-        thresholds = []
-        for item in metrics_list[0]["confidenceMetrics"]:
-            fpr.append(item.get("falsePositiveRate", 0.0))
-            tpr.append(item.get("recall", 0.0))
-            thresholds.append(item.get("confidenceThreshold", 0.0))
-        print(f"fpr: {fpr}")
-        print(f"tpr: {tpr}")
-        print(f"thresholds: {thresholds}")
-        classificationMetrics.log_roc_curve(fpr, tpr, thresholds)
+        curve = roc_curve(eval_metrics.get("confidenceMetrics", []))
+        if len(curve):
+            sampled = downsample(curve, max_roc_points)
+            logging.info(
+                "ROC curve: %d points logged out of %d, AUC %.4f (full curve %.4f)",
+                len(sampled),
+                len(curve),
+                auc(sampled),
+                auc(curve),
+            )
+            classificationMetrics.log_roc_curve(
+                sampled[:, 0].tolist(), sampled[:, 1].tolist(), sampled[:, 2].tolist()
+            )
 
         # log the confusion matrix
         annotations = []
@@ -74,14 +161,13 @@ def interpret_automl_classification_metrics(
         )
 
         # log textual metrics info as well
-        for metric in metrics_list[0].keys():
+        for metric in eval_metrics.keys():
             if metric != "confidenceMetrics":
-                val_string = json.dumps(metrics_list[0][metric])
+                val_string = json.dumps(eval_metrics[metric])
                 metrics.log_metric(metric, val_string)
         # metrics.metadata["model_type"] = "AutoML Tabular classification"
 
     logging.getLogger().setLevel(logging.INFO)
-    aip.init(project=project)
     # extract the model resource name from the input Model Artifact
     model_resource_path = model.metadata["resourceName"]
     logging.info("model path: %s", model_resource_path)
@@ -89,10 +175,11 @@ def interpret_automl_classification_metrics(
     client_options = {"api_endpoint": f"{region}-aiplatform.googleapis.com"}
     # Initialize client that will be used to create and send requests.
     client = aip.gapic.ModelServiceClient(client_options=client_options)
-    metrics_list = get_eval_info(client, model_resource_path)
-    log_metrics(metrics_list, classificationMetrics)
+    eval_metrics = get_eval_info(client, model_resource_path, evaluation_id, cache_dir)
+    log_metrics(eval_metrics, classificationMetrics)
 
 
+@with_helpers(get_eval_info)
 @component(
     base_image="python:3.9",
     packages_to_install=[
@@ -100,17 +187,23 @@ def interpret_automl_classification_metrics(
     ],
 )
 def interpret_automl_regression_metrics(
-    project: str, region: str, model: Input[Artifact], metrics: Output[Metrics]
+    region: str,
+    model: Input[Artifact],
+    metrics: Output[Metrics],
+    evaluation_id: str = "",
+    cache_dir: str = "",
 ) -> None:
+    import logging
+
     import google.cloud.aiplatform as aip
 
-    model = aip.Model(
-        model_name=model.metadata["resourceName"], project=project, location=region
+    logging.getLogger().setLevel(logging.INFO)
+    client_options = {"api_endpoint": f"{region}-aiplatform.googleapis.com"}
+    client = aip.gapic.ModelServiceClient(client_options=client_options)
+    eval_metrics = get_eval_info(
+        client, model.metadata["resourceName"], evaluation_id, cache_dir
     )
 
-    model_evaluations = model.list_model_evaluations()
-    model_evaluation = list(model_evaluations)[0]
-
     available_metrics = [
         "meanAbsoluteError",
         "meanAbsolutePercentageError",
@@ -120,7 +213,11 @@ def interpret_automl_regression_metrics(
     ]
     output = dict()
     for x in available_metrics:
-        val = model_evaluation.metrics.get(x)
+        val = eval_metrics.get(x)
+        if val is None:
+            # e.g. no MAPE when the label has zeros
+            logging.info("metric %s not in the evaluation", x)
+            continue
         output[x] = val
         metrics.log_metric(str(x), float(val))
     print(output)
@@ -1,25 +1,132 @@
-from kfp.v2.dsl import Artifact, component, Input, Metrics, Output
+from kfp.v2.dsl import Artifact, component, Dataset, Input, Metrics, Output
 
 
-@component(base_image="python:3.9")
-def interpret_bqml_evaluation_metrics(
-    bqml_evaluation_metrics: Input[Artifact], metrics: Output[Metrics]
+@component(base_image="python:3.9", packages_to_install=["numpy", "pyarrow"])
+def interpret_bqml_evaluation_metrics(  # noqa: C901
+    bqml_evaluation_metrics: Input[Artifact],
+    metrics: Output[Metrics],
+    evaluation_table: Output[Dataset],
+    worst_k: int = 5,
+    worst_by: str = "",
 ) -> None:
+    """Log BQML evaluation metrics.
+
+    A single-row result (regression, classification) is logged metric by
+    metric. A multi-row result (e.g. one row per ARIMA series) is summarized:
+    mean and percentiles of every numeric column, plus the `worst_k` rows by
+    `worst_by` (default: the first error metric): the highest errors, or the
+    lowest scores (r2_score, accuracy, roc_auc...). The full result is written
+    to `evaluation_table` as Parquet.
+    """
+    import json
     import math
 
-    metadata = bqml_evaluation_metrics.metadata
-    for r in metadata["rows"]:
-        rows = r["f"]
-        schema = metadata["schema"]["fields"]
-        output = {}
-        for metric, value in zip(schema, rows):
-            metric_name = metric["name"]
-            val = float(value["v"])
-            output[metric_name] = val
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    numeric_types = {"FLOAT", "FLOAT64", "INTEGER", "INT64", "NUMERIC", "BIGNUMERIC"}
+    error_metrics = [
+        "mean_absolute_error",
+        "mean_squared_error",
+        "root_mean_squared_error",
+        "mean_absolute_percentage_error",
+        "log_loss",
+        "aic",
+    ]
+    higher_is_better = {
+        "r2_score",
+        "explained_variance",
+        "accuracy",
+        "precision",
+        "recall",
+        "f1_score",
+        "roc_auc",
+    }
+
+    def parse_columns(metadata: dict) -> dict:
+        """Turn the BigQuery rows into one array per column, in a single pass"""
+        fields = metadata["schema"]["fields"]
+        cells = [row["f"] for row in metadata.get("rows", [])]
+        columns = {}
+        for i, field in enumerate(fields):
+            values = [cell[i]["v"] for cell in cells]
+            if field.get("type", "FLOAT").upper() in numeric_types:
+                columns[field["name"]] = np.array(
+                    [np.nan if v is None else v for v in values], dtype=np.float64
+                )
+            else:
+                columns[field["name"]] = np.array(
+                    ["" if v is None else str(v) for v in values], dtype=object
+                )
+        if "mean_squared_error" in columns and "root_mean_squared_error" not in columns:
+            columns["root_mean_squared_error"] = np.sqrt(columns["mean_squared_error"])
+        return columns
+
+    columns = parse_columns(bqml_evaluation_metrics.metadata)
+    numeric = {k: v for k, v in columns.items() if v.dtype == np.float64}
+    n_rows = len(next(iter(columns.values()), []))
+
+    pq.write_table(
+        pa.table(
+            {
+                k: pa.array(list(v) if v.dtype == object else v)
+                for k, v in columns.items()
+            }
+        ),
+        evaluation_table.path,
+        compression="zstd",
+    )
+    evaluation_table.metadata["num_rows"] = n_rows
+
+    output = {}
+    if n_rows == 1:
+        for metric_name, values in numeric.items():
+            output[metric_name] = float(values[0])
+    elif n_rows > 1:
+        for metric_name, values in numeric.items():
+            if np.isnan(values).all():
+                continue
+            p50, p90, p99 = np.nanpercentile(values, [50, 90, 99])
+            output[f"{metric_name}_mean"] = float(np.nanmean(values))
+            output[f"{metric_name}_p50"] = float(p50)
+            output[f"{metric_name}_p90"] = float(p90)
+            output[f"{metric_name}_p99"] = float(p99)
+            output[f"{metric_name}_max"] = float(np.nanmax(values))
+
+        # BQML column names are lowercase except for ARIMA's `AIC`
+        by_lower = {name.lower(): name for name in numeric}
+        ranking = worst_by or next(
+            (by_lower[m] for m in error_metrics if m in by_lower), ""
+        )
+        if ranking in numeric and worst_k > 0:
+            # badness: the largest values are the worst, NaN rows come last
+            sign = -1.0 if ranking.lower() in higher_is_better else 1.0
+            values = np.where(
+                np.isnan(numeric[ranking]), -np.inf, sign * numeric[ranking]
+            )
+            k = min(worst_k, n_rows)
+            # partial sort: O(n) to find the k largest, then sort only those
+            worst = np.argpartition(values, -k)[-k:]
+            worst = worst[np.argsort(values[worst])[::-1]]
+            labels = [c for c, v in columns.items() if v.dtype == object]
+            metrics.log_metric(
+                f"worst_{k}_by_{ranking}",
+                json.dumps(
+                    [
+                        {
+                            **{c: columns[c][i] for c in labels},
+                            ranking: float(numeric[ranking][i]),
+                        }
+                        for i in worst
+                    ]
+                ),
+            )
+        output["num_rows"] = n_rows
+
+    for metric_name, val in output.items():
+        if not math.isnan(val):
             metrics.log_metric(metric_name, val)
-            if metric_name == "mean_squared_error":
-                rmse = math.sqrt(val)
-                metrics.log_metric("root_mean_squared_error", rmse)
 
     metrics.log_metric("framework", "BQML")
 
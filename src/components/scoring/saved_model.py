@@ -0,0 +1,196 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from kfp.v2.dsl import component, Dataset, Output
+
+
+# the TensorFlow version of the serving image the exported models are deployed
+# to. Its own image rather than python:3.9: TF 2.6 needs numpy 1.19, which the
+# rest of the components (and their bundle image) do not use
+@component(base_image="tensorflow/tensorflow:2.6.5", packages_to_install=["pyarrow"])
+def score_saved_model(  # noqa: C901
+    model_uri: str,
+    input_uri: str,
+    output_uri: str,
+    predictions: Output[Dataset],
+    input_format: str = "parquet",
+    batch_size: int = 8192,
+    workers: int = 0,
+    passthrough_columns: str = "",
+    signature: str = "serving_default",
+) -> None:
+    """Score Parquet or Arrow files with a TF SavedModel, e.g. an exported BQML model.
+
+    The input is read in record batches of `batch_size` rows, each scored by
+    one call of the model signature, and written out as it goes, so memory
+    is bounded by a few batches whatever the input size. Work is spread over
+    `workers` processes (default: one per core of the container CPU limit,
+    not of the node), each loading the model once and scoring every
+    `workers`-th Parquet row group (or file, for other formats) into its own
+    `part-<worker>.parquet` under `output_uri`. Rows
+    keep no order across parts: pass id columns in `passthrough_columns` to
+    join predictions back. Without `input_uri`, nothing is scored.
+    """
+    import math
+    import multiprocessing
+    import os
+    import pathlib
+    import time
+
+    if not input_uri:
+        print("No input_uri: nothing to score")
+        predictions.metadata["rows_scored"] = 0
+        return
+
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    import pyarrow.parquet as pq
+
+    start = time.perf_counter()
+    dataset = ds.dataset(input_uri, format=input_format)
+    units = []
+    for fragment in dataset.get_fragments():
+        if input_format == "parquet":
+            units.extend(fragment.split_by_row_group())
+        else:
+            units.append(fragment)
+
+    def available_cores() -> int:
+        """Cores of the CPU affinity, capped by the cgroup (v2, then v1) quota"""
+        cores = len(os.sched_getaffinity(0))
+        cgroup = pathlib.Path("/sys/fs/cgroup")
+        try:
+            if (cgroup / "cpu.max").is_file():
+                quota, period = (cgroup / "cpu.max").read_text().split()
+            else:
+                quota = (cgroup / "cpu/cpu.cfs_quota_us").read_text()
+                period = (cgroup / "cpu/cpu.cfs_period_us").read_text()
+            if quota.strip() not in ("max", "-1"):
+                cores = min(cores, math.ceil(int(quota) / int(period)))
+        except (OSError, ValueError):
+            pass  # no readable quota: not limited
+        return max(cores, 1)
+
+    cores = available_cores()
+    workers = max(min(workers or cores, len(units)), 1)
+    passthrough = [c.strip() for c in passthrough_columns.split(",") if c.strip()]
+    output_fs, output_path = pyarrow.fs.FileSystem.from_uri(output_uri)
+    output_fs.create_dir(output_path, recursive=True)
+
+    def load_model(threads: int) -> tuple:
+        import tensorflow as tf
+
+        # workers share the cores rather than each using all of them
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        predict = tf.saved_model.load(model_uri).signatures[signature]
+        _, inputs = predict.structured_input_signature
+        missing = set(inputs) - set(dataset.schema.names)
+        if missing:
+            raise ValueError(f"Model inputs not in {input_uri}: {sorted(missing)}")
+        return tf, predict, inputs
+
+    def to_arrow(values: np.ndarray) -> pa.Array:
+        if values.dtype == object:
+            values = np.char.decode(values.astype(bytes), "utf-8")
+        if values.ndim == 2 and values.shape[1] == 1:
+            values = values[:, 0]
+        if values.ndim == 1:
+            return pa.array(values)
+        return pa.FixedSizeListArray.from_arrays(
+            pa.array(values.reshape(-1)), values.shape[1]
+        )
+
+    def score(worker: int, threads: int) -> int:
+        tf, predict, inputs = load_model(threads)
+        columns = list(dict.fromkeys([*inputs, *passthrough]))
+        rows, writer = 0, None
+        try:
+            for unit in units[worker::workers]:
+                for batch in unit.to_batches(columns=columns, batch_size=batch_size):
+                    feeds = {}
+                    for name, spec in inputs.items():
+                        column = batch.column(name)
+                        if pa.types.is_string(column.type):
+                            column = pc.fill_null(column, "")
+                        values = column.to_numpy(zero_copy_only=False)
+                        values = values.astype(spec.dtype.as_numpy_dtype)
+                        if spec.shape.rank == 2:
+                            values = values.reshape(-1, 1)
+                        feeds[name] = tf.constant(values)
+                    outputs = predict(**feeds)
+                    scored = pa.RecordBatch.from_arrays(
+                        [batch.column(c) for c in passthrough]
+                        + [to_arrow(outputs[k].numpy()) for k in sorted(outputs)],
+                        names=passthrough + sorted(outputs),
+                    )
+                    if writer is None:
+                        writer = pq.ParquetWriter(
+                            f"{output_path}/part-{worker:05d}.parquet",
+                            scored.schema,
+                            filesystem=output_fs,
+                        )
+                    writer.write_batch(scored)
+                    rows += batch.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+    if workers == 1:
+        rows_scored = score(0, cores)
+    else:
+        # forked, not spawned: the workers inherit the dataset and functions;
+        # TensorFlow is only imported in the workers, so forking is safe
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+
+        def run(worker: int) -> None:
+            try:
+                results.put((worker, score(worker, max(cores // workers, 1)), None))
+            except Exception as e:
+                results.put((worker, 0, f"{type(e).__name__}: {e}"))
+
+        processes = [context.Process(target=run, args=(w,)) for w in range(workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        outcomes = {}
+        while not results.empty():
+            worker, rows, error = results.get()
+            outcomes[worker] = (rows, error)
+        errors = [
+            f"worker {w}: {outcomes[w][1]}"
+            if w in outcomes
+            else f"worker {w}: exit code {process.exitcode}"
+            for w, process in enumerate(processes)
+            if w not in outcomes or outcomes[w][1]
+        ]
+        if errors:
+            raise RuntimeError("\n".join(errors))
+        rows_scored = sum(rows for rows, _ in outcomes.values())
+
+    seconds = time.perf_counter() - start
+    print(f"Scored {rows_scored} rows in {seconds:.1f}s with {workers} workers")
+    predictions.uri = output_uri
+    predictions.metadata.update(
+        {
+            "rows_scored": rows_scored,
+            "workers": workers,
+            "rows_per_second": round(rows_scored / seconds, 1) if seconds else 0.0,
+        }
+    )
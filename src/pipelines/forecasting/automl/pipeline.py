@@ -12,9 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from google_cloud_pipeline_components import aiplatform as gcc_aip
 from kfp.v2 import dsl
 
+from src.components.bigquery.batch_predict_shards import (
+    merge_batch_predictions,
+    shard_batch_prediction_input,
+)
+from src.components.bigquery.table_profile import profile_bigquery_table
 from src.pipelines.trigger.pipeline import VertexPipeline
 
 
@@ -42,13 +46,32 @@ class TabularForecastingAutoMLPipeline(VertexPipeline):
         column_specs: dict,
         bigquery_source_input_uri: str,
         bigquery_destination_output_uri: str,
+        num_shards: int = 1,
+        explained_shards: int = 1,
+        machine_type: str = "n1-standard-4",
+        starting_replica_count: int = 1,
+        max_replica_count: int = 10,
+        predictions_table: str = "",
+        validation_rules: dict = {},  # noqa: B006
+        profile_cache_table: str = "",
     ) -> None:
+        from google_cloud_pipeline_components import aiplatform as gcc_aip
+
+        # fail in minutes on bad data rather than after training
+        profile = profile_bigquery_table(
+            project=project,
+            bq_table=bq_table,
+            label=label,
+            rules=validation_rules,
+            cache_table=profile_cache_table,
+        )
+
         dataset_create_op = gcc_aip.TimeSeriesDatasetCreateOp(
             project=project,
             location=region,
             display_name=display_name,
             bq_source=bq_table,
-        )
+        ).after(profile)
 
         training_op = gcc_aip.AutoMLForecastingTrainingJobRunOp(
             project=project,
@@ -69,18 +92,45 @@ class TabularForecastingAutoMLPipeline(VertexPipeline):
             export_evaluated_data_items=True,
         )
 
-        _ = gcc_aip.ModelBatchPredictOp(
-            project=project,
-            location=region,
-            job_display_name=display_name,
-            model=training_op.outputs["model"],
-            instances_format="bigquery",
+        # the series are split by a hash of their id, and the shards
+        # predicted in parallel, with explanations on the first ones only
+        shards = shard_batch_prediction_input(
             bigquery_source_input_uri=bigquery_source_input_uri,
-            predictions_format="bigquery",
             bigquery_destination_output_uri=bigquery_destination_output_uri,
-            generate_explanation=True,
+            id_column=id_column,
+            run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+            num_shards=num_shards,
+            explained_shards=explained_shards,
         )
 
+        shard_predictions = []
+        for items, generate_explanation in (
+            (shards.outputs["shards"], False),
+            (shards.outputs["explained_shards"], True),
+        ):
+            with dsl.ParallelFor(items) as shard:
+                shard_predictions.append(
+                    gcc_aip.ModelBatchPredictOp(
+                        project=project,
+                        location=region,
+                        job_display_name=display_name,
+                        model=training_op.outputs["model"],
+                        instances_format="bigquery",
+                        bigquery_source_input_uri=shard.source,
+                        predictions_format="bigquery",
+                        bigquery_destination_output_uri=shard.destination,
+                        generate_explanation=generate_explanation,
+                        machine_type=machine_type,
+                        starting_replica_count=starting_replica_count,
+                        max_replica_count=max_replica_count,
+                    )
+                )
+
+        _ = merge_batch_predictions(
+            staging_dataset=shards.outputs["staging_dataset"],
+            predictions_table=predictions_table,
+        ).after(*shard_predictions)
+
 
 if __name__ == "__main__":
     pipeline = TabularForecastingAutoMLPipeline()
@@ -12,13 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from google_cloud_pipeline_components.experimental.bigquery import (
-    BigqueryCreateModelJobOp,
-    BigqueryExplainForecastModelJobOp,
-    BigqueryMLArimaEvaluateJobOp,
-)
 from kfp.v2 import dsl
 
+from src.components.bigquery.features import materialize_features
+from src.components.bigquery.table_profile import profile_bigquery_table
+from src.components.metrics.bqml import interpret_bqml_evaluation_metrics
 from src.pipelines.trigger.pipeline import VertexPipeline
 
 
@@ -39,7 +37,38 @@ class TabularForecastingBQMLPipeline(VertexPipeline):
         id_column: str,
         data_frequency: str,
         forecast_horizon: int,
+        validation_rules: dict = {},  # noqa: B006
+        profile_cache_table: str = "",
+        feature_transforms: dict = {},  # noqa: B006
+        feature_drop_columns: str = "",
+        feature_partition_column: str = "",
     ) -> None:
+        from google_cloud_pipeline_components.experimental.bigquery import (
+            BigqueryCreateModelJobOp,
+            BigqueryExplainForecastModelJobOp,
+            BigqueryMLArimaEvaluateJobOp,
+        )
+
+        # fail in minutes on bad data rather than after training
+        profile = profile_bigquery_table(
+            project=project,
+            bq_table=bq_table,
+            label=label,
+            rules=validation_rules,
+            cache_table=profile_cache_table,
+        )
+
+        # features are materialized once per snapshot of the table, and
+        # shared by every model trained on it, in this pipeline or another
+        features = materialize_features(
+            project=project,
+            bq_table=bq_table,
+            transforms=feature_transforms,
+            drop_columns=feature_drop_columns,
+            partition_column=feature_partition_column,
+        ).after(profile)
+        feature_table = features.outputs["feature_table"]
+
         bq_model = BigqueryCreateModelJobOp(
             project=project,
             location=bq_location,
@@ -51,11 +80,11 @@ class TabularForecastingBQMLPipeline(VertexPipeline):
               TIME_SERIES_DATA_COL='{label}',
               TIME_SERIES_ID_COL='{id_column}',
               DATA_FREQUENCY='{data_frequency}') AS
-            SELECT {id_column}, {label}, {time_column}  FROM `{bq_table}`
+            SELECT {id_column}, {label}, {time_column}  FROM `{feature_table}`
             """,
         )
 
-        _ = BigqueryMLArimaEvaluateJobOp(
+        bq_arima_eval_op = BigqueryMLArimaEvaluateJobOp(
             project=project,
             location=bq_location,
             model=bq_model.outputs["model"],
@@ -70,6 +99,10 @@ class TabularForecastingBQMLPipeline(VertexPipeline):
             },
         ).after(bq_model)
 
+        _ = interpret_bqml_evaluation_metrics(
+            bq_arima_eval_op.outputs["arima_evaluation_metrics"]
+        )
+
         _ = BigqueryExplainForecastModelJobOp(
             project=project,
             location=bq_location,
@@ -12,10 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from google_cloud_pipeline_components import aiplatform as gcc_aip
-from google_cloud_pipeline_components.v1.endpoint import EndpointCreateOp, ModelDeployOp
 from kfp.v2 import dsl
 
+from src.components.bigquery.sample import sample_training_table
+from src.components.bigquery.table_profile import profile_bigquery_table
 from src.components.metrics.automl import interpret_automl_classification_metrics
 from src.pipelines.trigger.pipeline import VertexPipeline
 
@@ -32,12 +32,49 @@ class TabularClassificationAutoMLPipeline(VertexPipeline):
         bq_table: str,
         label: str,
         display_name: str,
+        # 0 trains on the whole table
+        sample_rows: int = 0,
+        sampling_method: str = "stratified",
+        sampling_time_column: str = "",
+        validation_rules: dict = {},  # noqa: B006
+        profile_cache_table: str = "",
+        # from `load_test recommend --update_params`
+        deploy_machine_type: str = "n1-standard-2",
+        deploy_min_replica_count: int = 1,
+        deploy_max_replica_count: int = 1,
     ) -> None:
+        from google_cloud_pipeline_components import aiplatform as gcc_aip
+        from google_cloud_pipeline_components.v1.endpoint import (
+            EndpointCreateOp,
+            ModelDeployOp,
+        )
+
+        # fail in minutes on bad data rather than after training
+        profile = profile_bigquery_table(
+            project=project,
+            bq_table=bq_table,
+            label=label,
+            rules=validation_rules,
+            cache_table=profile_cache_table,
+        )
+
+        # training cost scales with rows: train on a sample of large tables
+        sample = sample_training_table(
+            project=project,
+            bq_table=bq_table,
+            label=label,
+            run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+            target_rows=sample_rows,
+            method=sampling_method,
+            time_column=sampling_time_column,
+        ).after(profile)
+
         dataset_create_op = gcc_aip.TabularDatasetCreateOp(
             project=project,
             location=region,
             display_name=display_name,
-            bq_source=bq_table,
+            bq_source=sample.outputs["bq_source"],
+            labels=sample.outputs["labels"],
         )
 
         training_op = gcc_aip.AutoMLTabularTrainingJobRunOp(
@@ -50,7 +87,6 @@ class TabularClassificationAutoMLPipeline(VertexPipeline):
         )
 
         _ = interpret_automl_classification_metrics(
-            project,
             region,
             training_op.outputs["model"],
         )
@@ -64,9 +100,9 @@ class TabularClassificationAutoMLPipeline(VertexPipeline):
         ModelDeployOp(
             model=training_op.outputs["model"],
             endpoint=endpoint_op.outputs["endpoint"],
-            dedicated_resources_machine_type="n1-standard-2",
-            dedicated_resources_min_replica_count=1,
-            dedicated_resources_max_replica_count=1,
+            dedicated_resources_machine_type=deploy_machine_type,
+            dedicated_resources_min_replica_count=deploy_min_replica_count,
+            dedicated_resources_max_replica_count=deploy_max_replica_count,
         )
 
 
@@ -39,6 +39,8 @@ class TabularClassificationAutoMLEvaluationPipeline(VertexPipeline):
         self,
         project: str,
         region: str,
+        evaluation_id: str = "",
+        evaluation_cache_dir: str = "",
     ) -> None:
         import_model_op = return_unmanaged_model(
             artifact_uri="https://us-central1-aiplatform.googleapis.com/v1/projects/125188993477/locations/us-central1/models/2223665510153715712",
@@ -46,9 +48,10 @@ class TabularClassificationAutoMLEvaluationPipeline(VertexPipeline):
         )
 
         _ = interpret_automl_classification_metrics(
-            project,
             region,
             import_model_op.outputs["model"],
+            evaluation_id=evaluation_id,
+            cache_dir=evaluation_cache_dir,
         )
 
 
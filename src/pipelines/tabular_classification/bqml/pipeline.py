@@ -12,25 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from google_cloud_pipeline_components.types import artifact_types
-from google_cloud_pipeline_components.v1.bigquery import (
-    BigqueryCreateModelJobOp,
-    BigqueryEvaluateModelJobOp,
-    BigqueryExportModelJobOp,
-    BigqueryPredictModelJobOp,
-)
-from google_cloud_pipeline_components.v1.endpoint import EndpointCreateOp, ModelDeployOp
-from google_cloud_pipeline_components.v1.model import ModelUploadOp
 from kfp.v2 import dsl
 from kfp.v2.components import importer_node
 
+from src.components.bigquery.bq_predict import predict_bqml_incremental
+from src.components.bigquery.bqml_search import (
+    bqml_candidates,
+    record_bqml_candidate,
+    select_bqml_champion,
+)
+from src.components.bigquery.features import materialize_features
+from src.components.bigquery.table_profile import profile_bigquery_table
 from src.components.metrics.bqml import interpret_bqml_evaluation_metrics
+from src.components.scoring.saved_model import score_saved_model
 from src.pipelines.trigger.pipeline import VertexPipeline
 
 
 class TabularClassificationBQMLPipeline(VertexPipeline):
 
     display_name = "tabular_classification_bqml_pipeline"
+    # candidate models trained at the same time by the model search
+    search_parallelism = 4
+    # resources of the offline scoring task, one worker per core of the limit
+    scoring_cpu_limit = "8"
+    scoring_memory_limit = "32G"
 
     @dsl.pipeline(name="tabular-classification-bqml-pipeline")
     def pipeline(
@@ -43,44 +48,139 @@ class TabularClassificationBQMLPipeline(VertexPipeline):
         model: str,
         artifact_uri: str,
         display_name: str,
+        predictions_table: str = "svc-demo-vertex.pipeline_us.results_1",
+        watermark_column: str = "",
+        cluster_columns: str = "",
+        prune_features: bool = False,
+        candidates: list = [{"model_type": "dnn_classifier"}],  # noqa: B006
+        metric: str = "f1_score",
+        leaderboard_table: str = "",
+        validation_rules: dict = {},  # noqa: B006
+        profile_cache_table: str = "",
+        feature_transforms: dict = {},  # noqa: B006
+        feature_drop_columns: str = "",
+        feature_partition_column: str = "",
+        # from `load_test recommend --update_params`
+        deploy_machine_type: str = "n1-standard-2",
+        deploy_min_replica_count: int = 1,
+        deploy_max_replica_count: int = 1,
+        scoring_input_uri: str = "",
+        scoring_output_uri: str = "",
+        scoring_input_format: str = "parquet",
+        scoring_passthrough_columns: str = "",
     ) -> None:
-        bq_model = BigqueryCreateModelJobOp(
-            project=project,
-            location=bq_location,
-            query=f"CREATE OR REPLACE MODEL {model} OPTIONS (model_type='dnn_classifier', labels=['{label}']) AS SELECT * FROM `{bq_table}`",
+        from google_cloud_pipeline_components.types import artifact_types
+        from google_cloud_pipeline_components.v1.bigquery import (
+            BigqueryCreateModelJobOp,
+            BigqueryEvaluateModelJobOp,
+            BigqueryExportModelJobOp,
+        )
+        from google_cloud_pipeline_components.v1.endpoint import (
+            EndpointCreateOp,
+            ModelDeployOp,
         )
+        from google_cloud_pipeline_components.v1.model import ModelUploadOp
 
-        bq_eval_model_op = BigqueryEvaluateModelJobOp(
-            project=project, location=bq_location, model=bq_model.outputs["model"]
-        ).after(bq_model)
+        # fail in minutes on bad data rather than after training
+        profile = profile_bigquery_table(
+            project=project,
+            bq_table=bq_table,
+            label=label,
+            rules=validation_rules,
+            cache_table=profile_cache_table,
+        )
 
-        _ = interpret_bqml_evaluation_metrics(
-            bq_eval_model_op.outputs["evaluation_metrics"]
+        # features are materialized once per snapshot of the table, and
+        # shared by every model trained on it, in this pipeline or another
+        features = materialize_features(
+            project=project,
+            bq_table=bq_table,
+            transforms=feature_transforms,
+            drop_columns=feature_drop_columns,
+            partition_column=feature_partition_column,
+        ).after(profile)
+
+        # every candidate is trained and evaluated, concurrently, and only
+        # the best one by `metric` is used for prediction and export
+        search = bqml_candidates(
+            project=project,
+            model=model,
+            bq_table=features.outputs["feature_table"],
+            label=label,
+            candidates=candidates,
+            leaderboard_table=leaderboard_table,
         )
 
-        _ = BigqueryPredictModelJobOp(
+        with dsl.ParallelFor(
+            search.outputs["candidates"], parallelism=self.search_parallelism
+        ) as candidate:
+            bq_model = BigqueryCreateModelJobOp(
+                project=project,
+                location=bq_location,
+                query=candidate.query,
+            )
+
+            bq_eval_model_op = BigqueryEvaluateModelJobOp(
+                project=project, location=bq_location, model=bq_model.outputs["model"]
+            )
+
+            evaluation = interpret_bqml_evaluation_metrics(
+                bq_eval_model_op.outputs["evaluation_metrics"]
+            )
+
+            recorded = record_bqml_candidate(
+                project=project,
+                bq_location=bq_location,
+                leaderboard_table=search.outputs["leaderboard_table"],
+                run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+                candidate=candidate.name,
+                model=bq_model.outputs["model"],
+                metrics=evaluation.outputs["metrics"],
+            )
+
+        champion = select_bqml_champion(
             project=project,
-            location=bq_location,
-            model=bq_model.outputs["model"],
-            table_name=f"`{bq_table}`",
-            # query_statement=f"SELECT * EXCEPT ({label}) FROM {bq_table} WHERE body_mass_g IS NOT NULL AND sex IS NOT NULL"
-            job_configuration_query={
-                "destinationTable": {
-                    "projectId": "svc-demo-vertex",
-                    "datasetId": "pipeline_us",
-                    "tableId": "results_1",
-                },
-                "createDisposition": "CREATE_IF_NEEDED",
-                "writeDisposition": "WRITE_TRUNCATE",
-            },
-        ).after(bq_model)
+            bq_location=bq_location,
+            leaderboard_table=search.outputs["leaderboard_table"],
+            run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+            metric=metric,
+        ).after(recorded)
+
+        # with a watermark column, only the rows added since the last run are
+        # scored and appended; without one, the whole table is re-scored
+        _ = predict_bqml_incremental(
+            project=project,
+            bq_location=bq_location,
+            model=champion.outputs["champion"],
+            source_table=features.outputs["feature_table"],
+            destination_table=predictions_table,
+            watermark_column=watermark_column,
+            cluster_columns=cluster_columns,
+            prune_features=prune_features,
+        )
 
+        # the exported model takes the feature columns: callers of the
+        # endpoint apply feature_transforms themselves
         bq_export = BigqueryExportModelJobOp(
             project=project,
             location=bq_location,
-            model=bq_model.outputs["model"],
+            model=champion.outputs["champion"],
             model_destination_path=artifact_uri,
-        ).after(bq_model)
+        )
+
+        # large offline scoring runs on CPUs with the exported model, without
+        # the endpoint or BigQuery slots; skipped without an input URI
+        with dsl.Condition(scoring_input_uri != "", name="offline-scoring"):
+            scoring = score_saved_model(
+                model_uri=bq_export.outputs["exported_model_path"],
+                input_uri=scoring_input_uri,
+                output_uri=scoring_output_uri,
+                input_format=scoring_input_format,
+                passthrough_columns=scoring_passthrough_columns,
+            )
+            scoring.container.set_cpu_limit(self.scoring_cpu_limit).set_memory_limit(
+                self.scoring_memory_limit
+            )
 
         import_unmanaged_model_task = importer_node.importer(
             artifact_uri=artifact_uri,
@@ -98,18 +198,20 @@ class TabularClassificationBQMLPipeline(VertexPipeline):
             unmanaged_container_model=import_unmanaged_model_task.outputs["artifact"],
         ).after(import_unmanaged_model_task)
 
+        # no .after(model_upload): the endpoint does not need the model, so it
+        # is created while the model is exported and uploaded
         endpoint = EndpointCreateOp(
             project=project,
             location=region,
             display_name=display_name,
-        ).after(model_upload)
+        )
 
         _ = ModelDeployOp(
             model=model_upload.outputs["model"],
             endpoint=endpoint.outputs["endpoint"],
-            dedicated_resources_min_replica_count=1,
-            dedicated_resources_max_replica_count=1,
-            dedicated_resources_machine_type="n1-standard-2",
+            dedicated_resources_min_replica_count=deploy_min_replica_count,
+            dedicated_resources_max_replica_count=deploy_max_replica_count,
+            dedicated_resources_machine_type=deploy_machine_type,
             traffic_split={"0": 100},
         )
 
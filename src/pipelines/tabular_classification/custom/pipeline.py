@@ -30,9 +30,18 @@ class TabularClassificationCustomPipeline(VertexPipeline):
         region: str,
         bq_dataset: str,
         bq_location: str,
+        source_format: str = "CSV",
+        schema_json: str = "",
     ) -> None:
         # Imports data to BigQuery using a custom component.
-        _ = import_csv_to_bigquery(project, bq_location, bq_dataset, gcs_input_file_uri)
+        _ = import_csv_to_bigquery(
+            project,
+            bq_location,
+            bq_dataset,
+            gcs_input_file_uri,
+            source_format=source_format,
+            schema_json=schema_json,
+        )
 
 
 if __name__ == "__main__":
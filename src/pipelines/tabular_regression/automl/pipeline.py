@@ -12,9 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from google_cloud_pipeline_components import aiplatform as gcc_aip
 from kfp.v2 import dsl
 
+from src.components.bigquery.sample import sample_training_table
+from src.components.bigquery.table_profile import profile_bigquery_table
 from src.components.metrics.automl import interpret_automl_regression_metrics
 from src.pipelines.trigger.pipeline import VertexPipeline
 
@@ -31,12 +32,43 @@ class TabularRegressionAutoMLPipeline(VertexPipeline):
         bq_table: str,
         label: str,
         display_name: str,
+        # 0 trains on the whole table
+        sample_rows: int = 0,
+        sampling_method: str = "stratified",
+        sampling_time_column: str = "",
+        validation_rules: dict = {},  # noqa: B006
+        profile_cache_table: str = "",
     ) -> None:
+        from google_cloud_pipeline_components import aiplatform as gcc_aip
+
+        # fail in minutes on bad data rather than after training
+        profile = profile_bigquery_table(
+            project=project,
+            bq_table=bq_table,
+            label=label,
+            rules=validation_rules,
+            cache_table=profile_cache_table,
+        )
+
+        # training cost scales with rows: train on a sample of large tables
+        sample = sample_training_table(
+            project=project,
+            bq_table=bq_table,
+            label=label,
+            run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+            target_rows=sample_rows,
+            method=sampling_method,
+            # a numeric label is stratified by its deciles
+            label_bins=10,
+            time_column=sampling_time_column,
+        ).after(profile)
+
         dataset_create_op = gcc_aip.TabularDatasetCreateOp(
             project=project,
             location=region,
             display_name=display_name,
-            bq_source=bq_table,
+            bq_source=sample.outputs["bq_source"],
+            labels=sample.outputs["labels"],
         )
 
         training_op = gcc_aip.AutoMLTabularTrainingJobRunOp(
@@ -49,7 +81,6 @@ class TabularRegressionAutoMLPipeline(VertexPipeline):
         )
 
         _ = interpret_automl_regression_metrics(
-            project,
             region,
             training_op.outputs["model"],
         )
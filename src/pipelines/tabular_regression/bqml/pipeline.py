@@ -12,13 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from google_cloud_pipeline_components.v1.bigquery import (
-    BigqueryCreateModelJobOp,
-    BigqueryEvaluateModelJobOp,
-    BigqueryPredictModelJobOp,
-)
 from kfp.v2 import dsl
 
+from src.components.bigquery.bq_predict import predict_bqml_incremental
+from src.components.bigquery.bqml_search import (
+    bqml_candidates,
+    record_bqml_candidate,
+    select_bqml_champion,
+)
+from src.components.bigquery.features import materialize_features
+from src.components.bigquery.table_profile import profile_bigquery_table
 from src.components.metrics.bqml import interpret_bqml_evaluation_metrics
 from src.pipelines.trigger.pipeline import VertexPipeline
 
@@ -26,6 +29,8 @@ from src.pipelines.trigger.pipeline import VertexPipeline
 class TabularRegressionBQMLPipeline(VertexPipeline):
 
     display_name = "tabular_regression_bqml_pipeline"
+    # candidate models trained at the same time by the model search
+    search_parallelism = 4
 
     @dsl.pipeline(name="tabular-regression-bqml-pipeline")
     def pipeline(
@@ -36,37 +41,101 @@ class TabularRegressionBQMLPipeline(VertexPipeline):
         bq_table: str,
         label: str,
         model: str,
+        predictions_table: str = "svc-demo-vertex.pipeline_us.results_abalone",
+        watermark_column: str = "",
+        cluster_columns: str = "",
+        prune_features: bool = False,
+        candidates: list = [{"model_type": "BOOSTED_TREE_REGRESSOR"}],  # noqa: B006
+        metric: str = "mean_absolute_error",
+        leaderboard_table: str = "",
+        validation_rules: dict = {},  # noqa: B006
+        profile_cache_table: str = "",
+        feature_transforms: dict = {},  # noqa: B006
+        feature_drop_columns: str = "",
+        feature_partition_column: str = "",
     ) -> None:
-        bq_model = BigqueryCreateModelJobOp(
+        from google_cloud_pipeline_components.v1.bigquery import (
+            BigqueryCreateModelJobOp,
+            BigqueryEvaluateModelJobOp,
+        )
+
+        # fail in minutes on bad data rather than after training
+        profile = profile_bigquery_table(
             project=project,
-            location=bq_location,
-            query=f"CREATE OR REPLACE MODEL {model} OPTIONS (model_type='BOOSTED_TREE_REGRESSOR', labels=['{label}']) AS SELECT * FROM `{bq_table}`",
+            bq_table=bq_table,
+            label=label,
+            rules=validation_rules,
+            cache_table=profile_cache_table,
         )
 
-        bq_eval_model_op = BigqueryEvaluateModelJobOp(
-            project=project, location=bq_location, model=bq_model.outputs["model"]
-        ).after(bq_model)
+        # features are materialized once per snapshot of the table, and
+        # shared by every model trained on it, in this pipeline or another
+        features = materialize_features(
+            project=project,
+            bq_table=bq_table,
+            transforms=feature_transforms,
+            drop_columns=feature_drop_columns,
+            partition_column=feature_partition_column,
+        ).after(profile)
 
-        _ = interpret_bqml_evaluation_metrics(
-            bq_eval_model_op.outputs["evaluation_metrics"]
+        # every candidate is trained and evaluated, concurrently, and only
+        # the best one by `metric` is used for prediction
+        search = bqml_candidates(
+            project=project,
+            model=model,
+            bq_table=features.outputs["feature_table"],
+            label=label,
+            candidates=candidates,
+            leaderboard_table=leaderboard_table,
         )
 
-        _ = BigqueryPredictModelJobOp(
+        with dsl.ParallelFor(
+            search.outputs["candidates"], parallelism=self.search_parallelism
+        ) as candidate:
+            bq_model = BigqueryCreateModelJobOp(
+                project=project,
+                location=bq_location,
+                query=candidate.query,
+            )
+
+            bq_eval_model_op = BigqueryEvaluateModelJobOp(
+                project=project, location=bq_location, model=bq_model.outputs["model"]
+            )
+
+            evaluation = interpret_bqml_evaluation_metrics(
+                bq_eval_model_op.outputs["evaluation_metrics"]
+            )
+
+            recorded = record_bqml_candidate(
+                project=project,
+                bq_location=bq_location,
+                leaderboard_table=search.outputs["leaderboard_table"],
+                run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+                candidate=candidate.name,
+                model=bq_model.outputs["model"],
+                metrics=evaluation.outputs["metrics"],
+            )
+
+        champion = select_bqml_champion(
             project=project,
-            location=bq_location,
-            model=bq_model.outputs["model"],
-            table_name=f"`{bq_table}`",
-            # query_statement=f"SELECT * EXCEPT ({label}) FROM {bq_table} WHERE body_mass_g IS NOT NULL AND sex IS NOT NULL"
-            job_configuration_query={
-                "destinationTable": {
-                    "projectId": "svc-demo-vertex",
-                    "datasetId": "pipeline_us",
-                    "tableId": "results_abalone",
-                },
-                "createDisposition": "CREATE_IF_NEEDED",
-                "writeDisposition": "WRITE_TRUNCATE",
-            },
-        ).after(bq_model)
+            bq_location=bq_location,
+            leaderboard_table=search.outputs["leaderboard_table"],
+            run_id=dsl.PIPELINE_JOB_ID_PLACEHOLDER,
+            metric=metric,
+        ).after(recorded)
+
+        # with a watermark column, only the rows added since the last run are
+        # scored and appended; without one, the whole table is re-scored
+        _ = predict_bqml_incremental(
+            project=project,
+            bq_location=bq_location,
+            model=champion.outputs["champion"],
+            source_table=features.outputs["feature_table"],
+            destination_table=predictions_table,
+            watermark_column=watermark_column,
+            cluster_columns=cluster_columns,
+            prune_features=prune_features,
+        )
 
 
 if __name__ == "__main__":
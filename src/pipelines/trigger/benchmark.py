@@ -0,0 +1,438 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmark pipeline compilation, module import and metric interpretation.
+
+Measures, per pipeline, the compile time (compile cache disabled), the size of
+the compiled spec and the import time of its module; and the run time of the
+metric interpreter components on synthetic payloads of growing size. Results
+are written as a JSON baseline that a later run is compared against.
+
+    python -m src.pipelines.trigger.benchmark run --output baseline.json
+    python -m src.pipelines.trigger.benchmark compare --baseline baseline.json
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import functools
+import importlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import types
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from unittest import mock
+
+from src.pipelines.trigger import compile_all, importtime
+
+SIZES = {"small": 100, "medium": 10_000, "large": 200_000}
+SUITES = ("compile", "import", "metrics")
+
+# Differences below these are noise whatever their ratio
+_min_delta = {"s": 0.005, "ms": 20.0, "bytes": 0.0}
+
+
+@dataclasses.dataclass
+class Comparison:
+    name: str
+    unit: str
+    baseline: Optional[float]
+    current: Optional[float]
+    regressed: bool = False
+
+    @property
+    def ratio(self) -> Optional[float]:
+        if not self.baseline or self.current is None:
+            return None
+        return self.current / self.baseline
+
+
+def _min_seconds(fn: Callable[[], Any], repeat: int) -> float:
+    """Fastest of `repeat` runs: the least noisy estimate of the cost of `fn`"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _result(value: float, unit: str) -> Dict[str, Any]:
+    return {"value": value, "unit": unit}
+
+
+def bench_compile(modules: List[str], repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    """Compile time and spec size of every pipeline of the given modules"""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for module_name in modules:
+            classes = compile_all.pipeline_classes(importlib.import_module(module_name))
+            for pipeline_cls in classes:
+                name = compile_all._template_name(
+                    module_name, pipeline_cls.__name__, len(classes)
+                )[: -len(".json")]
+                path = os.path.join(tmp, f"{name}.json")
+                pipeline = pipeline_cls()
+                seconds = _min_seconds(
+                    functools.partial(pipeline.compile_pipeline, path, use_cache=False),
+                    repeat,
+                )
+                results[f"compile/{name}"] = _result(seconds, "s")
+                results[f"spec_size/{name}"] = _result(
+                    float(os.path.getsize(path)), "bytes"
+                )
+    return results
+
+
+def bench_import(modules: List[str], repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    """Import time of each module, in fresh interpreters"""
+    return {
+        f"import/{module}": _result(importtime.measure(module, repeat).total_ms, "ms")
+        for module in modules
+    }
+
+
+def bqml_rows(n_rows: int, seed: int = 0) -> Dict[str, Any]:
+    """BigQuery rows shaped like ML.ARIMA_EVALUATE: one row per time series"""
+    rng = random.Random(seed)  # noqa: S311 - synthetic data
+    fields = [
+        {"name": "series_id", "type": "STRING"},
+        {"name": "non_seasonal_p", "type": "INTEGER"},
+        {"name": "has_drift", "type": "BOOLEAN"},
+        {"name": "log_likelihood", "type": "FLOAT"},
+        {"name": "AIC", "type": "FLOAT"},
+        {"name": "variance", "type": "FLOAT"},
+    ]
+    rows = []
+    for i in range(n_rows):
+        aic = rng.uniform(100, 1000)
+        rows.append(
+            {
+                "f": [
+                    {"v": f"series_{i}"},
+                    {"v": str(rng.randint(0, 5))},
+                    {"v": "true" if i % 2 else "false"},
+                    {"v": str(-aic / 2)},
+                    {"v": str(aic)},
+                    {"v": str(rng.uniform(0, 10))},
+                ]
+            }
+        )
+    return {"schema": {"fields": fields}, "rows": rows}
+
+
+def automl_classification_metrics(n_thresholds: int) -> Dict[str, Any]:
+    """AutoML classification metrics with `n_thresholds` confidence metrics"""
+    confidence_metrics = []
+    for i in range(n_thresholds):
+        threshold = i / max(n_thresholds - 1, 1)
+        confidence_metrics.append(
+            {
+                "confidenceThreshold": threshold,
+                "falsePositiveRate": (1 - threshold) ** 3,
+                "recall": 1 - threshold**3,
+                "precision": 0.9,
+                "f1Score": 0.8,
+            }
+        )
+    return {
+        "auRoc": 0.92,
+        "auPrc": 0.9,
+        "logLoss": 0.3,
+        "confidenceMetrics": confidence_metrics,
+        "confusionMatrix": {
+            "annotationSpecs": [{"displayName": "a"}, {"displayName": "b"}],
+            "rows": [[90, 10], [5, 95]],
+        },
+    }
+
+
+def automl_regression_metrics() -> Dict[str, Any]:
+    return {
+        "meanAbsoluteError": 1.5,
+        "meanAbsolutePercentageError": 15.0,
+        "rSquared": 0.6,
+        "rootMeanSquaredError": 2.1,
+        "rootMeanSquaredLogError": 0.2,
+    }
+
+
+class _FakeModelService:
+    """Serves one precomputed evaluation, so no API call is made"""
+
+    def __init__(self, metrics: Dict[str, Any]) -> None:
+        from google.protobuf import json_format, struct_pb2
+
+        self._evaluation = types.SimpleNamespace(
+            name="projects/p/locations/l/models/1/evaluations/1",
+            metrics_schema_uri="gs://benchmark",
+            _pb=types.SimpleNamespace(
+                metrics=json_format.ParseDict(metrics, struct_pb2.Value())
+            ),
+        )
+
+    def list_model_evaluations(self, request: Dict[str, Any]) -> List[Any]:
+        return [self._evaluation]
+
+    def get_model_evaluation(self, name: str) -> Any:
+        return self._evaluation
+
+
+def bench_metrics(sizes: Dict[str, int], repeat: int = 3) -> Dict[str, Dict[str, Any]]:
+    """Run time of the metric interpreter components on synthetic payloads"""
+    from kfp.v2.dsl import Artifact, ClassificationMetrics, Metrics
+
+    from src.components.metrics.automl import (
+        interpret_automl_classification_metrics,
+        interpret_automl_regression_metrics,
+    )
+    from src.components.metrics.bqml import interpret_bqml_evaluation_metrics
+
+    model = Artifact()
+    model.metadata["resourceName"] = "projects/p/locations/l/models/1"
+
+    def patched_service(metrics: Dict[str, Any]) -> contextlib.ExitStack:
+        stack = contextlib.ExitStack()
+        stack.enter_context(mock.patch("google.cloud.aiplatform.init"))
+        stack.enter_context(
+            mock.patch(
+                "google.cloud.aiplatform.gapic.ModelServiceClient",
+                return_value=_FakeModelService(metrics),
+            )
+        )
+        return stack
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(
+        io.StringIO()
+    ):
+        for size_name, size in sizes.items():
+            evaluation = Artifact()
+            evaluation.metadata.update(bqml_rows(size))
+            # Artifact.path only maps gs:// URIs, write the table locally
+            table = types.SimpleNamespace(
+                path=os.path.join(tmp, "evaluation.parquet"), metadata={}
+            )
+            results[f"metrics/bqml/{size_name}"] = _result(
+                _min_seconds(
+                    functools.partial(
+                        interpret_bqml_evaluation_metrics.python_func,
+                        evaluation,
+                        Metrics(),
+                        table,
+                    ),
+                    repeat,
+                ),
+                "s",
+            )
+
+            with patched_service(automl_classification_metrics(size)):
+                results[f"metrics/automl_classification/{size_name}"] = _result(
+                    _min_seconds(
+                        lambda: interpret_automl_classification_metrics.python_func(
+                            "l", model, Metrics(), ClassificationMetrics()
+                        ),
+                        repeat,
+                    ),
+                    "s",
+                )
+
+        # fixed-size payload: regression evaluations have no per-threshold data
+        with patched_service(automl_regression_metrics()):
+            results["metrics/automl_regression"] = _result(
+                _min_seconds(
+                    lambda: interpret_automl_regression_metrics.python_func(
+                        "l", model, Metrics()
+                    ),
+                    repeat,
+                ),
+                "s",
+            )
+    return results
+
+
+def run(
+    suites: Sequence[str] = SUITES,
+    modules: Optional[List[str]] = None,
+    sizes: Optional[Dict[str, int]] = None,
+    repeat: int = 3,
+) -> Dict[str, Any]:
+    """Run the benchmark suites and return a baseline document"""
+    modules = compile_all.discover_pipeline_modules() if modules is None else modules
+    results: Dict[str, Dict[str, Any]] = {}
+    if "compile" in suites:
+        results.update(bench_compile(modules, repeat))
+    if "import" in suites:
+        results.update(bench_import(modules, repeat))
+    if "metrics" in suites:
+        results.update(bench_metrics(SIZES if sizes is None else sizes, repeat))
+
+    from importlib.metadata import version
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "kfp": version("kfp"),
+        },
+        "results": results,
+    }
+
+
+def save(document: Dict[str, Any], path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(
+    current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = 0.2
+) -> List[Comparison]:
+    """Flag the results more than `threshold` (relative) worse than the baseline
+
+    Every benchmark is lower-is-better. Benchmarks only present on one side
+    are listed but never flagged.
+    """
+    current_results, baseline_results = current["results"], baseline["results"]
+    comparisons = []
+    for name in sorted(set(current_results) | set(baseline_results)):
+        new, old = current_results.get(name), baseline_results.get(name)
+        unit = (new or old)["unit"]
+        comparison = Comparison(
+            name=name,
+            unit=unit,
+            baseline=old["value"] if old else None,
+            current=new["value"] if new else None,
+        )
+        if comparison.current is not None and comparison.baseline:
+            delta = comparison.current - comparison.baseline
+            comparison.regressed = delta > comparison.baseline * threshold and (
+                delta > _min_delta.get(unit, 0.0)
+            )
+        comparisons.append(comparison)
+    return comparisons
+
+
+def format_comparison(comparisons: List[Comparison]) -> str:
+    """Render a baseline vs current table, regressions marked"""
+
+    def cell(value: Optional[float], unit: str) -> str:
+        if value is None:
+            return "-"
+        if unit == "s":
+            return f"{value * 1000:.1f} ms"
+        return f"{value:.0f} {unit}"
+
+    rows = [("benchmark", "baseline", "current", "change", "")]
+    for c in comparisons:
+        rows.append(
+            (
+                c.name,
+                cell(c.baseline, c.unit),
+                cell(c.current, c.unit),
+                f"{(c.ratio - 1) * 100:+.0f}%" if c.ratio is not None else "",
+                "REGRESSION" if c.regressed else "",
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(cell.ljust(w) for cell, w in zip(row, widths)) for row in rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    regressions = sum(c.regressed for c in comparisons)
+    lines.append(f"{regressions} regression(s)")
+    return "\n".join(line.rstrip() for line in lines)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark the pipelines")
+    commands = parser.add_subparsers(help="commands", dest="command", required=True)
+
+    cmd_run = commands.add_parser("run", help="run the benchmarks.")
+    cmd_compare = commands.add_parser(
+        "compare", help="run the benchmarks (or load --current) and compare."
+    )
+    for cmd in (cmd_run, cmd_compare):
+        cmd.add_argument(
+            "--suites",
+            nargs="+",
+            choices=SUITES,
+            default=list(SUITES),
+            help="benchmark suites to run.",
+        )
+        cmd.add_argument(
+            "--sizes",
+            nargs="+",
+            choices=list(SIZES),
+            default=list(SIZES),
+            help="payload sizes of the metrics suite.",
+        )
+        cmd.add_argument("--repeat", type=int, default=3, help="runs per benchmark.")
+        cmd.add_argument(
+            "--modules",
+            nargs="*",
+            default=None,
+            help="pipeline modules (default: all).",
+        )
+    cmd_run.add_argument("--output", help="JSON file to write the results to.")
+
+    cmd_compare.add_argument(
+        "--baseline", required=True, help="JSON baseline to compare against."
+    )
+    cmd_compare.add_argument(
+        "--current", help="JSON results to compare, instead of running."
+    )
+    cmd_compare.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative slowdown flagged as a regression.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(args: argparse.Namespace) -> int:
+    if args.command == "compare" and args.current:
+        current = load(args.current)
+    else:
+        current = run(
+            args.suites,
+            args.modules,
+            {name: SIZES[name] for name in args.sizes},
+            args.repeat,
+        )
+
+    if args.command == "run":
+        if args.output:
+            save(current, args.output)
+        print(json.dumps(current, indent=2, sort_keys=True))
+        return 0
+
+    comparisons = compare(current, load(args.baseline), args.threshold)
+    print(format_comparison(comparisons))
+    return 1 if any(c.regressed for c in comparisons) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,211 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compile every VertexPipeline under src/pipelines in a process pool.
+
+    python -m src.pipelines.trigger.compile_all --output_dir templates
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import dataclasses
+import importlib
+import inspect
+import os
+import pathlib
+import sys
+import time
+import traceback
+from types import ModuleType
+from typing import List, Optional
+
+_pipelines_dir = pathlib.Path(__file__).resolve().parents[1]
+_pipelines_package = "src.pipelines"
+_excluded_packages = ("trigger",)
+
+
+@dataclasses.dataclass
+class CompileResult:
+    module: str
+    pipeline: str
+    template_path: Optional[str]
+    seconds: float
+    error: Optional[str] = None
+
+
+def discover_pipeline_modules(
+    pipelines_dir: pathlib.Path = _pipelines_dir,
+) -> List[str]:
+    """List the `pipeline` modules under src/pipelines, e.g. src.pipelines.forecasting.bqml.pipeline"""
+    modules = []
+    for path in sorted(pipelines_dir.glob("**/pipeline.py")):
+        parts = path.relative_to(pipelines_dir).with_suffix("").parts
+        if parts[0] in _excluded_packages:
+            continue
+        modules.append(".".join((_pipelines_package,) + parts))
+    return modules
+
+
+def _template_name(module_name: str, class_name: str, n_classes: int) -> str:
+    # same naming as scripts/compile.sh: <group>_<variant>.json
+    parts = module_name.split(".")[2:-1]
+    if n_classes > 1:
+        parts.append(class_name)
+    return "_".join(parts) + ".json"
+
+
+def pipeline_classes(module: ModuleType) -> List[type]:
+    """The VertexPipeline subclasses defined (not imported) in a module"""
+    from src.pipelines.trigger.pipeline import VertexPipeline
+
+    return [
+        obj
+        for obj in vars(module).values()
+        if inspect.isclass(obj)
+        and issubclass(obj, VertexPipeline)
+        and obj is not VertexPipeline
+        and obj.__module__ == module.__name__
+    ]
+
+
+def compile_module(
+    module_name: str, output_dir: str, use_cache: bool = True
+) -> List[CompileResult]:
+    """Import a pipeline module and compile every VertexPipeline defined in it"""
+    start = time.perf_counter()
+    try:
+        module = importlib.import_module(module_name)
+    except Exception:
+        return [
+            CompileResult(
+                module=module_name,
+                pipeline="-",
+                template_path=None,
+                seconds=time.perf_counter() - start,
+                error=traceback.format_exc(),
+            )
+        ]
+
+    classes = pipeline_classes(module)
+
+    results = []
+    for pipeline_cls in classes:
+        template_path = os.path.join(
+            output_dir, _template_name(module_name, pipeline_cls.__name__, len(classes))
+        )
+        error = None
+        try:
+            pipeline_cls().compile_pipeline(template_path, use_cache=use_cache)
+        except Exception:
+            error = traceback.format_exc()
+        results.append(
+            CompileResult(
+                module=module_name,
+                pipeline=pipeline_cls.__name__,
+                template_path=template_path,
+                seconds=time.perf_counter() - start,
+                error=error,
+            )
+        )
+        start = time.perf_counter()
+    return results
+
+
+def compile_all(
+    output_dir: str,
+    modules: Optional[List[str]] = None,
+    max_workers: Optional[int] = None,
+    use_cache: bool = True,
+) -> List[CompileResult]:
+    """Compile the given (default: all discovered) pipeline modules in parallel"""
+    modules = discover_pipeline_modules() if modules is None else modules
+    os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(compile_module, module_name, output_dir, use_cache)
+            for module_name in modules
+        ]
+        return [result for future in futures for result in future.result()]
+
+
+def format_report(results: List[CompileResult]) -> str:
+    """Render a per-pipeline timing table"""
+    rows = [("pipeline", "seconds", "status", "template")]
+    for r in sorted(results, key=lambda r: r.seconds, reverse=True):
+        rows.append(
+            (
+                r.pipeline if r.pipeline != "-" else r.module,
+                f"{r.seconds:.2f}",
+                "FAILED" if r.error else "ok",
+                r.template_path or "",
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(cell.ljust(w) for cell, w in zip(row, widths)) for row in rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    return "\n".join(line.rstrip() for line in lines)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description="Compile every Vertex Pipeline under src/pipelines"
+    )
+    parser.add_argument(
+        "--output_dir",
+        default=".",
+        help="directory for the compiled pipeline package files.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of compile processes (default: number of CPUs).",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="always recompile, ignoring the compile cache.",
+    )
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        help="pipeline modules to compile (default: all).",
+    )
+    return parser.parse_args()
+
+
+def main(args: argparse.Namespace) -> int:
+    start = time.perf_counter()
+    results = compile_all(
+        args.output_dir,
+        modules=args.modules or None,
+        max_workers=args.workers,
+        use_cache=not args.no_cache,
+    )
+    print(format_report(results))
+
+    failures = [r for r in results if r.error]
+    for r in failures:
+        print(f"\n{r.module} ({r.pipeline}) failed:\n{r.error}", file=sys.stderr)
+    print(
+        f"\n{len(results) - len(failures)}/{len(results)} pipelines compiled "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,146 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Content-addressed cache of compiled pipeline specs.
+
+A compiled spec only depends on the source of the pipeline module, the sources
+of the `src` modules it imports (transitively), the public attributes of the
+pipeline object (e.g. `search_parallelism`) and the installed KFP/GCPC
+versions. The cache key is a hash of all of these, so an unchanged pipeline
+can be served from disk without invoking the KFP compiler.
+"""
+
+import ast
+import hashlib
+import importlib.metadata
+import importlib.util
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
+
+CACHE_DIR_ENV = "VERTEX_MLOPS_COMPILE_CACHE"
+
+_default_cache_dir = pathlib.Path.home() / ".cache" / "vertex-mlops" / "compile"
+_versioned_packages = ("kfp", "google-cloud-pipeline-components")
+_source_package = "src"
+
+
+def cache_dir() -> pathlib.Path:
+    """Return the cache directory, overridable with VERTEX_MLOPS_COMPILE_CACHE"""
+    return pathlib.Path(os.environ.get(CACHE_DIR_ENV, _default_cache_dir))
+
+
+def _package_version(name: str) -> str:
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return "not-installed"
+
+
+def _module_path(module_name: str) -> Optional[pathlib.Path]:
+    try:
+        spec = importlib.util.find_spec(module_name)
+    except ModuleNotFoundError:
+        return None
+    if spec is None or not spec.origin or not spec.has_location:
+        return None
+    return pathlib.Path(spec.origin)
+
+
+def _in_source_package(module_name: str) -> bool:
+    return module_name.split(".")[0] == _source_package
+
+
+def _source_imports(source: str) -> List[str]:
+    """List the `src` modules imported anywhere in `source`"""
+    modules = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.ImportFrom) and node.module:
+            if _in_source_package(node.module):
+                modules.add(node.module)
+                # `from src.components.x import module` imports a submodule
+                for alias in node.names:
+                    modules.add(f"{node.module}.{alias.name}")
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                if _in_source_package(alias.name):
+                    modules.add(alias.name)
+    return sorted(modules)
+
+
+def _public_attributes(pipeline: Any) -> Dict[str, Any]:
+    """Settings of a pipeline object, e.g. `search_parallelism`, set per instance"""
+    return {
+        name: getattr(pipeline, name)
+        for name in dir(pipeline)
+        if not name.startswith("_") and not callable(getattr(pipeline, name))
+    }
+
+
+def cache_key(pipeline: Any) -> str:
+    """Hash the sources, settings and library versions a compiled spec depends on"""
+    pipeline_cls = type(pipeline)
+    digest = hashlib.sha256()
+    for package in _versioned_packages:
+        digest.update(f"{package}=={_package_version(package)}\n".encode())
+    digest.update(
+        json.dumps(_public_attributes(pipeline), sort_keys=True, default=repr).encode()
+    )
+
+    # the pipeline class and the VertexPipeline base(s) it derives from
+    module_names = sorted(
+        {klass.__module__ for klass in pipeline_cls.__mro__ if klass is not object}
+    )
+    digest.update(pipeline_cls.__qualname__.encode())
+
+    seen = set()
+    while module_names:
+        module_name = module_names.pop(0)
+        path = _module_path(module_name)
+        if module_name in seen or path is None:
+            continue
+        seen.add(module_name)
+        source = path.read_text()
+        digest.update(f"\n# {module_name}\n".encode())
+        digest.update(source.encode())
+        module_names.extend(_source_imports(source))
+
+    return digest.hexdigest()
+
+
+def get(key: str) -> Optional[pathlib.Path]:
+    """Return the cached spec for `key`, if any"""
+    path = cache_dir() / f"{key}.json"
+    return path if path.is_file() else None
+
+
+def put(key: str, package_path: str) -> pathlib.Path:
+    """Store a compiled spec under `key`"""
+    directory = cache_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{key}.json"
+    # write then rename so concurrent compiles never read a partial spec
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as f:
+        tmp_path = f.name
+    shutil.copyfile(package_path, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def clear() -> None:
+    """Remove every cached spec"""
+    shutil.rmtree(cache_dir(), ignore_errors=True)
@@ -0,0 +1,263 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Find the critical path of a compiled pipeline, and false serialization.
+
+Every dependency of a task is either a data edge (it consumes an output of
+the upstream task) or an explicit `.after()` edge. An explicit edge whose
+removal would shorten the critical path is reported: either the ordering is
+really needed (e.g. the upstream task writes files the downstream one
+reads), or it serializes work that could run in parallel.
+
+Task durations come from a JSON file of seconds keyed by task or component
+name (e.g. measured on past runs), falling back to typical durations.
+
+    python -m src.pipelines.trigger.dag_analysis --template_path pipeline.json
+"""
+
+import argparse
+import dataclasses
+import json
+import re
+import sys
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Typical durations in seconds, container start-up included
+DEFAULT_DURATIONS = {
+    "automl-forecasting-training-job": 3600.0,
+    "automl-tabular-training-job": 3600.0,
+    "bigquery-create-model-job": 1800.0,
+    "bigquery-evaluate-model-job": 60.0,
+    "bigquery-explain-forecast-model-job": 120.0,
+    "bigquery-export-model-job": 300.0,
+    "bigquery-ml-arima-evaluate-job": 60.0,
+    "bigquery-predict-model-job": 90.0,
+    "bigquery-query-job": 60.0,
+    "endpoint-create": 60.0,
+    "import-csv-to-bigquery": 90.0,
+    "importer": 5.0,
+    "materialize-features": 120.0,
+    "model-batch-predict": 1200.0,
+    "model-deploy": 900.0,
+    "model-upload": 180.0,
+    "predict-bqml-incremental": 90.0,
+    "profile-bigquery-table": 60.0,
+    "sample-training-table": 120.0,
+    "score-saved-model": 600.0,
+    "tabular-dataset-create": 60.0,
+    "time-series-dataset-create": 60.0,
+}
+_default_duration = 60.0
+
+Edge = Tuple[str, str]
+
+
+@dataclasses.dataclass
+class ExplicitEdge:
+    upstream: str
+    downstream: str
+    # critical path shortening if the edge were removed
+    savings: float
+
+
+@dataclasses.dataclass
+class DagAnalysis:
+    durations: Dict[str, float]
+    makespan: float
+    critical_path: List[str]
+    explicit_edges: List[ExplicitEdge]
+
+    def false_serialization(self, min_savings: float = 0.0) -> List[ExplicitEdge]:
+        """Explicit edges that lengthen the critical path by more than `min_savings`"""
+        return [e for e in self.explicit_edges if e.savings > min_savings]
+
+    def format(self) -> str:
+        lines = [f"estimated duration: {self.makespan / 60:.1f} min", "critical path:"]
+        lines += [
+            f"  {task} ({self.durations[task] / 60:.1f} min)"
+            for task in self.critical_path
+        ]
+        if self.explicit_edges:
+            lines.append("explicit .after() dependencies (no data edge):")
+        for e in self.explicit_edges:
+            impact = (
+                f"lengthens the critical path by {e.savings / 60:.1f} min"
+                if e.savings > 0
+                else "not on the critical path"
+            )
+            lines.append(f"  {e.upstream} -> {e.downstream}: {impact}")
+        return "\n".join(lines)
+
+
+def _component_name(task: Dict[str, Any]) -> str:
+    name = task["componentRef"]["name"]
+    return re.sub(r"-\d+$", "", name[len("comp-") :])
+
+
+def task_durations(
+    tasks: Dict[str, Any],
+    durations: Optional[Dict[str, float]] = None,
+    components: Optional[Dict[str, Any]] = None,
+) -> Dict[str, float]:
+    """Duration of each task: by task name, else component name, else default
+
+    A task running a sub-DAG (e.g. a ParallelFor) takes the critical path of
+    the sub-DAG, assuming loop iterations run concurrently.
+    """
+    durations = durations or {}
+    components = components or {}
+    result = {}
+    for name, task in tasks.items():
+        component = _component_name(task)
+        dag = components.get(task["componentRef"]["name"], {}).get("dag")
+        if dag and name not in durations:
+            sub_tasks = dag.get("tasks", {})
+            result[name], _ = critical_path(
+                task_durations(sub_tasks, durations, components),
+                edges(sub_tasks)[0],
+            )
+            continue
+        result[name] = float(
+            durations.get(
+                name,
+                durations.get(
+                    component, DEFAULT_DURATIONS.get(component, _default_duration)
+                ),
+            )
+        )
+    return result
+
+
+def edges(tasks: Dict[str, Any]) -> Tuple[Set[Edge], Set[Edge]]:
+    """All dependency edges, and the data edges among them"""
+    all_edges, data_edges = set(), set()
+    for name, task in tasks.items():
+        for upstream in task.get("dependentTasks", []):
+            all_edges.add((upstream, name))
+        inputs = task.get("inputs", {})
+        for spec in list(inputs.get("parameters", {}).values()) + list(
+            inputs.get("artifacts", {}).values()
+        ):
+            source = spec.get("taskOutputParameter") or spec.get("taskOutputArtifact")
+            if source:
+                data_edges.add((source["producerTask"], name))
+    return all_edges | data_edges, data_edges
+
+
+def critical_path(
+    durations: Dict[str, float], dependencies: Set[Edge]
+) -> Tuple[float, List[str]]:
+    """Longest path through the DAG, weighted by task durations"""
+    predecessors: Dict[str, List[str]] = {task: [] for task in durations}
+    for upstream, downstream in dependencies:
+        predecessors[downstream].append(upstream)
+
+    finish: Dict[str, float] = {}
+    via: Dict[str, Optional[str]] = {}
+
+    def visit(task: str, visiting: frozenset) -> float:
+        if task in finish:
+            return finish[task]
+        if task in visiting:
+            raise ValueError(f"Dependency cycle through {task}")
+        start, via[task] = 0.0, None
+        for upstream in predecessors[task]:
+            upstream_finish = visit(upstream, visiting | {task})
+            if upstream_finish > start:
+                start, via[task] = upstream_finish, upstream
+        finish[task] = start + durations[task]
+        return finish[task]
+
+    for task in sorted(durations):
+        visit(task, frozenset())
+    if not finish:
+        return 0.0, []
+
+    last = max(sorted(finish), key=finish.__getitem__)
+    path = [last]
+    previous = via[last]
+    while previous is not None:
+        path.append(previous)
+        previous = via[previous]
+    return finish[last], path[::-1]
+
+
+def analyze(
+    spec: Dict[str, Any], durations: Optional[Dict[str, float]] = None
+) -> DagAnalysis:
+    """Critical path of the root DAG, and the impact of each explicit edge"""
+    tasks = spec["pipelineSpec"]["root"]["dag"]["tasks"]
+    task_seconds = task_durations(
+        tasks, durations, spec["pipelineSpec"].get("components")
+    )
+    dependencies, data_edges = edges(tasks)
+    makespan, path = critical_path(task_seconds, dependencies)
+
+    explicit_edges = []
+    for edge in sorted(dependencies - data_edges):
+        without, _ = critical_path(task_seconds, dependencies - {edge})
+        explicit_edges.append(ExplicitEdge(*edge, savings=makespan - without))
+    return DagAnalysis(
+        durations=task_seconds,
+        makespan=makespan,
+        critical_path=path,
+        explicit_edges=explicit_edges,
+    )
+
+
+def analyze_template(
+    template_path: str, durations_path: Optional[str] = None
+) -> DagAnalysis:
+    with open(template_path) as f:
+        spec = json.load(f)
+    durations = None
+    if durations_path:
+        with open(durations_path) as f:
+            durations = json.load(f)
+    return analyze(spec, durations)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description="Critical path and false serialization of a compiled pipeline"
+    )
+    parser.add_argument(
+        "--template_path",
+        required=True,
+        help="path to compiled pipeline package file.",
+    )
+    parser.add_argument(
+        "--durations",
+        default=None,
+        help="JSON file of task durations in seconds, by task or component name.",
+    )
+    parser.add_argument(
+        "--min_savings",
+        type=float,
+        default=0.0,
+        help="fail if an explicit dependency lengthens the critical path by more "
+        "than this many seconds.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(args: argparse.Namespace) -> int:
+    analysis = analyze_template(args.template_path, args.durations)
+    print(analysis.format())
+    return 1 if analysis.false_serialization(args.min_savings) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,127 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure module import time with `python -X importtime`.
+
+    python -m src.pipelines.trigger.importtime --budget_ms 1500 \\
+        src.pipelines.tabular_classification.bqml.pipeline
+"""
+
+import argparse
+import dataclasses
+import pathlib
+import subprocess  # noqa: S404
+import sys
+from typing import Dict, List, Optional, Set
+
+_repo_root = pathlib.Path(__file__).resolve().parents[3]
+
+
+@dataclasses.dataclass
+class ImportProfile:
+    module: str
+    total_us: int
+    # cumulative import time of every module loaded, in microseconds
+    modules: Dict[str, int]
+
+    @property
+    def total_ms(self) -> float:
+        return self.total_us / 1000
+
+    def top(self, n: int = 10) -> List[str]:
+        """Return the `n` slowest top-level packages"""
+        packages: Dict[str, int] = {}
+        for name, us in self.modules.items():
+            root = name.split(".")[0]
+            if root in ("site", self.module.split(".")[0]):
+                continue
+            packages[root] = max(packages.get(root, 0), us)
+        return sorted(packages, key=packages.__getitem__, reverse=True)[:n]
+
+
+def parse_importtime(module: str, stderr: str) -> ImportProfile:
+    """Parse the `import time: self | cumulative | name` lines of -X importtime"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # header line
+        modules[name.strip()] = int(cumulative)
+    return ImportProfile(
+        module=module, total_us=modules.get(module, 0), modules=modules
+    )
+
+
+def measure(module: str, repeat: int = 3) -> ImportProfile:
+    """Import `module` in fresh interpreters and return the fastest run"""
+    profiles = []
+    for _ in range(repeat):
+        completed = subprocess.run(  # noqa: S603
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=_repo_root,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        profiles.append(parse_importtime(module, completed.stderr))
+    return min(profiles, key=lambda p: p.total_us)
+
+
+def imported_modules(module: str) -> Set[str]:
+    """Names in `sys.modules` once `module` is imported in a fresh interpreter"""
+    completed = subprocess.run(  # noqa: S603
+        [
+            sys.executable,
+            "-c",
+            f"import sys, {module}; print('\\n'.join(sys.modules))",
+        ],
+        cwd=_repo_root,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(completed.stdout.split())
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(description="Measure module import time")
+    parser.add_argument("modules", nargs="+", help="modules to import.")
+    parser.add_argument(
+        "--budget_ms",
+        type=float,
+        default=None,
+        help="fail if a module takes longer than this to import.",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per module.")
+    return parser.parse_args(argv)
+
+
+def main(args: argparse.Namespace) -> int:
+    over_budget = False
+    for module in args.modules:
+        profile = measure(module, repeat=args.repeat)
+        status = ""
+        if args.budget_ms is not None and profile.total_ms > args.budget_ms:
+            over_budget = True
+            status = f"  OVER BUDGET ({args.budget_ms:.0f} ms)"
+        print(f"{module}: {profile.total_ms:.0f} ms{status}")
+        print(f"  slowest packages: {', '.join(profile.top(5))}")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,510 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Load-test a prediction endpoint and recommend its deployment resources.
+
+A load test sends predict requests at rising concurrency, to a Vertex AI
+endpoint or to any HTTP server taking `{"instances": [...]}` (e.g. `serve`,
+which serves an exported model locally), and records the latency
+percentiles and throughput at each level.
+
+The capacity of one replica is the highest throughput reached with the p95
+latency within the objective. Given load tests of one replica of several
+machine types and the expected traffic, `recommend` picks the machine type
+that is cheapest at peak, and the min/max replica counts to deploy it with:
+
+    python -m src.pipelines.trigger.load_test run \\
+        --endpoint projects/p/locations/us-central1/endpoints/123 \\
+        --machine_type n1-standard-2 --instances instances.jsonl \\
+        --output n1-standard-2.json
+    python -m src.pipelines.trigger.load_test recommend \\
+        --results n1-standard-2.json n1-standard-4.json \\
+        --peak_qps 50 --p95_ms 200 --update_params params.json
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import dataclasses
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import math
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+import urllib.request
+
+PredictFn = Callable[[List[Any]], Any]
+
+CONCURRENCY_LEVELS = (1, 2, 4, 8, 16, 32)
+
+# Approximate online prediction prices in USD per node hour (us-central1);
+# pass your own with --prices
+MACHINE_PRICES = {
+    "e2-standard-2": 0.0771,
+    "e2-standard-4": 0.1542,
+    "e2-standard-8": 0.3084,
+    "n1-standard-2": 0.1096,
+    "n1-standard-4": 0.2191,
+    "n1-standard-8": 0.4382,
+    "n1-standard-16": 0.8763,
+    "n1-highcpu-4": 0.1633,
+    "n1-highcpu-8": 0.3265,
+    "n1-highmem-2": 0.1365,
+    "n1-highmem-4": 0.2730,
+}
+
+# pipeline parameters of the ModelDeployOp resources
+DEPLOY_PARAMS = (
+    "deploy_machine_type",
+    "deploy_min_replica_count",
+    "deploy_max_replica_count",
+)
+
+
+@dataclasses.dataclass
+class LevelResult:
+    concurrency: int
+    requests: int
+    errors: int
+    seconds: float
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+
+    @property
+    def throughput(self) -> float:
+        """Successful requests per second"""
+        return (self.requests - self.errors) / self.seconds if self.seconds else 0.0
+
+
+@dataclasses.dataclass
+class LoadTestResult:
+    target: str
+    machine_type: str
+    batch_size: int
+    levels: List[LevelResult]
+
+    def capacity(self, p95_ms: float, max_error_rate: float = 0.0) -> float:
+        """Highest throughput of a level meeting the latency objective"""
+        return max(
+            (
+                level.throughput
+                for level in self.levels
+                if level.p95_ms <= p95_ms
+                and level.errors <= max_error_rate * level.requests
+            ),
+            default=0.0,
+        )
+
+    def format(self) -> str:
+        lines = [
+            f"{self.target} ({self.machine_type or 'unknown machine type'}, "
+            f"{self.batch_size} instances per request)",
+            "concurrency  requests  errors     p50     p95     p99  req/s",
+        ]
+        lines += [
+            f"{level.concurrency:>11}  {level.requests:>8}  {level.errors:>6}  "
+            f"{level.p50_ms:>6.0f}  {level.p95_ms:>6.0f}  {level.p99_ms:>6.0f}  "
+            f"{level.throughput:>5.1f}"
+            for level in self.levels
+        ]
+        return "\n".join(lines)
+
+
+@dataclasses.dataclass
+class Recommendation:
+    machine_type: str
+    min_replica_count: int
+    max_replica_count: int
+    # requests per second one replica serves within the latency objective
+    replica_capacity: float
+    hourly_cost_at_peak: float
+
+    def to_params(self) -> Dict[str, Any]:
+        return dict(
+            zip(
+                DEPLOY_PARAMS,
+                (self.machine_type, self.min_replica_count, self.max_replica_count),
+            )
+        )
+
+
+def save_result(result: LoadTestResult, path: str) -> None:
+    with open(path, "w") as f:
+        json.dump(dataclasses.asdict(result), f, indent=2)
+
+
+def load_result(path: str) -> LoadTestResult:
+    with open(path) as f:
+        value = json.load(f)
+    levels = [LevelResult(**level) for level in value["levels"]]
+    return LoadTestResult(**{**value, "levels": levels})
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def run_level(
+    predict: PredictFn,
+    instances: List[Any],
+    concurrency: int,
+    requests: int,
+    batch_size: int = 1,
+) -> LevelResult:
+    """Send `requests` requests from `concurrency` concurrent callers"""
+    batches = itertools.cycle(
+        [instances[i : i + batch_size] for i in range(0, len(instances), batch_size)]
+    )
+    lock = threading.Lock()
+    latencies: List[float] = []
+    errors = 0
+
+    def call(batch: List[Any]) -> None:
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            predict(batch)
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    work = [next(batches) for _ in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, work))
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    return LevelResult(
+        concurrency=concurrency,
+        requests=requests,
+        errors=errors,
+        seconds=seconds,
+        p50_ms=percentile(latencies, 50),
+        p95_ms=percentile(latencies, 95),
+        p99_ms=percentile(latencies, 99),
+    )
+
+
+def load_test(
+    predict: PredictFn,
+    instances: List[Any],
+    target: str = "",
+    machine_type: str = "",
+    concurrency_levels: Sequence[int] = CONCURRENCY_LEVELS,
+    requests_per_level: int = 200,
+    batch_size: int = 1,
+    stop_p99_ms: Optional[float] = None,
+) -> LoadTestResult:
+    """Run the levels in order, stopping once p99 exceeds `stop_p99_ms`"""
+    if not instances:
+        raise ValueError("No instances to send")
+    predict(instances[:batch_size])  # warm-up, not measured
+    levels = []
+    for concurrency in concurrency_levels:
+        level = run_level(
+            predict, instances, concurrency, requests_per_level, batch_size
+        )
+        levels.append(level)
+        print(
+            f"concurrency {concurrency}: p95 {level.p95_ms:.0f} ms, "
+            f"{level.throughput:.1f} req/s, {level.errors} errors"
+        )
+        if stop_p99_ms is not None and level.p99_ms > stop_p99_ms:
+            break
+    return LoadTestResult(
+        target=target, machine_type=machine_type, batch_size=batch_size, levels=levels
+    )
+
+
+def recommend(
+    results: List[LoadTestResult],
+    peak_qps: float,
+    p95_ms: float,
+    min_qps: float = 0.0,
+    target_utilization: float = 0.7,
+    prices: Optional[Dict[str, float]] = None,
+) -> Recommendation:
+    """Cheapest machine type at peak traffic, and its replica counts
+
+    Each result must be a load test of one replica. Replicas are sized to
+    run at `target_utilization` of their capacity, leaving headroom while
+    autoscaling catches up. `peak_qps` and `min_qps` are in requests per
+    second, of the batch size of the load tests.
+    """
+    prices = MACHINE_PRICES if prices is None else prices
+    candidates = []
+    for result in results:
+        if result.machine_type not in prices:
+            raise ValueError(f"No price for machine type {result.machine_type!r}")
+        capacity = result.capacity(p95_ms) * target_utilization
+        if capacity <= 0:
+            print(f"{result.machine_type}: p95 above {p95_ms} ms at any concurrency")
+            continue
+        max_replicas = max(math.ceil(peak_qps / capacity), 1)
+        candidates.append(
+            Recommendation(
+                machine_type=result.machine_type,
+                min_replica_count=min(
+                    max(math.ceil(min_qps / capacity), 1), max_replicas
+                ),
+                max_replica_count=max_replicas,
+                replica_capacity=result.capacity(p95_ms),
+                hourly_cost_at_peak=max_replicas * prices[result.machine_type],
+            )
+        )
+    if not candidates:
+        raise ValueError(f"No machine type meets a p95 latency of {p95_ms} ms")
+    return min(candidates, key=lambda r: (r.hourly_cost_at_peak, r.max_replica_count))
+
+
+def http_predictor(url: str, timeout: float = 60.0) -> PredictFn:
+    """Predict by POSTing `{"instances": [...]}` to a URL"""
+
+    def predict(instances: List[Any]) -> Any:
+        request = urllib.request.Request(
+            url,
+            data=json.dumps({"instances": instances}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=timeout) as response:  # noqa: S310
+            return json.load(response)["predictions"]
+
+    return predict
+
+
+def endpoint_predictor(
+    endpoint: str, project: Optional[str] = None, region: Optional[str] = None
+) -> PredictFn:
+    """Predict with a Vertex AI endpoint"""
+    # imported lazily: aiplatform is by far the slowest import of the CLI
+    from google.cloud import aiplatform
+
+    client = aiplatform.Endpoint(endpoint, project=project, location=region)
+    return lambda instances: client.predict(instances=instances).predictions
+
+
+def saved_model_predictor(model_dir: str) -> PredictFn:
+    """Predict with an exported TensorFlow SavedModel (e.g. a BQML export)"""
+    try:
+        import tensorflow as tf
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError(
+            "serving an exported model locally needs tensorflow"
+        ) from e
+
+    signature = tf.saved_model.load(model_dir).signatures["serving_default"]
+
+    def predict(instances: List[Any]) -> Any:
+        inputs = {
+            name: tf.constant([[instance[name]] for instance in instances])
+            for name in signature.structured_input_signature[1]
+        }
+        outputs = signature(**inputs)
+        return [
+            {name: value[i].numpy().tolist() for name, value in outputs.items()}
+            for i in range(len(instances))
+        ]
+
+    return predict
+
+
+def _handler(predict: PredictFn) -> type:
+    class PredictHandler(BaseHTTPRequestHandler):
+        """Vertex-style `{"instances": [...]}` -> `{"predictions": [...]}`"""
+
+        def do_GET(self) -> None:  # noqa: N802
+            self._reply(200, {"status": "ok"})
+
+        def do_POST(self) -> None:  # noqa: N802
+            try:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                self._reply(200, {"predictions": predict(body["instances"])})
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+
+        def _reply(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    return PredictHandler
+
+
+@contextlib.contextmanager
+def serve(predict: PredictFn, host: str = "127.0.0.1", port: int = 0) -> Iterator[str]:
+    """Serve predictions over HTTP in a background thread, yield the URL"""
+    server = ThreadingHTTPServer((host, port), _handler(predict))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://{host}:{server.server_address[1]}/predict"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def read_instances(path: str) -> List[Any]:
+    """Instances from a JSON lines file, or a JSON list"""
+    with open(path) as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description="Load-test a prediction endpoint and right-size its deployment"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    cmd_run = commands.add_parser("run", help="load-test an endpoint.")
+    target = cmd_run.add_mutually_exclusive_group(required=True)
+    target.add_argument("--endpoint", help="Vertex AI endpoint resource name.")
+    target.add_argument("--url", help="URL of a server taking {'instances': [...]}.")
+    cmd_run.add_argument("--project", default=None, help="GCP project.")
+    cmd_run.add_argument("--region", default=None, help="GCP region.")
+    cmd_run.add_argument(
+        "--instances", required=True, help="JSON lines file of instances to send."
+    )
+    cmd_run.add_argument(
+        "--machine_type",
+        default="",
+        help="machine type of the single replica under test.",
+    )
+    cmd_run.add_argument(
+        "--concurrency",
+        default=",".join(map(str, CONCURRENCY_LEVELS)),
+        help="comma-separated concurrency levels.",
+    )
+    cmd_run.add_argument("--requests", type=int, default=200, help="per level.")
+    cmd_run.add_argument("--batch_size", type=int, default=1, help="per request.")
+    cmd_run.add_argument(
+        "--stop_p99_ms",
+        type=float,
+        default=None,
+        help="stop after the first level with a higher p99 latency.",
+    )
+    cmd_run.add_argument("--output", default=None, help="JSON file of the results.")
+
+    cmd_serve = commands.add_parser(
+        "serve", help="serve an exported TensorFlow model locally."
+    )
+    cmd_serve.add_argument("--model_dir", required=True, help="SavedModel directory.")
+    cmd_serve.add_argument("--port", type=int, default=8080)
+
+    cmd_recommend = commands.add_parser(
+        "recommend", help="machine type and replica counts from load test results."
+    )
+    cmd_recommend.add_argument(
+        "--results", nargs="+", required=True, help="load test result files."
+    )
+    cmd_recommend.add_argument(
+        "--peak_qps", type=float, required=True, help="peak requests per second."
+    )
+    cmd_recommend.add_argument(
+        "--min_qps", type=float, default=0.0, help="off-peak requests per second."
+    )
+    cmd_recommend.add_argument(
+        "--p95_ms", type=float, required=True, help="p95 latency objective."
+    )
+    cmd_recommend.add_argument(
+        "--target_utilization",
+        type=float,
+        default=0.7,
+        help="fraction of a replica's capacity to plan for.",
+    )
+    cmd_recommend.add_argument(
+        "--prices", default=None, help="JSON file of node hour prices by machine type."
+    )
+    cmd_recommend.add_argument(
+        "--update_params",
+        nargs="*",
+        default=[],
+        help="pipeline params files to write the recommendation to.",
+    )
+    return parser.parse_args(argv)
+
+
+def main(args: argparse.Namespace) -> int:
+    if args.command == "run":
+        if args.endpoint:
+            predict = endpoint_predictor(args.endpoint, args.project, args.region)
+        else:
+            predict = http_predictor(args.url)
+        result = load_test(
+            predict,
+            read_instances(args.instances),
+            target=args.endpoint or args.url,
+            machine_type=args.machine_type,
+            concurrency_levels=[int(c) for c in args.concurrency.split(",")],
+            requests_per_level=args.requests,
+            batch_size=args.batch_size,
+            stop_p99_ms=args.stop_p99_ms,
+        )
+        print(result.format())
+        if args.output:
+            save_result(result, args.output)
+    elif args.command == "serve":
+        with serve(
+            saved_model_predictor(args.model_dir), "0.0.0.0", args.port  # noqa: S104
+        ) as url:
+            print(f"Serving {args.model_dir} on {url}")
+            threading.Event().wait()
+    elif args.command == "recommend":
+        results = [load_result(path) for path in args.results]
+        prices = None
+        if args.prices:
+            with open(args.prices) as f:
+                prices = json.load(f)
+        recommendation = recommend(
+            results,
+            peak_qps=args.peak_qps,
+            p95_ms=args.p95_ms,
+            min_qps=args.min_qps,
+            target_utilization=args.target_utilization,
+            prices=prices,
+        )
+        print(json.dumps(dataclasses.asdict(recommendation), indent=2))
+        for path in args.update_params:
+            with open(path) as f:
+                params = json.load(f)
+            params.update(recommendation.to_params())
+            with open(path, "w") as f:
+                json.dump(params, f, indent=4)
+                f.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(parse_args()))
@@ -0,0 +1,619 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run a compiled pipeline on the local machine.
+
+Tasks run in a thread pool as soon as the tasks they depend on are done, so
+independent branches of the DAG run concurrently. Each task is executed:
+
+- by its stand-in, if one is registered for its component (see stand_ins.py);
+- in-process, for lightweight components that do not call Google Cloud: the
+  component source is read from the compiled spec and called directly;
+- otherwise with placeholder outputs (training, deployment, ...).
+
+The iterations of a ParallelFor run concurrently, each in its own
+directory. The sub-DAG of a dsl.Condition runs once if its condition holds,
+and is reported as not triggered otherwise, as are the tasks after it.
+
+Artifacts are files under `work_dir`, BigQuery tables live in a sqlite
+database there and `gs://bucket/...` maps to `work_dir/gcs/bucket/...`.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import dataclasses
+import inspect
+import json
+import operator
+import pathlib
+import re
+import time
+import traceback
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from src.pipelines.trigger import bundle
+from src.pipelines.trigger.stand_ins import (
+    LocalWarehouse,
+    placeholder,
+    stand_in_for,
+    StandIn,
+    TaskContext,
+)
+
+SUCCEEDED, FAILED, SKIPPED = "SUCCEEDED", "FAILED", "SKIPPED"
+NOT_TRIGGERED = "NOT_TRIGGERED"
+
+# lightweight components installing these talk to Google Cloud
+_cloud_packages = frozenset(
+    {
+        "google-cloud-aiplatform",
+        "google-cloud-bigquery",
+        "google-cloud-bigquery-storage",
+        "google-cloud-storage",
+        "google-cloud-pipeline-components",
+    }
+)
+_input_placeholder = re.compile(r"\{\{\$\.inputs\.parameters\['([^']+)'\]\}\}")
+_item_field = re.compile(r'\["([^"]+)"\]')
+# a compiled dsl.Condition term: inputs.parameters['p'].string_value != ''
+_condition_term = re.compile(
+    r"inputs\.parameters\['([^']+)'\]\.(string|int|double)_value"
+    r"\s*(==|!=|<=|>=|<|>)\s*(.+)"
+)
+_comparisons = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+_value_types = {"string": str, "int": int, "double": float}
+
+
+@dataclasses.dataclass
+class TaskResult:
+    task: str
+    state: str
+    mode: str
+    seconds: float = 0.0
+    parameters: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    artifacts: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    error: Optional[str] = None
+    # caveats of a stand-in, e.g. outputs that are not meaningful locally
+    notes: List[str] = dataclasses.field(default_factory=list)
+    # the runs of the sub-DAG of a loop, one per item, or of a triggered condition
+    iterations: List["LocalRun"] = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class LocalRun:
+    tasks: Dict[str, TaskResult]
+    seconds: float
+    work_dir: str
+
+    @property
+    def succeeded(self) -> bool:
+        return all(t.state in (SUCCEEDED, NOT_TRIGGERED) for t in self.tasks.values())
+
+
+class _LocalPath:
+    """Artifact mixin mapping file:// URIs, and gs:// to the local bucket dir"""
+
+    schema_title = "system.Artifact"
+    uri: str
+    work_dir: Optional[pathlib.Path] = None
+
+    def _get_path(self) -> Optional[str]:
+        if self.uri.startswith("file://"):
+            return self.uri[len("file://") :]
+        if self.uri.startswith("gs://") and self.work_dir is not None:
+            return str(self.work_dir / "gcs" / self.uri[len("gs://") :])
+        # the KFP artifact class this is mixed into
+        return super()._get_path()  # type: ignore
+
+
+_local_classes: Dict[type, type] = {}
+
+
+def _artifact(
+    cls: type, schema_title: str, name: str, uri: str, work_dir: pathlib.Path
+) -> Any:
+    if cls not in _local_classes:
+        _local_classes[cls] = type(cls.__name__, (_LocalPath, cls), {})
+    artifact = _local_classes[cls](name=name, uri=uri)
+    artifact.schema_title = schema_title
+    artifact.work_dir = work_dir
+    return artifact
+
+
+def _artifact_class(schema_title: str) -> type:
+    from kfp.v2.components.types import artifact_types
+
+    return artifact_types._SCHEMA_TITLE_TO_TYPE.get(
+        schema_title, artifact_types.Artifact
+    )
+
+
+def _constant(value: Dict[str, Any]) -> Any:
+    if "intValue" in value:
+        return int(value["intValue"])
+    if "doubleValue" in value:
+        return float(value["doubleValue"])
+    return value.get("stringValue", "")
+
+
+def _convert(value: Any, annotation: Any) -> Any:
+    """Convert a pipeline parameter to the type of a function argument"""
+    if annotation is bool and not isinstance(value, bool):
+        return str(value).lower() in ("true", "1")
+    if annotation is int:
+        return int(value)
+    if annotation is float:
+        return float(value)
+    if annotation in (dict, list) or getattr(annotation, "__origin__", None) in (
+        dict,
+        list,
+    ):
+        return json.loads(value) if isinstance(value, str) else value
+    return value
+
+
+def _holds(condition: str, parameters: Dict[str, Any]) -> bool:
+    """Evaluate the trigger condition of a dsl.Condition on its parameters"""
+    for term in condition.split("&&"):
+        match = _condition_term.fullmatch(term.strip().strip("()"))
+        if match is None:
+            raise NotImplementedError(f"Unsupported condition: {condition}")
+        name, value_type, comparison, literal = match.groups()
+        cast = _value_types[value_type]
+        expected = literal[1:-1] if literal.startswith("'") else json.loads(literal)
+        if not _comparisons[comparison](cast(parameters[name]), cast(expected)):
+            return False
+    return True
+
+
+def _select(item: Any, selector: str) -> Any:
+    """A field of a loop item, e.g. `parseJson(string_value)["uri"]`"""
+    if isinstance(item, str):
+        item = json.loads(item)
+    field = _item_field.search(selector)
+    if field is None:
+        raise NotImplementedError(f"Unsupported loop item selector: {selector}")
+    return item[field.group(1)]
+
+
+class LocalRunner:
+    """Execute the root DAG of a compiled pipeline spec in a thread pool"""
+
+    def __init__(
+        self,
+        spec: Dict[str, Any],
+        work_dir: str,
+        stand_ins: Optional[Dict[str, StandIn]] = None,
+        in_process: Sequence[str] = (),
+        max_workers: Optional[int] = None,
+        warehouse: Optional[LocalWarehouse] = None,
+    ) -> None:
+        self.pipeline_spec = spec["pipelineSpec"]
+        self.runtime_config = spec.get("runtimeConfig", {})
+        self.work_dir = pathlib.Path(work_dir).resolve()
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        # sub-DAG runners share their parent's warehouse, and so its lock
+        self.warehouse = warehouse or LocalWarehouse(
+            str(self.work_dir / "warehouse.sqlite")
+        )
+        self.stand_ins = stand_ins
+        self.in_process = set(in_process)
+        self.max_workers = max_workers
+        self._installs = bundle.runtime_installs(spec)
+        self._outputs: Dict[str, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        # task directories: under work_dir, or an iteration dir of a loop
+        self._task_root = self.work_dir
+
+    def pipeline_parameters(self, pipeline_params: Dict[str, Any]) -> Dict[str, Any]:
+        """Pipeline parameters: the given ones over the compiled-in defaults"""
+        definitions = self.pipeline_spec["root"].get("inputDefinitions", {})
+        defaults = {
+            name: _constant(value)
+            for name, value in self.runtime_config.get("parameters", {}).items()
+        }
+        params = {**defaults, **pipeline_params}
+        missing = sorted(set(definitions.get("parameters", {})) - set(params))
+        if missing:
+            raise ValueError(f"Missing pipeline parameters: {', '.join(missing)}")
+        return params
+
+    def _resolve(
+        self, task: Dict[str, Any], pipeline_params: Dict[str, Any]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        inputs = task.get("inputs", {})
+        parameters = {}
+        for name, spec in inputs.get("parameters", {}).items():
+            if "componentInputParameter" in spec:
+                parameters[name] = pipeline_params[spec["componentInputParameter"]]
+                if "parameterExpressionSelector" in spec:
+                    parameters[name] = _select(
+                        parameters[name], spec["parameterExpressionSelector"]
+                    )
+            elif "taskOutputParameter" in spec:
+                source = spec["taskOutputParameter"]
+                parameters[name] = self._outputs[source["producerTask"]][0][
+                    source["outputParameterKey"]
+                ]
+            elif "runtimeValue" in spec:
+                parameters[name] = _constant(spec["runtimeValue"]["constantValue"])
+        # f-strings of pipeline parameters compile to placeholders
+        for name, value in parameters.items():
+            if isinstance(value, str):
+                parameters[name] = _input_placeholder.sub(
+                    lambda m: str(parameters[m.group(1)]), value
+                )
+
+        artifacts = {}
+        for name, spec in inputs.get("artifacts", {}).items():
+            if "componentInputArtifact" in spec:
+                artifacts[name] = pipeline_params[spec["componentInputArtifact"]]
+                continue
+            source = spec["taskOutputArtifact"]
+            artifacts[name] = self._outputs[source["producerTask"]][1][
+                source["outputArtifactKey"]
+            ]
+        return parameters, artifacts
+
+    def _mode(self, component_name: str) -> str:
+        component = self.pipeline_spec["components"][component_name]
+        if "dag" in component:
+            return (
+                "condition" if component_name.startswith("comp-condition-") else "loop"
+            )
+        executor = self.pipeline_spec["deploymentSpec"]["executors"][
+            component["executorLabel"]
+        ]
+        if "importer" in executor:
+            return "importer"
+        if component_name[len("comp-") :] in self.in_process:
+            return "in-process"
+        if stand_in_for(component_name, self.stand_ins):
+            return "stand-in"
+        lightweight = "--function_to_execute" in executor["container"].get("args", [])
+        packages = {
+            bundle._package_name(p)
+            for p in self._installs.get(component["executorLabel"], [])
+        }
+        if lightweight and not packages & _cloud_packages:
+            return "in-process"
+        return "placeholder"
+
+    def _run_sub_dag(
+        self, component: Dict[str, Any], params: Dict[str, Any], task_root: pathlib.Path
+    ) -> LocalRun:
+        runner = LocalRunner(
+            {"pipelineSpec": {**self.pipeline_spec, "root": component}},
+            str(self.work_dir),
+            self.stand_ins,
+            sorted(self.in_process),
+            self.max_workers,
+            self.warehouse,
+        )
+        runner._task_root = task_root
+        runner._task_root.mkdir(parents=True, exist_ok=True)
+        return runner.run(params)
+
+    def _run_loop(self, name: str, pipeline_params: Dict[str, Any]) -> TaskResult:
+        """Run the sub-DAG of a ParallelFor once per item, concurrently"""
+        start = time.perf_counter()
+        task = self.pipeline_spec["root"]["dag"]["tasks"][name]
+        component = self.pipeline_spec["components"][task["componentRef"]["name"]]
+        parameters, artifacts = self._resolve(task, pipeline_params)
+        iterator = task["parameterIterator"]
+        items = parameters[iterator["items"]["inputParameter"]]
+        if isinstance(items, str):
+            # placeholder outputs are empty strings: no iteration
+            items = json.loads(items) if items else []
+
+        def iteration(index: int, item: Any) -> LocalRun:
+            return self._run_sub_dag(
+                component,
+                {**parameters, **artifacts, iterator["itemInput"]: item},
+                self._task_root / name / str(index),
+            )
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            runs = list(executor.map(iteration, range(len(items)), items))
+        failures = [
+            f"iteration {i}:\n{format_report(run)}"
+            for i, run in enumerate(runs)
+            if not run.succeeded
+        ]
+        if failures:
+            raise RuntimeError("\n".join(failures))
+        return TaskResult(
+            task=name,
+            state=SUCCEEDED,
+            mode="loop",
+            seconds=time.perf_counter() - start,
+            iterations=runs,
+        )
+
+    def _run_condition(self, name: str, pipeline_params: Dict[str, Any]) -> TaskResult:
+        """Run the sub-DAG of a dsl.Condition once, if the condition holds"""
+        start = time.perf_counter()
+        task = self.pipeline_spec["root"]["dag"]["tasks"][name]
+        component = self.pipeline_spec["components"][task["componentRef"]["name"]]
+        parameters, artifacts = self._resolve(task, pipeline_params)
+        if not _holds(task["triggerPolicy"]["condition"], parameters):
+            return TaskResult(task=name, state=NOT_TRIGGERED, mode="condition")
+
+        run = self._run_sub_dag(
+            component, {**parameters, **artifacts}, self._task_root / name
+        )
+        if not run.succeeded:
+            raise RuntimeError(format_report(run))
+        return TaskResult(
+            task=name,
+            state=SUCCEEDED,
+            mode="condition",
+            seconds=time.perf_counter() - start,
+            iterations=[run],
+        )
+
+    def _run_task(self, name: str, pipeline_params: Dict[str, Any]) -> TaskResult:
+        task = self.pipeline_spec["root"]["dag"]["tasks"][name]
+        component_name = task["componentRef"]["name"]
+        component = self.pipeline_spec["components"][component_name]
+        if "parameterIterator" in task:
+            return self._run_loop(name, pipeline_params)
+        if "triggerPolicy" in task:
+            return self._run_condition(name, pipeline_params)
+        executor = self.pipeline_spec["deploymentSpec"]["executors"][
+            component["executorLabel"]
+        ]
+        mode = self._mode(component_name)
+        start = time.perf_counter()
+
+        parameters, inputs = self._resolve(task, pipeline_params)
+        task_dir = self._task_root / name
+        task_dir.mkdir(exist_ok=True)
+        outputs = {
+            output: _artifact(
+                _artifact_class(spec["artifactType"]["schemaTitle"]),
+                spec["artifactType"]["schemaTitle"],
+                output,
+                f"file://{task_dir / output}",
+                self.work_dir,
+            )
+            for output, spec in component.get("outputDefinitions", {})
+            .get("artifacts", {})
+            .items()
+        }
+        output_parameters: Dict[str, Any] = {
+            output: None
+            for output in component.get("outputDefinitions", {}).get("parameters", {})
+        }
+        ctx = TaskContext(
+            task=name,
+            component=component_name,
+            parameters=parameters,
+            inputs=inputs,
+            outputs=outputs,
+            output_parameters=output_parameters,
+            work_dir=self.work_dir,
+            warehouse=self.warehouse,
+        )
+
+        stand_in = stand_in_for(component_name, self.stand_ins)
+        if mode == "importer":
+            importer = executor["importer"]
+            schema_title = importer["typeSchema"]["schemaTitle"]
+            artifact = _artifact(
+                _artifact_class(schema_title),
+                schema_title,
+                "artifact",
+                parameters[importer["artifactUri"]["runtimeParameter"]],
+                self.work_dir,
+            )
+            artifact.metadata.update(importer.get("metadata", {}))
+            outputs["artifact"] = artifact
+        elif mode == "in-process":
+            self._call_function(executor, ctx)
+        elif mode == "stand-in" and stand_in is not None:
+            stand_in(ctx)
+        else:
+            placeholder(ctx)
+
+        self._outputs[name] = (output_parameters, outputs)
+        return TaskResult(
+            task=name,
+            state=SUCCEEDED,
+            mode=mode,
+            seconds=time.perf_counter() - start,
+            parameters=output_parameters,
+            artifacts={
+                output: {"uri": a.uri, "metadata": a.metadata}
+                for output, a in outputs.items()
+            },
+            notes=ctx.notes,
+        )
+
+    @staticmethod
+    def _call_function(executor: Dict[str, Any], ctx: TaskContext) -> None:
+        """Run a lightweight component's function from its compiled source"""
+        from kfp.v2.components.types import type_annotations
+
+        container = executor["container"]
+        source = container["command"][-1]
+        function_name = container["args"][
+            container["args"].index("--function_to_execute") + 1
+        ]
+        namespace: Dict[str, Any] = {}
+        exec(compile(source, f"<{ctx.component}>", "exec"), namespace)  # noqa: S102
+        function = namespace[function_name]
+
+        kwargs = {}
+        for name, parameter in inspect.signature(function).parameters.items():
+            annotation = parameter.annotation
+            if type_annotations.is_input_artifact(annotation):
+                kwargs[name] = ctx.inputs[name]
+            elif type_annotations.is_output_artifact(annotation):
+                output = ctx.outputs[name]
+                pathlib.Path(output.path).parent.mkdir(parents=True, exist_ok=True)
+                kwargs[name] = output
+            elif name in ctx.parameters:
+                kwargs[name] = _convert(ctx.parameters[name], annotation)
+
+        returned = function(**kwargs)
+        if returned is None:
+            return
+        if hasattr(returned, "_fields"):
+            ctx.output_parameters.update(returned._asdict())
+        else:
+            ctx.output_parameters["Output"] = returned
+
+    def _check_supported(self, tasks: Dict[str, Any]) -> None:
+        for name, task in tasks.items():
+            if "artifactIterator" in task:
+                raise NotImplementedError(f"{name}: artifact loops are not supported")
+            component = self.pipeline_spec["components"][task["componentRef"]["name"]]
+            sub_dag = {"parameterIterator", "triggerPolicy"} & set(task)
+            if "dag" in component and not sub_dag:
+                raise NotImplementedError(
+                    f"{name}: sub-DAGs other than loops and conditions are not supported"
+                )
+
+    def _start_ready(
+        self,
+        executor: ThreadPoolExecutor,
+        pending: Dict[str, Dict[str, Any]],
+        results: Dict[str, TaskResult],
+        running: Dict[Future, str],
+        params: Dict[str, Any],
+    ) -> None:
+        """Start the pending tasks whose dependencies are all done
+
+        As on Vertex, the dependents of a condition that was not triggered
+        are not triggered either, nor are theirs.
+        """
+        while True:
+            ready = {}
+            for name, task in pending.items():
+                states = [
+                    results[d].state if d in results else None
+                    for d in task.get("dependentTasks", [])
+                ]
+                if all(state in (SUCCEEDED, NOT_TRIGGERED) for state in states):
+                    ready[name] = NOT_TRIGGERED not in states
+            if not ready:
+                return
+            for name, triggered in ready.items():
+                task = pending.pop(name)
+                if triggered:
+                    running[executor.submit(self._run_task, name, params)] = name
+                else:
+                    results[name] = TaskResult(
+                        task=name,
+                        state=NOT_TRIGGERED,
+                        mode=self._mode(task["componentRef"]["name"]),
+                    )
+
+    def run(self, pipeline_params: Dict[str, Any]) -> LocalRun:
+        """Run every task of the root DAG, independent ones concurrently
+
+        After a failure no new task is started and the tasks that have not
+        run are reported as skipped.
+        """
+        start = time.perf_counter()
+        params = self.pipeline_parameters(pipeline_params)
+        tasks = self.pipeline_spec["root"]["dag"]["tasks"]
+        self._check_supported(tasks)
+
+        results: Dict[str, TaskResult] = {}
+        running: Dict[Future, str] = {}
+        pending = dict(tasks)
+        failed = False
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                if not failed:
+                    self._start_ready(executor, pending, results, running, params)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception:
+                        failed = True
+                        results[name] = TaskResult(
+                            task=name,
+                            state=FAILED,
+                            mode=self._mode(tasks[name]["componentRef"]["name"]),
+                            error=traceback.format_exc(),
+                        )
+
+        for name in pending:
+            results[name] = TaskResult(
+                task=name,
+                state=SKIPPED,
+                mode=self._mode(tasks[name]["componentRef"]["name"]),
+            )
+        return LocalRun(
+            tasks=results,
+            seconds=time.perf_counter() - start,
+            work_dir=str(self.work_dir),
+        )
+
+
+def run(
+    template_path: str,
+    pipeline_params: Dict[str, Any],
+    work_dir: str,
+    stand_ins: Optional[Dict[str, StandIn]] = None,
+    in_process: Sequence[str] = (),
+    max_workers: Optional[int] = None,
+) -> LocalRun:
+    """Run a compiled pipeline package file locally"""
+    with open(template_path) as f:
+        spec = json.load(f)
+    runner = LocalRunner(spec, work_dir, stand_ins, in_process, max_workers)
+    return runner.run(pipeline_params)
+
+
+def _flatten(local_run: LocalRun, prefix: str = "") -> Iterator[Tuple[str, TaskResult]]:
+    """Task results, followed by those of each loop iteration or condition"""
+    for r in local_run.tasks.values():
+        yield prefix + r.task, r
+        for i, iteration in enumerate(r.iterations):
+            yield from _flatten(iteration, f"{prefix}{r.task}/{i}/")
+
+
+def format_report(local_run: LocalRun) -> str:
+    """Render one line per task, in completion order, and the failures"""
+    rows = [("task", "mode", "state", "seconds")]
+    for name, r in _flatten(local_run):
+        rows.append((name, r.mode, r.state, f"{r.seconds:.2f}"))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    lines = ["  ".join(cell.ljust(w) for cell, w in zip(row, widths)) for row in rows]
+    lines.insert(1, "  ".join("-" * w for w in widths))
+    lines = [line.rstrip() for line in lines]
+    for name, r in _flatten(local_run):
+        lines += [f"note: {name}: {note}" for note in r.notes]
+    for r in local_run.tasks.values():
+        if r.error:
+            lines.append(f"\n{r.task} failed:\n{r.error}")
+    succeeded = sum(r.state == SUCCEEDED for r in local_run.tasks.values())
+    lines.append(
+        f"{succeeded}/{len(local_run.tasks)} tasks succeeded in "
+        f"{local_run.seconds:.2f}s (work dir: {local_run.work_dir})"
+    )
+    return "\n".join(lines)
@@ -0,0 +1,165 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Submit several pipeline jobs at once and monitor them with asyncio.
+
+The aiplatform SDK is synchronous, so every SDK call (submit, state refresh)
+runs in a worker thread while the event loop interleaves the polling of all
+jobs.
+"""
+
+import asyncio
+import dataclasses
+import itertools
+import random
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+SUCCEEDED = "PIPELINE_STATE_SUCCEEDED"
+TERMINAL_STATES = frozenset(
+    {SUCCEEDED, "PIPELINE_STATE_FAILED", "PIPELINE_STATE_CANCELLED"}
+)
+
+
+@dataclasses.dataclass
+class PollConfig:
+    initial_delay: float = 10.0
+    max_delay: float = 300.0
+    multiplier: float = 2.0
+    # each delay is scaled by a random factor in [1 - jitter, 1 + jitter]
+    jitter: float = 0.2
+    timeout: Optional[float] = None
+
+
+@dataclasses.dataclass
+class JobSummary:
+    index: int
+    parameter_values: Dict[str, Any]
+    resource_name: Optional[str]
+    state: str
+    seconds: float
+    polls: int = 0
+    error: Optional[str] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.state == SUCCEEDED
+
+
+def backoff_delays(
+    config: PollConfig, rng: Optional[random.Random] = None
+) -> Iterator[float]:
+    """Yield exponentially growing, jittered polling delays"""
+    rng = rng or random.Random()  # noqa: S311 - not used for security
+    delay = config.initial_delay
+    while True:
+        yield delay * rng.uniform(1 - config.jitter, 1 + config.jitter)
+        delay = min(delay * config.multiplier, config.max_delay)
+
+
+def expand_grid(
+    base_params: Dict[str, Any], grid: Dict[str, List[Any]]
+) -> List[Dict[str, Any]]:
+    """Return one parameter set per combination of the grid values"""
+    names = sorted(grid)
+    return [
+        {**base_params, **dict(zip(names, values))}
+        for values in itertools.product(*(grid[name] for name in names))
+    ]
+
+
+def _state_name(job: Any) -> str:
+    # PipelineJob.state refreshes the job resource, i.e. makes an API call
+    state = job.state
+    return getattr(state, "name", str(state))
+
+
+async def wait_for_job(
+    job: Any, config: PollConfig, rng: Optional[random.Random] = None
+) -> Tuple[str, int]:
+    """Poll a submitted job until it reaches a terminal state
+
+    Returns the final state and the number of polls it took.
+    """
+    start = time.monotonic()
+    delays = backoff_delays(config, rng)
+    polls = 0
+    while True:
+        state = await asyncio.to_thread(_state_name, job)
+        polls += 1
+        if state in TERMINAL_STATES:
+            return state, polls
+        if config.timeout is not None and time.monotonic() - start > config.timeout:
+            raise asyncio.TimeoutError(f"{job.resource_name} still {state}")
+        await asyncio.sleep(next(delays))
+
+
+async def run_jobs(
+    pipeline: Any,
+    parameter_values: List[Dict[str, Any]],
+    config: Optional[PollConfig] = None,
+    max_concurrent: Optional[int] = None,
+    **run_job_kwargs: Any,
+) -> List[JobSummary]:
+    """Submit one job per parameter set and wait for all of them to finish
+
+    `pipeline` is a VertexPipeline, `run_job_kwargs` are forwarded to its
+    `run_job` method (template_path, pipeline_root, project, region).
+    """
+    config = config or PollConfig()
+    semaphore = asyncio.Semaphore(max_concurrent or len(parameter_values) or 1)
+
+    async def run_one(index: int, params: Dict[str, Any]) -> JobSummary:
+        async with semaphore:
+            start = time.monotonic()
+            job, polls = None, 0
+            try:
+                job = await asyncio.to_thread(
+                    pipeline.run_job,
+                    pipeline_params=params,
+                    sync=False,
+                    **run_job_kwargs,
+                )
+                state, polls = await wait_for_job(job, config)
+                error = None
+            except Exception as e:
+                state, error = "ERROR", f"{type(e).__name__}: {e}"
+            return JobSummary(
+                index=index,
+                parameter_values=params,
+                resource_name=getattr(job, "resource_name", None),
+                state=state,
+                seconds=time.monotonic() - start,
+                polls=polls,
+                error=error,
+            )
+
+    return list(
+        await asyncio.gather(
+            *(run_one(i, params) for i, params in enumerate(parameter_values))
+        )
+    )
+
+
+def format_summary(summaries: List[JobSummary]) -> str:
+    """Render one line per job and a final tally"""
+    lines = []
+    for s in summaries:
+        line = f"[{s.index}] {s.state:<26} {s.seconds:8.0f}s  {s.resource_name or '-'}"
+        if s.error:
+            line += f"  ({s.error})"
+        lines.append(line)
+    succeeded = sum(s.succeeded for s in summaries)
+    lines.append(f"{succeeded}/{len(summaries)} jobs succeeded")
+    return "\n".join(lines)
@@ -1,9 +1,19 @@
 import argparse
+import asyncio
+import inspect
 import json
-from typing import Any, Dict
+import os
+import pathlib
+import shutil
+from typing import Any, Dict, List, Optional
 
-from google.cloud import aiplatform
-from kfp.v2 import compiler
+from src.pipelines.trigger import (
+    bundle,
+    compile_cache,
+    monitor,
+    profile,
+    schema_cache,
+)
 
 _default_pipeline_params: Dict = {}
 
@@ -15,12 +25,23 @@ class VertexPipeline:
     def pipeline(self, *args: Any, **kwargs: Any) -> None:
         pass
 
-    def compile_pipeline(self, package_path: str) -> None:
-        """Compile the pipeline"""
+    def compile_pipeline(self, package_path: str, use_cache: bool = True) -> None:
+        """Compile the pipeline, reusing the cached spec if its sources are unchanged"""
+        key = compile_cache.cache_key(self) if use_cache else None
+        cached_path = compile_cache.get(key) if key else None
+        if cached_path:
+            shutil.copyfile(cached_path, package_path)
+            return
+
+        # imported lazily: the KFP compiler is only needed on a cache miss
+        from kfp.v2 import compiler
+
         compiler.Compiler().compile(
             pipeline_func=self.pipeline,
             package_path=package_path,
         )
+        if key:
+            compile_cache.put(key, package_path)
 
     def run_job(
         self,
@@ -29,8 +50,13 @@ class VertexPipeline:
         project: str,
         region: str,
         pipeline_params: Dict[str, Any] = _default_pipeline_params,
-    ) -> None:
-        """Run the pipeline"""
+        sync: bool = True,
+    ) -> Any:
+        """Run the pipeline, or only submit it if `sync` is False, and return the job"""
+        # imported lazily: aiplatform is by far the slowest import of the CLI
+        from google.cloud import aiplatform
+
+        aiplatform.init()
         job = aiplatform.PipelineJob(
             display_name=self.display_name,
             template_path=template_path,
@@ -40,7 +66,102 @@ class VertexPipeline:
             location=region,
             enable_caching=False,
         )
-        job.run()
+        if sync:
+            job.run()
+        else:
+            job.submit()
+        return job
+
+    def run_jobs(
+        self,
+        template_path: str,
+        pipeline_root: str,
+        project: str,
+        region: str,
+        pipeline_params_list: List[Dict[str, Any]],
+        max_concurrent: Optional[int] = None,
+        poll_config: Optional[monitor.PollConfig] = None,
+    ) -> List[monitor.JobSummary]:
+        """Submit one job per params dict concurrently and wait for all of them"""
+        return asyncio.run(
+            monitor.run_jobs(
+                self,
+                pipeline_params_list,
+                config=poll_config,
+                max_concurrent=max_concurrent,
+                template_path=template_path,
+                pipeline_root=pipeline_root,
+                project=project,
+                region=region,
+            )
+        )
+
+    def run_local(
+        self,
+        work_dir: str,
+        pipeline_params: Dict[str, Any] = _default_pipeline_params,
+        stand_ins: Optional[Dict[str, Any]] = None,
+        max_workers: Optional[int] = None,
+    ) -> Any:
+        """Compile and run the pipeline on this machine, see local_runner.py"""
+        from src.pipelines.trigger import local_runner
+
+        os.makedirs(work_dir, exist_ok=True)
+        template_path = os.path.join(work_dir, "pipeline.json")
+        self.compile_pipeline(template_path)
+        return local_runner.run(
+            template_path,
+            pipeline_params,
+            work_dir,
+            stand_ins=stand_ins,
+            max_workers=max_workers,
+        )
+
+    def load_pipeline_params(
+        self, params_paths: List[str], grid_path: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Read the params files, with the cached schema, expanded over the grid"""
+        takes_schema = (
+            schema_cache.SCHEMA_PARAM in inspect.signature(self.pipeline).parameters
+        )
+        pipeline_params_list = []
+        for params_path in params_paths:
+            with open(params_path) as json_file:
+                pipeline_params = json.load(json_file)
+            if takes_schema:
+                pipeline_params = schema_cache.with_cached_schema(
+                    pipeline_params, params_path
+                )
+            pipeline_params_list.append(pipeline_params)
+
+        if grid_path:
+            with open(grid_path) as json_file:
+                grid = json.load(json_file)
+            pipeline_params_list = [
+                params
+                for base_params in pipeline_params_list
+                for params in monitor.expand_grid(base_params, grid)
+            ]
+        return pipeline_params_list
+
+    def profile_job(self, args: argparse.Namespace) -> None:
+        """Print the timeline of a finished job and compare it with past runs"""
+        if args.job_json:
+            recorded = profile.load_job(args.job_json)
+        else:
+            recorded = profile.record_job(args.job, args.project, args.region)
+            if args.record:
+                with open(args.record, "w") as json_file:
+                    json.dump(recorded, json_file, indent=2)
+        job_profile = profile.profile_job(recorded)
+        print(profile.format_gantt(job_profile))
+
+        history_path = pathlib.Path(args.history) if args.history else None
+        history = profile.load_history(history_path, job_profile.pipeline)
+        for regression in profile.compare_to_history(job_profile, history):
+            print(f"REGRESSION {regression}")
+        if job_profile.state == "PIPELINE_STATE_SUCCEEDED":
+            profile.append_history(job_profile, history_path)
 
     def parse_args(self) -> argparse.Namespace:
         """Parse arguments"""
@@ -57,6 +178,22 @@ class VertexPipeline:
             required=True,
             help="path to compiled pipeline package file.",
         )
+        cmd_compile.add_argument(
+            "--no_cache",
+            action="store_true",
+            help="always recompile, ignoring the compile cache.",
+        )
+        cmd_compile.add_argument(
+            "--bundle_image_repository",
+            default=None,
+            help="run the lightweight components on a prebuilt dependency image "
+            "in this repository instead of pip installing at task start.",
+        )
+        cmd_compile.add_argument(
+            "--bundle_dir",
+            default=None,
+            help="directory to write the bundle Dockerfile and requirements.txt to.",
+        )
 
         # run command arguments
         cmd_run_job = commands.add_parser(
@@ -72,7 +209,19 @@ class VertexPipeline:
         cmd_run_job.add_argument(
             "--pipeline_params",
             required=True,
-            help="Pipeline params file.",
+            nargs="+",
+            help="Pipeline params file(s). Several files submit one job each.",
+        )
+        cmd_run_job.add_argument(
+            "--grid",
+            help="JSON file mapping param names to lists of values: one job is "
+            "submitted per combination, on top of each params file.",
+        )
+        cmd_run_job.add_argument(
+            "--max_concurrent",
+            type=int,
+            default=None,
+            help="maximum number of jobs running at once (default: all).",
         )
         cmd_run_job.add_argument(
             "--pipeline_root",
@@ -80,25 +229,91 @@ class VertexPipeline:
             help="GCS root directory for files generated by pipeline job.",
         )
 
+        # local command arguments
+        cmd_local = commands.add_parser(
+            "local", help="run pipeline on this machine, with local stand-ins."
+        )
+        cmd_local.add_argument(
+            "--pipeline_params", required=True, help="Pipeline params file."
+        )
+        cmd_local.add_argument(
+            "--work_dir",
+            default="local_run",
+            help="directory for artifacts, the local warehouse and local GCS.",
+        )
+        cmd_local.add_argument(
+            "--max_workers",
+            type=int,
+            default=None,
+            help="maximum number of tasks running at once.",
+        )
+
+        # profile command arguments
+        cmd_profile = commands.add_parser(
+            "profile", help="task timeline and critical path of a finished job."
+        )
+        job_source = cmd_profile.add_mutually_exclusive_group(required=True)
+        job_source.add_argument("--job", help="pipeline job resource name.")
+        job_source.add_argument(
+            "--job_json", help="job recorded with --record, profiled offline."
+        )
+        cmd_profile.add_argument("--project", default=None, help="project ID.")
+        cmd_profile.add_argument("--region", default=None, help="region.")
+        cmd_profile.add_argument(
+            "--record", default=None, help="save the fetched job to this JSON file."
+        )
+        cmd_profile.add_argument(
+            "--history",
+            default=None,
+            help="JSON lines history of profiles (default: "
+            f"${profile.HISTORY_PATH_ENV} or ~/.cache/vertex-mlops).",
+        )
+
         return parser.parse_args()
 
     def main(self, args: argparse.Namespace) -> None:
         if args.command == "compile":
-            self.compile_pipeline(args.template_path)
+            self.compile_pipeline(args.template_path, use_cache=not args.no_cache)
+            if args.bundle_image_repository:
+                report = bundle.bundle_template(
+                    args.template_path, args.bundle_image_repository, args.bundle_dir
+                )
+                print(report.format())
         elif args.command == "run":
-            aiplatform.init()
+            pipeline_params_list = self.load_pipeline_params(
+                args.pipeline_params, args.grid
+            )
+            for pipeline_params in pipeline_params_list:
+                print(pipeline_params)
+
+            if len(pipeline_params_list) == 1:
+                self.run_job(
+                    template_path=args.template_path,
+                    pipeline_root=args.pipeline_root,
+                    project=args.project,
+                    region=args.region,
+                    pipeline_params=pipeline_params_list[0],
+                )
+            else:
+                summaries = self.run_jobs(
+                    template_path=args.template_path,
+                    pipeline_root=args.pipeline_root,
+                    project=args.project,
+                    region=args.region,
+                    pipeline_params_list=pipeline_params_list,
+                    max_concurrent=args.max_concurrent,
+                )
+                print(monitor.format_summary(summaries))
+        elif args.command == "local":
+            from src.pipelines.trigger import local_runner
 
             with open(args.pipeline_params) as json_file:
                 pipeline_params = json.load(json_file)
-
-            print(pipeline_params)
-
-            self.run_job(
-                template_path=args.template_path,
-                pipeline_root=args.pipeline_root,
-                project=args.project,
-                region=args.region,
-                pipeline_params=pipeline_params,
+            local_run = self.run_local(
+                args.work_dir, pipeline_params, max_workers=args.max_workers
             )
+            print(local_runner.format_report(local_run))
+        elif args.command == "profile":
+            self.profile_job(args)
         else:
             print(f"Command not implemented: {args.command}")
@@ -0,0 +1,410 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Timeline of the tasks of a finished pipeline job.
+
+The wall time of every task is split into:
+
+- queue: from task creation to task start;
+- start: from task start to its container job running (image pull,
+  provisioning), when the container job details are known;
+- execution: the rest, until the task ends (including any polling of a
+  BigQuery or Vertex job by the component).
+
+The critical path is followed back from the last task to end, through the
+dependency that ended last, into and out of the sub-DAGs of ParallelFor and
+Condition tasks; the gaps between a dependency ending and the next task
+being created are the orchestration overhead.
+
+A job is recorded as JSON (`PipelineJob.to_dict()` and the container jobs of
+its tasks), so profiles can be computed offline, and every profile can be
+appended to a JSON lines history to compare successive runs.
+"""
+
+import dataclasses
+import datetime
+import json
+import math
+import os
+import pathlib
+import re
+import statistics
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from src.pipelines.trigger import dag_analysis
+
+HISTORY_PATH_ENV = "VERTEX_MLOPS_PROFILE_HISTORY"
+_default_history_path = (
+    pathlib.Path.home() / ".cache" / "vertex-mlops" / "profile_history.jsonl"
+)
+
+
+@dataclasses.dataclass
+class TaskTimeline:
+    task: str
+    state: str
+    # seconds since the job started
+    created: float
+    started: float
+    running: float
+    ended: float
+    # ParallelFor iterations of the task, merged into one span
+    iterations: int = 1
+
+    @property
+    def queue(self) -> float:
+        return self.started - self.created
+
+    @property
+    def start(self) -> float:
+        return self.running - self.started
+
+    @property
+    def execution(self) -> float:
+        return self.ended - self.running
+
+    @property
+    def total(self) -> float:
+        return self.ended - self.created
+
+
+@dataclasses.dataclass
+class JobProfile:
+    job: str
+    pipeline: str
+    state: str
+    seconds: float
+    tasks: Dict[str, TaskTimeline]
+    critical_path: List[str]
+    # seconds between each critical task and the end of its predecessor
+    orchestration: float
+
+    def to_record(self) -> Dict[str, Any]:
+        """JSON-able history record"""
+        return {
+            "job": self.job,
+            "pipeline": self.pipeline,
+            "state": self.state,
+            "seconds": self.seconds,
+            "critical_path": self.critical_path,
+            "orchestration": self.orchestration,
+            "tasks": {
+                name: {
+                    "state": t.state,
+                    "queue": t.queue,
+                    "start": t.start,
+                    "execution": t.execution,
+                    "total": t.total,
+                    "iterations": t.iterations,
+                }
+                for name, t in self.tasks.items()
+            },
+        }
+
+
+def _merge(first: TaskTimeline, other: TaskTimeline) -> TaskTimeline:
+    """One span covering two iterations of a task, failed if either failed"""
+    return TaskTimeline(
+        task=first.task,
+        state=other.state if first.state.endswith("SUCCEEDED") else first.state,
+        created=min(first.created, other.created),
+        started=min(first.started, other.started),
+        running=min(first.running, other.running),
+        ended=max(first.ended, other.ended),
+        iterations=first.iterations + other.iterations,
+    )
+
+
+def _timestamp(value: str) -> datetime.datetime:
+    # RFC 3339 with up to nanoseconds, e.g. 2022-07-21T10:00:00.123456789Z
+    # python 3.9 fromisoformat only takes 3 or 6 fractional digits
+    value = re.sub(
+        r"\.(\d+)",
+        lambda m: "." + m.group(1)[:6].ljust(6, "0"),
+        value.replace("Z", "+00:00"),
+    )
+    return datetime.datetime.fromisoformat(value)
+
+
+def load_job(path: str) -> Dict[str, Any]:
+    """Read a job recorded with `record_job`"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def record_job(
+    resource_name: str, project: Optional[str] = None, region: Optional[str] = None
+) -> Dict[str, Any]:
+    """Fetch a pipeline job and the container jobs of its tasks"""
+    # imported lazily: aiplatform is by far the slowest import of the CLI
+    from google.cloud import aiplatform
+
+    job = aiplatform.PipelineJob.get(resource_name, project=project, location=region)
+    recorded = {"job": job.to_dict(), "custom_jobs": {}}
+    for task in recorded["job"].get("jobDetail", {}).get("taskDetails", []):
+        name = task.get("executorDetail", {}).get("containerDetail", {}).get("mainJob")
+        if name:
+            custom_job = aiplatform.CustomJob.get(
+                name, project=project, location=region
+            )
+            recorded["custom_jobs"][name] = custom_job.to_dict()
+    return recorded
+
+
+def profile_job(recorded: Dict[str, Any]) -> JobProfile:
+    """Compute the task timelines and critical path of a recorded job"""
+    job, custom_jobs = recorded["job"], recorded.get("custom_jobs", {})
+    job_start = _timestamp(job.get("startTime") or job["createTime"])
+
+    def offset(value: str) -> float:
+        return (_timestamp(value) - job_start).total_seconds()
+
+    timelines: Dict[str, TaskTimeline] = {}
+    for task in job.get("jobDetail", {}).get("taskDetails", []):
+        if "parentTaskId" not in task or "createTime" not in task:
+            continue  # the root DAG, or a task that never ran
+        created = offset(task["createTime"])
+        started = offset(task.get("startTime", task["createTime"]))
+        ended = offset(task.get("endTime", task.get("startTime", task["createTime"])))
+        main_job = custom_jobs.get(
+            task.get("executorDetail", {}).get("containerDetail", {}).get("mainJob", "")
+        )
+        running = started
+        if main_job and main_job.get("startTime"):
+            running = min(max(offset(main_job["startTime"]), started), ended)
+        timeline = TaskTimeline(
+            task=task["taskName"],
+            state=task.get("state", ""),
+            created=created,
+            started=started,
+            running=running,
+            ended=ended,
+        )
+        # the iterations of a ParallelFor share the task name of the spec
+        if timeline.task in timelines:
+            timeline = _merge(timelines[timeline.task], timeline)
+        timelines[timeline.task] = timeline
+
+    critical, orchestration = _critical_path(job, timelines)
+    if job.get("endTime"):
+        seconds = offset(job["endTime"])
+    else:
+        seconds = max((t.ended for t in timelines.values()), default=0.0)
+    return JobProfile(
+        job=job.get("name", ""),
+        pipeline=job.get("displayName", ""),
+        state=job.get("state", ""),
+        seconds=seconds,
+        tasks=dict(sorted(timelines.items(), key=lambda item: item[1].created)),
+        critical_path=critical,
+        orchestration=orchestration,
+    )
+
+
+def _predecessors(job: Dict[str, Any]) -> Tuple[Dict[str, List[str]], Set[str]]:
+    """Upstream tasks of each task that runs a component, and the sub-DAG tasks
+
+    The tasks of a ParallelFor or Condition follow their upstream tasks in the
+    sub-DAG, or else those of the sub-DAG task. A task after a sub-DAG follows
+    the last tasks of the sub-DAG.
+    """
+    spec = job.get("pipelineSpec", {})
+    components = spec.get("components", {})
+    predecessors: Dict[str, List[str]] = {}
+    sub_dags: Set[str] = set()
+
+    def sub_dag(task: Dict[str, Any]) -> Dict[str, Any]:
+        component = components.get(task["componentRef"]["name"], {})
+        return component.get("dag", {}).get("tasks", {})
+
+    def last_tasks(name: str, tasks: Dict[str, Any]) -> List[str]:
+        inner = sub_dag(tasks[name])
+        if not inner:
+            return [name]
+        upstream = {u for u, _ in dag_analysis.edges(inner)[0]}
+        return [t for n in inner if n not in upstream for t in last_tasks(n, inner)]
+
+    def walk(tasks: Dict[str, Any], entry: List[str]) -> None:
+        dependencies, _ = dag_analysis.edges(tasks)
+        for name, task in tasks.items():
+            upstream = [
+                t
+                for u, d in sorted(dependencies)
+                if d == name and u in tasks
+                for t in last_tasks(u, tasks)
+            ] or entry
+            inner = sub_dag(task)
+            if inner:
+                sub_dags.add(name)
+                walk(inner, upstream)
+            else:
+                predecessors[name] = upstream
+
+    walk(spec.get("root", {}).get("dag", {}).get("tasks", {}), [])
+    return predecessors, sub_dags
+
+
+def _critical_path(
+    job: Dict[str, Any], timelines: Dict[str, TaskTimeline]
+) -> Tuple[List[str], float]:
+    predecessors, sub_dags = _predecessors(job)
+    # a sub-DAG task spans its own tasks: those are the steps of the path
+    steps = [name for name in timelines if name not in sub_dags]
+    if not steps:
+        return [], 0.0
+
+    path = [max(steps, key=lambda name: timelines[name].ended)]
+    while True:
+        candidates = [u for u in predecessors.get(path[-1], []) if u in timelines]
+        if not candidates:
+            break
+        path.append(max(candidates, key=lambda name: timelines[name].ended))
+    path.reverse()
+
+    orchestration = timelines[path[0]].created + sum(
+        timelines[task].created - timelines[previous].ended
+        for previous, task in zip(path, path[1:])
+    )
+    return path, max(orchestration, 0.0)
+
+
+def format_gantt(profile: JobProfile, width: int = 60) -> str:
+    """Text Gantt chart: `.` queue, `-` start, `#` execution, `*` critical"""
+    scale = width / max(profile.seconds, 1.0)
+    rows = [("task", "queue", "start", "exec", "timeline")]
+    for t in profile.tasks.values():
+        cells = [" "] * (width + 1)
+        for char, begin, end in (
+            (".", t.created, t.started),
+            ("-", t.started, t.running),
+            ("#", t.running, t.ended),
+        ):
+            if end <= begin:
+                continue
+            # every phase gets at least one column
+            first = min(int(begin * scale), width)
+            last = max(min(math.ceil(end * scale), width + 1), first + 1)
+            cells[first:last] = char * (last - first)
+        marker = "*" if t.task in profile.critical_path else " "
+        count = f" x{t.iterations}" if t.iterations > 1 else ""
+        rows.append(
+            (
+                f"{marker}{t.task}{count}",
+                _minutes(t.queue),
+                _minutes(t.start),
+                _minutes(t.execution),
+                "|" + "".join(cells).rstrip(),
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(4)]
+    lines = [
+        "  ".join(
+            [row[0].ljust(widths[0])]
+            + [c.rjust(w) for c, w in zip(row[1:4], widths[1:])]
+        )
+        + "  "
+        + row[4]
+        for row in rows
+    ]
+    lines.append(
+        f"{profile.pipeline} {profile.state}: {_minutes(profile.seconds)} total, "
+        f"{_minutes(profile.orchestration)} orchestration on the critical path"
+    )
+    lines.append("critical path: " + " -> ".join(profile.critical_path))
+    return "\n".join(line.rstrip() for line in lines)
+
+
+def _minutes(seconds: float) -> str:
+    return f"{seconds / 60:.1f}m" if seconds >= 60 else f"{seconds:.0f}s"
+
+
+def history_path() -> pathlib.Path:
+    return pathlib.Path(os.environ.get(HISTORY_PATH_ENV) or _default_history_path)
+
+
+def load_history(
+    path: Optional[pathlib.Path] = None, pipeline: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """History records, oldest first, optionally of one pipeline only"""
+    path = path or history_path()
+    if not path.is_file():
+        return []
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [r for r in records if pipeline is None or r["pipeline"] == pipeline]
+
+
+def append_history(profile: JobProfile, path: Optional[pathlib.Path] = None) -> bool:
+    """Append a profile to the history, unless its job is already there"""
+    path = path or history_path()
+    if any(r["job"] == profile.job for r in load_history(path)):
+        return False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(profile.to_record(), sort_keys=True) + "\n")
+    return True
+
+
+def compare_to_history(
+    profile: JobProfile,
+    history: List[Dict[str, Any]],
+    last: int = 5,
+    threshold: float = 0.25,
+    min_seconds: float = 30.0,
+) -> List[str]:
+    """Tasks (and the whole job) slower than the median of the last runs
+
+    Only successful earlier runs of the same pipeline count. A slowdown is
+    reported if it exceeds both `threshold` (relative) and `min_seconds`.
+    """
+    previous = [
+        r
+        for r in history
+        if r["pipeline"] == profile.pipeline
+        and r["job"] != profile.job
+        and r["state"] == "PIPELINE_STATE_SUCCEEDED"
+    ][-last:]
+    if not previous:
+        return []
+
+    def check(name: str, seconds: float, baseline: List[float]) -> Optional[str]:
+        if not baseline:
+            return None
+        median = statistics.median(baseline)
+        if seconds > median * (1 + threshold) and seconds - median > min_seconds:
+            return (
+                f"{name}: {_minutes(seconds)} vs median {_minutes(median)} "
+                f"over {len(baseline)} runs"
+            )
+        return None
+
+    regressions = [check("job", profile.seconds, [r["seconds"] for r in previous])]
+    for name, t in profile.tasks.items():
+        regressions.append(
+            check(
+                name,
+                t.total,
+                [r["tasks"][name]["total"] for r in previous if name in r["tasks"]],
+            )
+        )
+    return [r for r in regressions if r]
+
+
+def median_durations(history: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Median task durations, usable as `dag_analysis --durations`"""
+    totals: Dict[str, List[float]] = {}
+    for record in history:
+        for name, task in record["tasks"].items():
+            totals.setdefault(name, []).append(task["total"])
+    return {name: statistics.median(values) for name, values in totals.items()}
@@ -0,0 +1,98 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cache of BigQuery table schemas, stored next to the pipeline params.
+
+Infer the schema once, from a table loaded with autodetect:
+
+    python -m src.pipelines.trigger.schema_cache \\
+        --table svc-demo-vertex.pipeline_us.abalone_raw \\
+        --pipeline_params src/pipelines/tabular_classification/custom/params.json
+
+`VertexPipeline` then passes the cached schema as the `schema_json` pipeline
+parameter, and the bq_import components use it as an explicit
+`LoadJobConfig.schema` instead of re-inferring types on every load.
+"""
+
+import argparse
+import json
+import pathlib
+from typing import Any, Dict, List, Optional
+
+SCHEMA_PARAM = "schema_json"
+_schema_file_name = "schema.json"
+
+
+def schema_path(pipeline_params_path: str) -> pathlib.Path:
+    """Return the schema cache file next to a params file"""
+    return pathlib.Path(pipeline_params_path).parent / _schema_file_name
+
+
+def load(pipeline_params_path: str) -> Optional[List[Dict[str, Any]]]:
+    """Return the cached schema for a params file, if any"""
+    path = schema_path(pipeline_params_path)
+    if not path.is_file():
+        return None
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def save(pipeline_params_path: str, schema: List[Dict[str, Any]]) -> pathlib.Path:
+    """Write the schema cache next to a params file"""
+    path = schema_path(pipeline_params_path)
+    with open(path, "w") as json_file:
+        json.dump(schema, json_file, indent=4)
+        json_file.write("\n")
+    return path
+
+
+def infer_from_table(
+    table_id: str, project: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """Read the schema BigQuery inferred for an existing table"""
+    from google.cloud import bigquery
+
+    table = bigquery.Client(project=project).get_table(table_id)
+    return [field.to_api_repr() for field in table.schema]
+
+
+def with_cached_schema(
+    pipeline_params: Dict[str, Any], pipeline_params_path: str
+) -> Dict[str, Any]:
+    """Add the cached schema to the params unless they already set one"""
+    if SCHEMA_PARAM in pipeline_params:
+        return pipeline_params
+    schema = load(pipeline_params_path)
+    if schema is None:
+        return pipeline_params
+    return {**pipeline_params, SCHEMA_PARAM: json.dumps(schema)}
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse arguments"""
+    parser = argparse.ArgumentParser(
+        description="Cache the schema of a BigQuery table next to pipeline params"
+    )
+    parser.add_argument("--table", required=True, help="table to read the schema from.")
+    parser.add_argument(
+        "--pipeline_params", required=True, help="Pipeline params file."
+    )
+    parser.add_argument("--project", default=None, help="project ID.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    path = save(args.pipeline_params, infer_from_table(args.table, args.project))
+    print(f"Schema of {args.table} cached in {path}")
@@ -0,0 +1,478 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local stand-ins for the BigQuery and Vertex AI steps of a pipeline.
+
+A stand-in is a function taking the `TaskContext` of a task: it reads the
+resolved input parameters and artifacts and fills in the output artifacts
+and parameters, as the real component would. BigQuery tables live in a
+sqlite database (`LocalWarehouse`), GCS objects under a local directory.
+Steps with no local equivalent (model training, evaluation, deployment)
+produce placeholder outputs, so downstream tasks still get well-formed
+inputs.
+"""
+
+import contextlib
+import dataclasses
+import glob
+import json
+import pathlib
+import re
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import pyarrow as pa
+
+from src.components.bigquery.stream_import import iter_file_batches
+
+_table_id = re.compile(r"`([\w-]+(?:\.[\w-]+){1,2})`")
+_model_name = re.compile(r"\bMODEL\s+`?([\w.-]+)`?", re.IGNORECASE)
+_model_type = re.compile(r"model_type\s*=\s*'(\w+)'", re.IGNORECASE)
+
+_sqlite_types = [
+    (pa.types.is_integer, "INTEGER", "INTEGER"),
+    (pa.types.is_floating, "REAL", "FLOAT"),
+    (pa.types.is_boolean, "INTEGER", "BOOLEAN"),
+]
+
+
+class LocalWarehouse:
+    """A sqlite database standing in for BigQuery
+
+    `project.dataset.table` ids map to `dataset__table` tables, and
+    backquoted table ids in queries are rewritten accordingly. Queries run
+    as sqlite SQL: plain SELECTs work, BigQuery-only functions do not.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def table_name(table_id: str) -> str:
+        return "__".join(table_id.strip("`").split(".")[-2:]).replace("-", "_")
+
+    def translate(self, sql: str) -> str:
+        return _table_id.sub(lambda m: f'"{self.table_name(m.group(1))}"', sql)
+
+    def _connect(self) -> "contextlib.closing[sqlite3.Connection]":
+        return contextlib.closing(sqlite3.connect(self.path))
+
+    def execute(self, sql: str, parameters: Iterable[Any] = ()) -> List[sqlite3.Row]:
+        # one connection per call: tasks run in several threads. The
+        # connection's own context manager only commits, closing() closes it
+        with self._lock, self._connect() as connection, connection:
+            connection.row_factory = sqlite3.Row
+            return connection.execute(self.translate(sql), tuple(parameters)).fetchall()
+
+    def schema(self, table_id: str) -> List[Dict[str, str]]:
+        """BigQuery-style schema fields of a table"""
+        rows = self.execute(f'PRAGMA table_info("{self.table_name(table_id)}")')
+        return [{"name": row["name"], "type": row["type"] or "STRING"} for row in rows]
+
+    def num_rows(self, table_id: str) -> int:
+        return self.execute(f'SELECT COUNT(*) FROM "{self.table_name(table_id)}"')[0][0]
+
+    def load_file(
+        self,
+        path: str,
+        table_id: str,
+        source_format: str = "CSV",
+        replace: bool = True,
+    ) -> int:
+        """Load a CSV, Parquet or Arrow file into a table, return the rows loaded"""
+        table = self.table_name(table_id)
+        loaded = 0
+        with self._lock, self._connect() as connection, connection:
+            if replace:
+                connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+            for batch in iter_file_batches(path, source_format):
+                columns = ", ".join(
+                    f'"{field.name}" {_field_type(field)}' for field in batch.schema
+                )
+                connection.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+                placeholders = ", ".join("?" * batch.num_columns)
+                connection.executemany(
+                    f'INSERT INTO "{table}" VALUES ({placeholders})',
+                    zip(*(column.to_pylist() for column in batch.columns)),
+                )
+                loaded += batch.num_rows
+        return loaded
+
+
+def _field_type(field: pa.Field) -> str:
+    # declared with the BigQuery type name, sqlite only uses its affinity
+    return next(
+        (bq_type for check, _, bq_type in _sqlite_types if check(field.type)),
+        "STRING",
+    )
+
+
+@dataclasses.dataclass
+class TaskContext:
+    task: str
+    component: str
+    parameters: Dict[str, Any]
+    inputs: Dict[str, Any]
+    outputs: Dict[str, Any]
+    output_parameters: Dict[str, Any]
+    work_dir: pathlib.Path
+    warehouse: LocalWarehouse
+    # shown in the run report
+    notes: List[str] = dataclasses.field(default_factory=list)
+
+    def local_path(self, uri: str) -> str:
+        """Map a gs:// URI or /gcs/ path to the local stand-in of the bucket"""
+        for prefix in ("gs://", "/gcs/"):
+            if uri.startswith(prefix):
+                return str(self.work_dir / "gcs" / uri[len(prefix) :])
+        return uri
+
+
+StandIn = Callable[[TaskContext], None]
+
+
+def _table_metadata(project: str, table_id: str) -> Dict[str, str]:
+    parts = table_id.strip("`").split(".")
+    if len(parts) == 2:
+        parts = [project] + parts
+    return {"projectId": parts[0], "datasetId": parts[1], "tableId": parts[2]}
+
+
+def import_csv_to_bigquery(ctx: TaskContext) -> None:
+    p = ctx.parameters
+    table_id = (
+        f"{p['project']}.{p['bq_dataset']}.{p.get('table_name_prefix', 'abalone')}_raw"
+    )
+    rows = ctx.warehouse.load_file(
+        ctx.local_path(p["gcs_csv_uri"]), table_id, p.get("source_format") or "CSV"
+    )
+    print(f"Loaded {rows} rows into {table_id}")
+    raw_dataset = ctx.outputs["raw_dataset"]
+    raw_dataset.uri = f"bq://{table_id}"
+    raw_dataset.metadata["schema"] = ctx.warehouse.schema(table_id)
+
+
+def append_new_csvs_to_bigquery(ctx: TaskContext) -> None:
+    p = ctx.parameters
+    table_id = (
+        f"{p['project']}.{p['bq_dataset']}.{p.get('table_name_prefix', 'abalone')}_raw"
+    )
+    manifest = ctx.warehouse.table_name(f"{table_id}_manifest")
+    ctx.warehouse.execute(f'CREATE TABLE IF NOT EXISTS "{manifest}" (uri STRING)')
+    loaded = {
+        row["uri"] for row in ctx.warehouse.execute(f'SELECT uri FROM "{manifest}"')
+    }
+
+    new_files = sorted(
+        path
+        for path in glob.glob(ctx.local_path(p["gcs_csv_pattern"]))
+        if path not in loaded
+    )
+    for path in new_files:
+        ctx.warehouse.load_file(
+            path, table_id, p.get("source_format") or "CSV", replace=False
+        )
+        ctx.warehouse.execute(f'INSERT INTO "{manifest}" VALUES (?)', [path])
+
+    ctx.outputs["raw_dataset"].uri = f"bq://{table_id}"
+    ctx.outputs["raw_dataset"].metadata["files_loaded"] = len(new_files)
+
+
+def bigquery_query_job(ctx: TaskContext) -> None:
+    p = ctx.parameters
+    destination = json.loads(p.get("job_configuration_query") or "{}").get(
+        "destinationTable"
+    )
+    if destination:
+        table_id = ".".join(
+            destination[key] for key in ("projectId", "datasetId", "tableId")
+        )
+        table = ctx.warehouse.table_name(table_id)
+        ctx.warehouse.execute(f'DROP TABLE IF EXISTS "{table}"')
+        ctx.warehouse.execute(f'CREATE TABLE "{table}" AS {p["query"]}')
+    else:
+        table_id = f"{p['project']}.local.{ctx.task.replace('-', '_')}"
+        ctx.warehouse.execute(p["query"])
+    ctx.outputs["destination_table"].metadata.update(
+        _table_metadata(p["project"], table_id)
+    )
+
+
+def bigquery_create_model_job(ctx: TaskContext) -> None:
+    p = ctx.parameters
+    name = _model_name.search(p["query"])
+    model_type = _model_type.search(p["query"])
+    parts = name.group(1).split(".") if name else ["local", ctx.task]
+    if len(parts) == 2:
+        parts = [p["project"]] + parts
+    ctx.outputs["model"].metadata.update(
+        {
+            "projectId": parts[0],
+            "datasetId": parts[1],
+            "modelId": parts[2],
+            "modelType": model_type.group(1).lower() if model_type else "",
+        }
+    )
+
+
+# ML.EVALUATE columns per model type. Nothing is trained locally, so the
+# values are placeholders: they only exercise the downstream steps.
+_evaluation_columns = {
+    "classifier": [
+        "precision",
+        "recall",
+        "accuracy",
+        "f1_score",
+        "log_loss",
+        "roc_auc",
+    ],
+    "regressor": [
+        "mean_absolute_error",
+        "mean_squared_error",
+        "mean_squared_log_error",
+        "median_absolute_error",
+        "r2_score",
+        "explained_variance",
+    ],
+    "arima_plus": ["non_seasonal_p", "log_likelihood", "AIC", "variance"],
+}
+
+
+def _evaluation_rows(columns: List[str]) -> Dict[str, Any]:
+    return {
+        "schema": {"fields": [{"name": c, "type": "FLOAT"} for c in columns]},
+        "rows": [{"f": [{"v": "0.0"} for _ in columns]}],
+    }
+
+
+def bigquery_evaluate_model_job(ctx: TaskContext) -> None:
+    model_type = ctx.inputs["model"].metadata.get("modelType", "")
+    if model_type.startswith("arima"):
+        kind = "arima_plus"
+    elif model_type.endswith("regressor") or model_type == "linear_reg":
+        kind = "regressor"
+    else:
+        kind = "classifier"
+    ctx.outputs["evaluation_metrics"].metadata.update(
+        _evaluation_rows(_evaluation_columns[kind])
+    )
+
+
+def bigquery_ml_arima_evaluate_job(ctx: TaskContext) -> None:
+    ctx.outputs["arima_evaluation_metrics"].metadata.update(
+        _evaluation_rows(_evaluation_columns["arima_plus"])
+    )
+
+
+def predict_bqml_incremental(ctx: TaskContext) -> None:
+    """Copy the source rows past the watermark: nothing is trained locally"""
+    p = ctx.parameters
+    source = ctx.warehouse.table_name(p["source_table"])
+    destination = ctx.warehouse.table_name(p["destination_table"])
+    watermark_column = p.get("watermark_column", "")
+    append = watermark_column and ctx.warehouse.schema(p["destination_table"])
+    predictions = ctx.outputs["predictions"]
+    predictions.uri = f"bq://{p['destination_table']}"
+    predictions.metadata.update(_table_metadata(p["project"], p["destination_table"]))
+    if not ctx.warehouse.schema(p["source_table"]):
+        # e.g. a public table: there is nothing to score locally
+        predictions.metadata["rows_scored"] = 0
+        return
+
+    before = 0
+    if append:
+        before = ctx.warehouse.num_rows(p["destination_table"])
+        ctx.warehouse.execute(
+            f'INSERT INTO "{destination}" SELECT * FROM "{source}" '
+            f'WHERE "{watermark_column}" > '
+            f'(SELECT MAX("{watermark_column}") FROM "{destination}")'
+        )
+    else:
+        ctx.warehouse.execute(f'DROP TABLE IF EXISTS "{destination}"')
+        ctx.warehouse.execute(
+            f'CREATE TABLE "{destination}" AS SELECT * FROM "{source}"'
+        )
+
+    predictions.metadata["rows_scored"] = (
+        ctx.warehouse.num_rows(p["destination_table"]) - before
+    )
+
+
+def sample_training_table(ctx: TaskContext) -> None:
+    """Train on the whole table: local tables are small"""
+    bq_table = ctx.parameters["bq_table"]
+    ctx.outputs["sample"].uri = bq_table
+    ctx.outputs["sample"].metadata["fraction"] = 1.0
+    ctx.output_parameters.update(
+        {"bq_source": bq_table, "labels": {"sampling": "none"}, "fraction": 1.0}
+    )
+
+
+def profile_bigquery_table(ctx: TaskContext) -> None:
+    """Row and null counts only: sqlite has no approximate aggregates"""
+    p = ctx.parameters
+    table_id = (
+        p["bq_table"][len("bq://") :]
+        if p["bq_table"].startswith("bq://")
+        else p["bq_table"]
+    )
+    profile = ctx.outputs["profile"]
+    profile.uri = f"bq://{table_id}"
+    columns = [field["name"] for field in ctx.warehouse.schema(table_id)]
+    if not columns:
+        # e.g. a public table: there is nothing to profile locally
+        profile.metadata["rows"] = 0
+        return
+    counts = ", ".join(f'SUM("{c}" IS NULL)' for c in columns)
+    rows, *nulls = ctx.warehouse.execute(
+        f"SELECT COUNT(*), {counts} FROM `{table_id}`"
+    )[0]
+    profile.metadata.update(
+        {
+            "rows": rows,
+            "columns": {
+                c: {"nulls": n, "null_rate": n / rows if rows else 0.0}
+                for c, n in zip(columns, nulls)
+            },
+        }
+    )
+    ctx.outputs["statistics"].metadata.update(
+        {"rows": rows, "columns": len(columns), "cached": False, "violations": 0}
+    )
+
+
+def materialize_features(ctx: TaskContext) -> None:
+    """Train on the source table: transforms are BigQuery SQL"""
+    p = ctx.parameters
+    table_id = (
+        p["bq_table"][len("bq://") :]
+        if p["bq_table"].startswith("bq://")
+        else p["bq_table"]
+    )
+    ctx.outputs["features"].uri = f"bq://{table_id}"
+    ctx.outputs["features"].metadata.update(
+        {**_table_metadata(p["project"], table_id), "reused": True}
+    )
+    ctx.output_parameters["feature_table"] = table_id
+
+
+def record_bqml_candidate(ctx: TaskContext) -> None:
+    p = ctx.parameters
+    table = ctx.warehouse.table_name(p["leaderboard_table"])
+    ctx.warehouse.execute(
+        f'CREATE TABLE IF NOT EXISTS "{table}" '
+        "(run_id STRING, candidate STRING, model_id STRING, metrics STRING)"
+    )
+    metrics = {
+        k: v
+        for k, v in ctx.inputs["metrics"].metadata.items()
+        if isinstance(v, (int, float)) and not isinstance(v, bool)
+    }
+    ctx.warehouse.execute(
+        f'INSERT INTO "{table}" VALUES (?, ?, ?, ?)',
+        [
+            p["run_id"],
+            p["candidate"],
+            "{projectId}.{datasetId}.{modelId}".format(**ctx.inputs["model"].metadata),
+            json.dumps(metrics),
+        ],
+    )
+
+
+def select_bqml_champion(ctx: TaskContext) -> None:
+    """The first candidate with the metric: the local metrics are placeholders
+
+    Every candidate has the same 0.0 metrics, so ranking them would pick the
+    first one anyway; the report says so rather than presenting a winner.
+    """
+    p = ctx.parameters
+    rows = ctx.warehouse.execute(
+        f'SELECT candidate, model_id, metrics FROM "'
+        f'{ctx.warehouse.table_name(p["leaderboard_table"])}" WHERE run_id = ? '
+        "ORDER BY candidate",
+        [p["run_id"]],
+    )
+    row = next(row for row in rows if p["metric"] in json.loads(row["metrics"]))
+    project_id, dataset_id, model_id = row["model_id"].split(".")
+    ctx.outputs["champion"].metadata.update(
+        {"projectId": project_id, "datasetId": dataset_id, "modelId": model_id}
+    )
+    ctx.outputs["metrics"].metadata.update(
+        {"candidates": len(rows), "champion": row["candidate"]}
+    )
+    if len(rows) > 1:
+        ctx.notes.append(
+            f"local evaluation metrics are placeholders (all 0.0): {row['candidate']}"
+            f" is the first of {len(rows)} candidates by name, not the best by "
+            f"{p['metric']}"
+        )
+
+
+# artifact type -> resource collection of the placeholder resource name
+_resource_collections = {
+    "google.VertexModel": "models",
+    "google.VertexEndpoint": "endpoints",
+    "google.VertexDataset": "datasets",
+    "google.VertexBatchPredictionJob": "batchPredictionJobs",
+}
+
+
+def placeholder(ctx: TaskContext) -> None:
+    """Well-formed outputs for a step with no local equivalent"""
+    project = ctx.parameters.get("project", "local")
+    location = ctx.parameters.get("location", "local")
+    for name, artifact in ctx.outputs.items():
+        schema_title = getattr(artifact, "schema_title", "")
+        if schema_title == "google.BQTable":
+            artifact.metadata.update(
+                _table_metadata(project, f"local.{ctx.task}_{name}".replace("-", "_"))
+            )
+        elif schema_title == "google.BQMLModel":
+            artifact.metadata.update(
+                {"projectId": project, "datasetId": "local", "modelId": ctx.task}
+            )
+        else:
+            collection = _resource_collections.get(schema_title, "artifacts")
+            artifact.metadata[
+                "resourceName"
+            ] = f"projects/{project}/locations/{location}/{collection}/local-{ctx.task}"
+    for name in ctx.output_parameters:
+        ctx.output_parameters[name] = "{}" if name == "gcp_resources" else ""
+
+
+DEFAULT_STAND_INS: Dict[str, StandIn] = {
+    "import-csv-to-bigquery": import_csv_to_bigquery,
+    "append-new-csvs-to-bigquery": append_new_csvs_to_bigquery,
+    "bigquery-query-job": bigquery_query_job,
+    "bigquery-create-model-job": bigquery_create_model_job,
+    "bigquery-evaluate-model-job": bigquery_evaluate_model_job,
+    "bigquery-ml-arima-evaluate-job": bigquery_ml_arima_evaluate_job,
+    "predict-bqml-incremental": predict_bqml_incremental,
+    "record-bqml-candidate": record_bqml_candidate,
+    "select-bqml-champion": select_bqml_champion,
+    "sample-training-table": sample_training_table,
+    "profile-bigquery-table": profile_bigquery_table,
+    "materialize-features": materialize_features,
+}
+
+
+def stand_in_for(
+    component: str, stand_ins: Optional[Dict[str, StandIn]] = None
+) -> Optional[StandIn]:
+    """The stand-in registered for a component, e.g. `comp-bigquery-query-job-2`"""
+    stand_ins = DEFAULT_STAND_INS if stand_ins is None else stand_ins
+    name = component[len("comp-") :] if component.startswith("comp-") else component
+    return stand_ins.get(name) or stand_ins.get(re.sub(r"-\d+$", "", name))
@@ -0,0 +1,365 @@
+# Copyright 2022 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Online prediction client coalescing single predictions into batches.
+
+Callers await `predict(instance)` one instance at a time; the client queues
+the instances and sends them as one request once `max_batch_size` are
+waiting or the oldest has waited `max_latency_ms`. At most `max_in_flight`
+requests are sent at once, over one pooled HTTP session (or one gRPC
+channel), so the round trips are shared between callers.
+
+When all requests are in flight, batches wait; when `max_queue` instances
+are waiting, `predict` itself waits (backpressure). Failed requests are
+retried with exponential backoff if the error is transient (429, 5xx,
+connection errors).
+
+    async with MicroBatchingClient(endpoint_transport(endpoint, region)) as client:
+        predictions = await asyncio.gather(*(client.predict(i) for i in instances))
+    print(client.stats())
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import dataclasses
+import math
+import random
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+_retryable_status = frozenset({429, 500, 502, 503, 504})
+
+
+class PredictionError(Exception):
+    pass
+
+
+class RetryablePredictionError(PredictionError):
+    """A transient error: throttling, an unavailable server or a timeout"""
+
+
+class Histogram:
+    """Counts of observations per bucket upper bound, the last one unbounded"""
+
+    def __init__(self, bounds: Sequence[float]) -> None:
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = next(
+            (i for i, bound in enumerate(self.bounds) if value <= bound),
+            len(self.bounds),
+        )
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th percentile"""
+        if not self.count:
+            return 0.0
+        rank = max(math.ceil(q / 100 * self.count), 1)
+        seen = 0
+        for bound, count in zip(self.bounds + [math.inf], self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": {
+                str(bound): count
+                for bound, count in zip(self.bounds + ["+inf"], self.counts)
+            },
+        }
+
+
+class HttpTransport:
+    """POST `{"instances": [...]}` to a URL over a pooled requests session
+
+    The blocking calls run in a thread pool the size of the connection pool.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        pool_size: int = 8,
+        timeout: float = 60.0,
+        session: Optional[Any] = None,
+    ) -> None:
+        import requests
+
+        self.url = url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size)
+
+    def _post(self, instances: List[Any]) -> List[Any]:
+        import requests
+
+        try:
+            response = self.session.post(
+                self.url, json={"instances": instances}, timeout=self.timeout
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            raise RetryablePredictionError(str(e)) from e
+        if response.status_code != 200:
+            error = (
+                RetryablePredictionError
+                if response.status_code in _retryable_status
+                else PredictionError
+            )
+            raise error(f"{response.status_code}: {response.text[:200]}")
+        return response.json()["predictions"]
+
+    async def predict(self, instances: List[Any]) -> List[Any]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._post, instances)
+
+    async def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+class GrpcTransport:
+    """Predict with a Vertex AI endpoint over one asyncio gRPC channel"""
+
+    def __init__(self, endpoint: str, region: str) -> None:
+        # imported lazily: aiplatform is by far the slowest import
+        from google.api_core.client_options import ClientOptions
+        from google.cloud.aiplatform_v1.services.prediction_service import (
+            PredictionServiceAsyncClient,
+        )
+
+        self.endpoint = endpoint
+        self.client = PredictionServiceAsyncClient(
+            client_options=ClientOptions(
+                api_endpoint=f"{region}-aiplatform.googleapis.com"
+            )
+        )
+
+    async def predict(self, instances: List[Any]) -> List[Any]:
+        from google.api_core import exceptions
+        from google.protobuf import json_format, struct_pb2
+
+        values = [json_format.ParseDict(i, struct_pb2.Value()) for i in instances]
+        try:
+            response = await self.client.predict(
+                endpoint=self.endpoint, instances=values
+            )
+        except (
+            exceptions.TooManyRequests,
+            exceptions.ServiceUnavailable,
+            exceptions.InternalServerError,
+            exceptions.DeadlineExceeded,
+        ) as e:
+            raise RetryablePredictionError(str(e)) from e
+        except exceptions.GoogleAPICallError as e:
+            raise PredictionError(str(e)) from e
+        return [json_format.MessageToDict(p) for p in response._pb.predictions]
+
+    async def close(self) -> None:
+        await self.client.transport.close()
+
+
+def endpoint_transport(endpoint: str, region: str, pool_size: int = 8) -> HttpTransport:
+    """HTTP transport to a Vertex AI endpoint, with default credentials"""
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+
+    credentials, _ = google.auth.default(
+        scopes=["https://www.googleapis.com/auth/cloud-platform"]
+    )
+    return HttpTransport(
+        f"https://{region}-aiplatform.googleapis.com/v1/{endpoint}:predict",
+        pool_size=pool_size,
+        session=AuthorizedSession(credentials),
+    )
+
+
+@dataclasses.dataclass
+class _Pending:
+    instance: Any
+    future: asyncio.Future
+    queued: float
+
+
+class MicroBatchingClient:
+    """Coalesce `predict` calls into batched requests, see the module doc"""
+
+    def __init__(
+        self,
+        transport: Any,
+        max_batch_size: int = 32,
+        max_latency_ms: float = 5.0,
+        max_in_flight: int = 8,
+        max_queue: int = 1024,
+        retries: int = 3,
+        backoff_ms: float = 100.0,
+    ) -> None:
+        self.transport = transport
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.retries = retries
+        self.backoff = backoff_ms / 1000
+        self.request_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.prediction_latency_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.batch_size = Histogram(BATCH_SIZE_BUCKETS)
+        self.counters = {"requests": 0, "retries": 0, "failed_requests": 0}
+        # created by start(), on the loop they are used from
+        self._queue: asyncio.Queue
+        self._in_flight: asyncio.Semaphore
+        self._batcher: Optional[asyncio.Task] = None
+        self._requests: set = set()
+
+    async def __aenter__(self) -> "MicroBatchingClient":
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    def start(self) -> None:
+        """Start batching, on the running event loop"""
+        if self._batcher is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._batcher = asyncio.get_running_loop().create_task(self._batch())
+
+    async def predict(self, instance: Any) -> Any:
+        """The prediction of one instance, sent as part of a batch"""
+        self.start()
+        pending = _Pending(
+            instance, asyncio.get_running_loop().create_future(), time.perf_counter()
+        )
+        await self._queue.put(pending)
+        return await pending.future
+
+    async def predict_many(self, instances: Sequence[Any]) -> List[Any]:
+        return list(await asyncio.gather(*(self.predict(i) for i in instances)))
+
+    async def close(self) -> None:
+        """Send what is queued, wait for the requests in flight, then stop"""
+        if self._batcher is not None:
+            await self._queue.join()
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, return_exceptions=True)
+            self._batcher = None
+        if self._requests:
+            await asyncio.gather(*self._requests, return_exceptions=True)
+        await self.transport.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.counters,
+            "request_latency_ms": self.request_latency_ms.snapshot(),
+            "prediction_latency_ms": self.prediction_latency_ms.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+        }
+
+    async def _next_batch(self) -> List[_Pending]:
+        batch = [await self._queue.get()]
+        deadline = batch[0].queued + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _batch(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            # wait for a free slot before taking more instances off the queue
+            await self._in_flight.acquire()
+            request = asyncio.get_running_loop().create_task(self._send(batch))
+            self._requests.add(request)
+            request.add_done_callback(self._requests.discard)
+
+    async def _send(self, batch: List[_Pending]) -> None:
+        try:
+            predictions, error = await self._predict_with_retries(
+                [p.instance for p in batch]
+            )
+            self.batch_size.observe(len(batch))
+            now = time.perf_counter()
+            for i, pending in enumerate(batch):
+                self.prediction_latency_ms.observe((now - pending.queued) * 1000)
+                if pending.future.done():
+                    continue  # the caller was cancelled
+                if error is not None:
+                    pending.future.set_exception(error)
+                else:
+                    pending.future.set_result(predictions[i])
+        finally:
+            self._in_flight.release()
+            for _ in batch:
+                self._queue.task_done()
+
+    def _observe_request(self, start: float) -> None:
+        # the round trip only: backoff sleeps are not request latency
+        self.request_latency_ms.observe((time.perf_counter() - start) * 1000)
+
+    async def _predict_with_retries(
+        self, instances: List[Any]
+    ) -> Tuple[List[Any], Optional[Exception]]:
+        for attempt in range(self.retries + 1):
+            self.counters["requests"] += 1
+            start = time.perf_counter()
+            try:
+                predictions = await self.transport.predict(instances)
+            except PredictionError as e:
+                self._observe_request(start)
+                retryable = isinstance(e, RetryablePredictionError)
+                if not retryable or attempt == self.retries:
+                    self.counters["failed_requests"] += 1
+                    return [], e
+                self.counters["retries"] += 1
+                # full jitter, so retried batches do not come back together
+                delay = random.uniform(0, self.backoff * 2**attempt)  # noqa: S311
+                await asyncio.sleep(delay)
+                continue
+            except Exception as e:
+                self._observe_request(start)
+                self.counters["failed_requests"] += 1
+                return [], e
+            self._observe_request(start)
+            if len(predictions) != len(instances):
+                self.counters["failed_requests"] += 1
+                return [], PredictionError(
+                    f"{len(predictions)} predictions for {len(instances)} instances"
+                )
+            return predictions, None
+        raise AssertionError("unreachable")
@@ -0,0 +1,187 @@
+import pathlib
+import types
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from google.api_core.exceptions import Conflict, NotFound
+from google.cloud import bigquery
+import pytest
+import pytest_mock
+
+from src.pipelines.trigger import compile_cache
+
+
+@pytest.fixture(autouse=True)
+def isolated_compile_cache(
+    tmp_path_factory: pytest.TempPathFactory, monkeypatch: pytest.MonkeyPatch
+) -> pathlib.Path:
+    cache_dir = tmp_path_factory.mktemp("compile_cache")
+    monkeypatch.setenv(compile_cache.CACHE_DIR_ENV, str(cache_dir))
+    return cache_dir
+
+
+def artifact(**metadata: Any) -> types.SimpleNamespace:
+    """An output artifact passed to a component's `python_func`"""
+    return types.SimpleNamespace(uri=None, metadata=metadata)
+
+
+class QueryResult(list):
+    """The rows of a query, with the `total_rows` of a RowIterator"""
+
+    def __init__(
+        self, rows: Iterable[Any] = (), total_rows: Optional[int] = None
+    ) -> None:
+        super().__init__(rows)
+        self.total_rows = len(self) if total_rows is None else total_rows
+
+
+_epoch_ms = 1_658_361_600_000  # 2022-07-21
+
+
+def _table_id(table: Any) -> str:
+    if isinstance(table, str):
+        return table
+    return f"{table.project}.{table.dataset_id}.{table.table_id}"
+
+
+class FakeBigQuery:
+    """In-memory tables standing in for bigquery.Client
+
+    Tests add the tables (and models) their component reads, by ID, and
+    answer queries with `on_query(sql, job_config)`, which returns the rows
+    of the result. A query or a load job creates its destination table. Jobs
+    given an ID are kept: starting one again is a `Conflict`. Queries, load
+    jobs, created datasets, rows loaded, updated tables and deleted datasets
+    are recorded.
+    """
+
+    def __init__(self) -> None:
+        self.location = "US"
+        self.tables: Dict[str, Any] = {}
+        self.models: Dict[str, Any] = {}
+        self.on_query: Callable[[str, Any], Iterable[Any]] = lambda sql, config: []
+        self.queries: List[Tuple[str, Any]] = []
+        self.loads: List[Tuple[Any, str, Any]] = []
+        self.jobs: Dict[str, Any] = {}
+        self._tables_created = 0
+        self.datasets: List[Any] = []
+        self.loaded: Dict[str, List[Dict[str, Any]]] = {}
+        self.updated: List[Tuple[Any, List[str]]] = []
+        self.deleted: List[str] = []
+
+    def __call__(self, *args: Any, **kwargs: Any) -> "FakeBigQuery":
+        return self
+
+    def get_dataset(self, dataset_id: str) -> Any:
+        return types.SimpleNamespace(location=self.location)
+
+    def create_dataset(self, dataset: Any, **kwargs: Any) -> Any:
+        self.datasets.append(dataset)
+        return dataset
+
+    def delete_dataset(self, dataset_id: str, **kwargs: Any) -> None:
+        self.deleted.append(dataset_id)
+
+    def get_table(self, table: Any) -> Any:
+        table_id = _table_id(table)
+        if table_id not in self.tables:
+            raise NotFound(table_id)
+        return self.tables[table_id]
+
+    def delete_table(self, table: Any, not_found_ok: bool = False) -> None:
+        table_id = _table_id(table)
+        if table_id not in self.tables and not not_found_ok:
+            raise NotFound(table_id)
+        self.tables.pop(table_id, None)
+
+    def create_table(self, table: Any, exists_ok: bool = False) -> Any:
+        table_id = _table_id(table)
+        if table_id in self.tables:
+            if not exists_ok:
+                raise Conflict(table_id)
+            return self.tables[table_id]
+        if isinstance(table, bigquery.Table):
+            # set by the service: every table created gets a later time
+            self._tables_created += 1
+            table._properties["creationTime"] = str(_epoch_ms + self._tables_created)
+        self.tables[table_id] = table
+        return table
+
+    def list_tables(self, dataset_id: str) -> List[Any]:
+        return [
+            types.SimpleNamespace(
+                project=table_id.split(".")[0],
+                dataset_id=table_id.split(".")[1],
+                table_id=table_id.split(".")[2],
+            )
+            for table_id in self.tables
+            if table_id.rsplit(".", 1)[0] == dataset_id
+        ]
+
+    def update_table(self, table: Any, fields: List[str]) -> Any:
+        self.updated.append((table, fields))
+        return table
+
+    def get_model(self, model_id: str) -> Any:
+        if model_id not in self.models:
+            raise NotFound(model_id)
+        return self.models[model_id]
+
+    def query(self, sql: str, job_config: Any = None, **kwargs: Any) -> Any:
+        self.queries.append((sql, job_config))
+        rows = self.on_query(sql, job_config)
+        result = rows if isinstance(rows, QueryResult) else QueryResult(rows)
+        destination = getattr(job_config, "destination", None)
+        if destination is not None:
+            self.tables.setdefault(_table_id(destination), types.SimpleNamespace())
+        return types.SimpleNamespace(result=lambda: result, total_bytes_processed=100)
+
+    def get_job(self, job_id: str) -> Any:
+        if job_id not in self.jobs:
+            raise NotFound(job_id)
+        return self.jobs[job_id]
+
+    def _start_job(self, job_id: Optional[str], destination: str) -> Any:
+        if job_id in self.jobs:
+            raise Conflict(job_id)
+        job = types.SimpleNamespace(
+            result=lambda: None,
+            job_id=job_id or f"job_{len(self.jobs)}",
+            destination=destination,
+        )
+        self.jobs[job.job_id] = job
+        return job
+
+    def load_table_from_uri(
+        self,
+        source_uris: Any,
+        table_id: str,
+        job_config: Any = None,
+        job_id: Optional[str] = None,
+    ) -> Any:
+        job = self._start_job(job_id, table_id)
+        self.loads.append((source_uris, table_id, job_config))
+        self.tables.setdefault(
+            table_id,
+            types.SimpleNamespace(
+                labels={}, num_rows=0, schema=getattr(job_config, "schema", None) or []
+            ),
+        )
+        return job
+
+    def load_table_from_json(
+        self,
+        rows: List[Dict[str, Any]],
+        table_id: str,
+        job_config: Any = None,
+        job_id: Optional[str] = None,
+    ) -> Any:
+        job = self._start_job(job_id, table_id)
+        self.loaded.setdefault(table_id, []).extend(rows)
+        return job
+
+
+@pytest.fixture
+def fake_bigquery(mocker: pytest_mock.MockerFixture) -> FakeBigQuery:
+    fake = FakeBigQuery()
+    mocker.patch("google.cloud.bigquery.Client", fake)
+    return fake
@@ -0,0 +1,83 @@
+import types
+from typing import Any, List
+
+from google.cloud import bigquery
+
+from src.components.bigquery.batch_predict_shards import (
+    merge_batch_predictions,
+    shard_batch_prediction_input,
+)
+from tests.conftest import artifact, FakeBigQuery
+
+_prediction_schema = [
+    bigquery.SchemaField("store_name", "STRING"),
+    bigquery.SchemaField("date", "TIMESTAMP"),
+    bigquery.SchemaField("predicted_sale_dollars", "RECORD"),
+]
+_explanation_schema = _prediction_schema + [
+    bigquery.SchemaField("explanation", "RECORD")
+]
+
+
+def _shard_output(table_id: str, schema: List[Any]) -> types.SimpleNamespace:
+    return types.SimpleNamespace(
+        table_id=table_id,
+        full_table_id=f"project:staging.{table_id}",
+        schema=schema,
+    )
+
+
+def test_shards_by_id_hash(fake_bigquery: FakeBigQuery) -> None:
+    shards, explained, staging = shard_batch_prediction_input.python_func(
+        bigquery_source_input_uri="bq://public-data:sales.predict",
+        bigquery_destination_output_uri="bq://project",
+        id_column="store_name",
+        run_id="1234-abcd",
+        num_shards=4,
+        explained_shards=1,
+    )
+
+    assert staging == "project.batch_predict_1234_abcd"
+    assert explained == [
+        {
+            "source": "bq://project.batch_predict_1234_abcd.shard_0",
+            "destination": "bq://project.batch_predict_1234_abcd.explained_0",
+        }
+    ]
+    assert [s["destination"][-len("predictions_1") :] for s in shards] == [
+        "predictions_1",
+        "predictions_2",
+        "predictions_3",
+    ]
+    view = fake_bigquery.tables["project.batch_predict_1234_abcd.shard_3"].view_query
+    assert "FROM `public-data.sales.predict`" in view
+    assert "FARM_FINGERPRINT(CAST(`store_name` AS STRING))), 4) = 3" in view
+
+
+def test_merge_on_common_columns(fake_bigquery: FakeBigQuery) -> None:
+    for table_id, schema in [
+        ("shard_0", []),
+        ("explained_0", _explanation_schema),
+        ("predictions_1", _prediction_schema),
+        ("errors_1", []),
+    ]:
+        fake_bigquery.tables[f"project.staging.{table_id}"] = _shard_output(
+            table_id, schema
+        )
+    predictions = artifact()
+
+    merge_batch_predictions.python_func(
+        staging_dataset="project.staging",
+        predictions=predictions,
+        predictions_table="project.sales.predictions",
+    )
+
+    (merged_sql, merged), (explained_sql, explained) = fake_bigquery.queries
+    assert merged.destination.table_id == "predictions"
+    assert merged_sql.count("UNION ALL") == 1
+    assert "explanation" not in merged_sql
+    assert explained.destination.table_id == "predictions_explanations"
+    assert explained_sql == "SELECT * FROM `project.staging.explained_0`"
+    assert fake_bigquery.deleted == ["project.staging"]
+    assert predictions.uri == "bq://project.sales.predictions"
+    assert predictions.metadata["shards"] == 2
@@ -0,0 +1,65 @@
+import json
+import pathlib
+
+from src.pipelines.trigger import benchmark
+
+_module = "src.pipelines.tabular_regression.bqml.pipeline"
+
+
+def test_run_compile_and_metrics(tmp_path: pathlib.Path) -> None:
+    document = benchmark.run(
+        suites=["compile", "metrics"], modules=[_module], sizes={"tiny": 10}, repeat=1
+    )
+    results = document["results"]
+    assert set(results) == {
+        "compile/tabular_regression_bqml",
+        "spec_size/tabular_regression_bqml",
+        "metrics/bqml/tiny",
+        "metrics/automl_classification/tiny",
+        "metrics/automl_regression",
+    }
+    assert results["compile/tabular_regression_bqml"]["unit"] == "s"
+    assert results["spec_size/tabular_regression_bqml"]["value"] > 1000
+    assert all(result["value"] > 0 for result in results.values())
+
+    path = str(tmp_path / "baseline.json")
+    benchmark.save(document, path)
+    assert benchmark.load(path) == json.loads(json.dumps(document))
+
+
+def _document(**values: float) -> dict:
+    return {
+        "results": {
+            name.replace("__", "/"): {"value": value, "unit": "s"}
+            for name, value in values.items()
+        }
+    }
+
+
+def test_compare_flags_regressions() -> None:
+    baseline = _document(compile__a=1.0, compile__b=1.0, metrics__c=0.001, old=1.0)
+    current = _document(compile__a=1.5, compile__b=1.1, metrics__c=0.002, new=1.0)
+
+    comparisons = {c.name: c for c in benchmark.compare(current, baseline, 0.2)}
+
+    assert comparisons["compile/a"].regressed
+    assert comparisons["compile/a"].ratio == 1.5
+    assert not comparisons["compile/b"].regressed
+    # doubled, but a 1 ms difference is below the noise floor
+    assert not comparisons["metrics/c"].regressed
+    assert comparisons["old"].current is None
+    assert comparisons["new"].baseline is None
+    report = benchmark.format_comparison(list(comparisons.values()))
+    assert report.endswith("1 regression(s)")
+
+
+def test_compare_cli(tmp_path: pathlib.Path) -> None:
+    baseline_path, current_path = tmp_path / "baseline.json", tmp_path / "current.json"
+    benchmark.save(_document(compile__a=1.0), str(baseline_path))
+    benchmark.save(_document(compile__a=2.0), str(current_path))
+    args = benchmark.parse_args(
+        ["compare", "--baseline", str(baseline_path), "--current", str(current_path)]
+    )
+    assert benchmark.main(args) == 1
+    args.threshold = 1.5
+    assert benchmark.main(args) == 0
@@ -0,0 +1,187 @@
+import json
+import types
+from typing import Any, Dict, List
+from unittest import mock
+
+from google.cloud import bigquery
+import pytest
+import pytest_mock
+
+from src.components.bigquery.bq_import import (
+    append_new_csvs_to_bigquery,
+    import_csv_to_bigquery,
+)
+from tests.conftest import artifact, FakeBigQuery
+
+_manifest_id = "project.dataset.abalone_raw_manifest"
+
+
+@pytest.fixture
+def blob() -> types.SimpleNamespace:
+    return types.SimpleNamespace(generation=1, md5_hash="abc", crc32c="x", size=10)
+
+
+@pytest.fixture
+def fake_bigquery(
+    fake_bigquery: FakeBigQuery,
+    mocker: pytest_mock.MockerFixture,
+    blob: types.SimpleNamespace,
+) -> FakeBigQuery:
+    def on_query(sql: str, job_config: Any) -> List[Any]:
+        assert _manifest_id in sql
+        return fake_bigquery.loaded.get(_manifest_id, [])
+
+    fake_bigquery.on_query = on_query
+    storage_client = mocker.patch("google.cloud.storage.Client")
+    storage_client.return_value.bucket.return_value.get_blob.return_value = blob
+    return fake_bigquery
+
+
+def _job_configs(fake_bigquery: FakeBigQuery) -> List[Any]:
+    return [job_config for _, _, job_config in fake_bigquery.loads]
+
+
+def _manifest(fake_bigquery: FakeBigQuery) -> List[Dict[str, Any]]:
+    return fake_bigquery.loaded.get(_manifest_id, [])
+
+
+def _import(**kwargs: Any) -> types.SimpleNamespace:
+    raw_dataset = artifact()
+    import_csv_to_bigquery.python_func(
+        project="project",
+        bq_location="US",
+        bq_dataset="dataset",
+        gcs_csv_uri="gs://bucket/abalone.csv",
+        raw_dataset=raw_dataset,
+        **kwargs,
+    )
+    return raw_dataset
+
+
+def test_import_skips_unchanged_source(
+    fake_bigquery: FakeBigQuery, blob: types.SimpleNamespace
+) -> None:
+    assert _import().uri == "bq://project.dataset.abalone_raw"
+    assert _import().uri == "bq://project.dataset.abalone_raw"
+    assert len(fake_bigquery.loads) == 1
+
+    blob.generation = 2
+    _import()
+    assert len(fake_bigquery.loads) == 2
+
+
+def test_import_reloads_when_skip_disabled(fake_bigquery: FakeBigQuery) -> None:
+    _import()
+    _import(skip_if_unchanged=False)
+    assert len(fake_bigquery.loads) == 2
+    assert fake_bigquery.tables["project.dataset.abalone_raw"].labels[
+        "source_fingerprint"
+    ]
+
+
+def test_import_with_explicit_schema(fake_bigquery: FakeBigQuery) -> None:
+    schema = [{"name": "Sex", "type": "STRING"}, {"name": "Rings", "type": "INTEGER"}]
+    raw_dataset = _import(schema_json=json.dumps(schema))
+
+    job_config = _job_configs(fake_bigquery)[-1]
+    assert not job_config.autodetect
+    assert job_config.skip_leading_rows == 1
+    assert [field.name for field in job_config.schema] == ["Sex", "Rings"]
+    assert [field["name"] for field in raw_dataset.metadata["schema"]] == [
+        "Sex",
+        "Rings",
+    ]
+
+
+def test_import_parquet(fake_bigquery: FakeBigQuery) -> None:
+    _import(source_format="parquet")
+    job_config = _job_configs(fake_bigquery)[-1]
+    assert job_config.source_format == bigquery.SourceFormat.PARQUET
+    assert not job_config.autodetect
+
+
+def _append(**kwargs: Any) -> types.SimpleNamespace:
+    raw_dataset = artifact()
+    append_new_csvs_to_bigquery.python_func(
+        project="project",
+        bq_location="US",
+        bq_dataset="dataset",
+        raw_dataset=raw_dataset,
+        **{"gcs_csv_pattern": "gs://landing/daily/*.csv", **kwargs},
+    )
+    return raw_dataset
+
+
+@pytest.fixture
+def blobs(mocker: pytest_mock.MockerFixture) -> List[types.SimpleNamespace]:
+    blobs = [
+        types.SimpleNamespace(name=f"daily/{i}.csv", generation=1) for i in range(5)
+    ]
+    blobs.append(types.SimpleNamespace(name="daily/readme.txt", generation=1))
+    list_blobs = mocker.patch("google.cloud.storage.Client").return_value.list_blobs
+    list_blobs.return_value = blobs
+    return blobs
+
+
+def test_append_loads_only_new_files(
+    fake_bigquery: FakeBigQuery, blobs: List[types.SimpleNamespace]
+) -> None:
+    raw_dataset = _append(max_files_per_job=2)
+    assert raw_dataset.uri == "bq://project.dataset.abalone_raw"
+    assert raw_dataset.metadata["files_loaded"] == 5
+    assert [len(uris) for uris, _, _ in fake_bigquery.loads] == [2, 2, 1]
+    assert len({row["load_job_id"] for row in _manifest(fake_bigquery)}) == 3
+
+    blobs.append(types.SimpleNamespace(name="daily/5.csv", generation=1))
+    raw_dataset = _append(max_files_per_job=2)
+    assert raw_dataset.metadata["files_loaded"] == 1
+    assert fake_bigquery.loads[-1][0] == ["gs://landing/daily/5.csv"]
+
+
+def test_append_lists_by_literal_prefix(
+    fake_bigquery: FakeBigQuery, mocker: pytest_mock.MockerFixture
+) -> None:
+    list_blobs = mocker.patch("google.cloud.storage.Client").return_value.list_blobs
+    list_blobs.return_value = [types.SimpleNamespace(name="a.csv", generation=1)]
+
+    assert _append().metadata["files_loaded"] == 0
+    list_blobs.assert_called_with("landing", prefix="daily/")
+    assert _append(gcs_csv_pattern="gs://landing").metadata["files_loaded"] == 1
+    list_blobs.assert_called_with("landing", prefix="")
+
+
+def test_append_refuses_overwritten_files(
+    fake_bigquery: FakeBigQuery, blobs: List[types.SimpleNamespace]
+) -> None:
+    _append()
+    blobs[0].generation = 2
+    with pytest.raises(ValueError, match="gs://landing/daily/0.csv"):
+        _append()
+    assert len(fake_bigquery.loads) == 1
+
+
+def test_append_retry_does_not_load_twice(
+    fake_bigquery: FakeBigQuery, blobs: List[types.SimpleNamespace]
+) -> None:
+    with mock.patch.object(
+        fake_bigquery, "load_table_from_json", side_effect=RuntimeError("timeout")
+    ), pytest.raises(RuntimeError):
+        _append()
+    assert not _manifest(fake_bigquery)
+
+    assert _append().metadata["files_loaded"] == 5
+    assert len(fake_bigquery.loads) == 1
+    assert len(_manifest(fake_bigquery)) == 5
+
+
+def test_append_reloads_a_rebuilt_table(
+    fake_bigquery: FakeBigQuery, blobs: List[types.SimpleNamespace]
+) -> None:
+    _append()
+    fake_bigquery.delete_table("project.dataset.abalone_raw")
+    fake_bigquery.delete_table(_manifest_id)
+    fake_bigquery.loaded.pop(_manifest_id)
+
+    assert _append().metadata["files_loaded"] == 5
+    assert len(fake_bigquery.loads) == 2
+    assert "project.dataset.abalone_raw" in fake_bigquery.tables
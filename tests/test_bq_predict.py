@@ -0,0 +1,102 @@
+import datetime
+import types
+from typing import Any
+
+from google.cloud import bigquery
+import pytest
+
+from src.components.bigquery.bq_predict import predict_bqml_incremental
+from tests.conftest import artifact, FakeBigQuery, QueryResult
+
+_schema = [
+    bigquery.SchemaField("id", "STRING"),
+    bigquery.SchemaField("length", "FLOAT"),
+    bigquery.SchemaField("sex", "STRING"),
+    bigquery.SchemaField("ingested_at", "TIMESTAMP"),
+    bigquery.SchemaField("Rings", "INTEGER"),
+]
+_watermark = datetime.datetime(2022, 7, 21, tzinfo=datetime.timezone.utc)
+
+
+@pytest.fixture
+def fake_bigquery(fake_bigquery: FakeBigQuery) -> FakeBigQuery:
+    fake_bigquery.tables["project.dataset.abalone"] = types.SimpleNamespace(
+        schema=_schema
+    )
+    fake_bigquery.models["project.dataset.abalone_model"] = types.SimpleNamespace(
+        feature_columns=[types.SimpleNamespace(name=n) for n in ("length", "sex")]
+    )
+
+    def on_query(sql: str, job_config: Any) -> Any:
+        if sql.startswith("SELECT MAX"):
+            return [{"watermark": _watermark}]
+        return QueryResult(total_rows=3)
+
+    fake_bigquery.on_query = on_query
+    return fake_bigquery
+
+
+def _predict(**kwargs: Any) -> types.SimpleNamespace:
+    model = types.SimpleNamespace(
+        metadata={
+            "projectId": "project",
+            "datasetId": "dataset",
+            "modelId": "abalone_model",
+        }
+    )
+    predictions = artifact()
+    predict_bqml_incremental.python_func(
+        project="project",
+        bq_location="US",
+        model=model,
+        source_table="project.dataset.abalone",
+        destination_table="project.dataset.predictions",
+        predictions=predictions,
+        **kwargs,
+    )
+    return predictions
+
+
+def test_full_scoring_overwrites(fake_bigquery: FakeBigQuery) -> None:
+    predictions = _predict()
+
+    sql, job_config = fake_bigquery.queries[-1]
+    assert "WHERE" not in sql
+    assert "SELECT * FROM `project.dataset.abalone`" in sql
+    assert job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE
+    assert job_config.time_partitioning is None
+    assert predictions.uri == "bq://project.dataset.predictions"
+    assert predictions.metadata["rows_scored"] == 3
+
+
+def test_incremental_scoring_appends_past_watermark(
+    fake_bigquery: FakeBigQuery,
+) -> None:
+    first = _predict(watermark_column="ingested_at", cluster_columns="sex")
+    sql, job_config = fake_bigquery.queries[-1]
+    assert "WHERE" not in sql
+    assert first.metadata["previous_watermark"] is None
+
+    second = _predict(watermark_column="ingested_at", cluster_columns="sex")
+    sql, job_config = fake_bigquery.queries[-1]
+    assert sql.endswith("WHERE `ingested_at` > @watermark))")
+    (parameter,) = job_config.query_parameters
+    assert parameter.type_ == "TIMESTAMP" and parameter.value == _watermark
+    assert job_config.write_disposition == bigquery.WriteDisposition.WRITE_APPEND
+    assert job_config.time_partitioning.field == "ingested_at"
+    assert job_config.clustering_fields == ["sex"]
+    assert second.metadata["previous_watermark"] == str(_watermark)
+
+
+def test_prune_features(fake_bigquery: FakeBigQuery) -> None:
+    _predict(
+        watermark_column="ingested_at", prune_features=True, passthrough_columns="id"
+    )
+    sql, _ = fake_bigquery.queries[-1]
+    assert "SELECT `length`, `sex`, `ingested_at`, `id` FROM" in sql
+    assert "Rings" not in sql
+
+
+def test_unknown_column(fake_bigquery: FakeBigQuery) -> None:
+    with pytest.raises(ValueError, match="No column day"):
+        _predict(watermark_column="ingested_at", partition_column="day")
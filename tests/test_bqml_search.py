@@ -0,0 +1,93 @@
+import json
+import types
+from typing import Any, List
+
+import pytest
+import pytest_mock
+
+from src.components.bigquery.bqml_search import bqml_candidates, select_bqml_champion
+
+
+def _candidates(candidates: List[dict], **kwargs: Any) -> Any:
+    return bqml_candidates.python_func(
+        project="project",
+        model="dataset.abalone_model",
+        bq_table="project.dataset.abalone",
+        label="Rings",
+        candidates=candidates,
+        **kwargs,
+    )
+
+
+def test_single_candidate_keeps_model_name() -> None:
+    [candidate], leaderboard = _candidates([{"model_type": "BOOSTED_TREE_REGRESSOR"}])
+    assert candidate["query"] == (
+        "CREATE OR REPLACE MODEL dataset.abalone_model "
+        "OPTIONS (model_type='BOOSTED_TREE_REGRESSOR', labels=['Rings']) "
+        "AS SELECT * FROM `project.dataset.abalone`"
+    )
+    assert leaderboard == "project.dataset.abalone_model_leaderboard"
+
+
+def test_candidate_options() -> None:
+    candidates, _ = _candidates(
+        [
+            {"model_type": "LINEAR_REG"},
+            {
+                "model_type": "BOOSTED_TREE_REGRESSOR",
+                "name": "deep",
+                "options": {"max_tree_depth": 10, "early_stop": False},
+            },
+        ],
+        leaderboard_table="project.search.runs",
+    )
+    assert [c["name"] for c in candidates] == ["0", "deep"]
+    assert "MODEL dataset.abalone_model_0 " in candidates[0]["query"]
+    assert "max_tree_depth=10, early_stop=FALSE)" in candidates[1]["query"]
+
+    with pytest.raises(ValueError, match="letters"):
+        _candidates([{"model_type": "LINEAR_REG", "name": "a-b"}])
+
+
+@pytest.mark.parametrize(
+    "metric, champion",
+    [("mean_absolute_error", "boosted"), ("r2_score", "boosted"), ("log_loss", "")],
+)
+def test_select_champion(
+    mocker: pytest_mock.MockerFixture, metric: str, champion: str
+) -> None:
+    rows = [
+        {
+            "candidate": "linear",
+            "model_id": "project.dataset.model_linear",
+            "metrics": json.dumps({"mean_absolute_error": 2.0, "r2_score": 0.4}),
+        },
+        {
+            "candidate": "boosted",
+            "model_id": "project.dataset.model_boosted",
+            "metrics": json.dumps({"mean_absolute_error": 1.5, "r2_score": 0.6}),
+        },
+    ]
+    client = mocker.patch("google.cloud.bigquery.Client").return_value
+    client.query.return_value.result.return_value = rows
+    artifact = types.SimpleNamespace(uri=None, metadata={})
+    metrics = mocker.Mock()
+
+    def select() -> None:
+        select_bqml_champion.python_func(
+            project="project",
+            bq_location="US",
+            leaderboard_table="project.dataset.leaderboard",
+            run_id="run",
+            metric=metric,
+            champion=artifact,
+            metrics=metrics,
+        )
+
+    if not champion:
+        with pytest.raises(ValueError, match="log_loss"):
+            select()
+        return
+    select()
+    assert artifact.metadata["modelId"] == f"model_{champion}"
+    metrics.log_metric.assert_any_call("champion", champion)
@@ -0,0 +1,78 @@
+import json
+import pathlib
+
+import pytest
+
+from src.pipelines.tabular_classification.bqml.pipeline import (
+    TabularClassificationBQMLPipeline,
+)
+from src.pipelines.trigger import bundle
+
+_repository = "us-docker.pkg.dev/project/repo/components"
+
+
+def test_bundle_template(tmp_path: pathlib.Path) -> None:
+    template_path = str(tmp_path / "pipeline.json")
+    TabularClassificationBQMLPipeline().compile_pipeline(template_path)
+    with open(template_path) as f:
+        original = json.load(f)
+    assert bundle.runtime_installs(original)
+
+    report = bundle.bundle_template(
+        template_path, _repository, bundle_dir=str(tmp_path / "bundle")
+    )
+
+    with open(template_path) as f:
+        spec = json.load(f)
+    executors = spec["pipelineSpec"]["deploymentSpec"]["executors"]
+    interpret = executors["exec-interpret-bqml-evaluation-metrics"]["container"]
+    assert interpret["image"] == report.image_uri
+    assert report.image_uri.startswith(f"{_repository}:")
+    assert interpret["command"][:2] == ["sh", "-ec"]
+    assert not bundle.runtime_installs(spec)
+    # components on another base image keep their own install step
+    scoring = executors["exec-score-saved-model"]["container"]
+    assert scoring["image"] == "tensorflow/tensorflow:2.6.5"
+    assert "pip install" in scoring["command"][2]
+    # GCPC container components are left alone
+    assert executors["exec-model-upload"] == (
+        original["pipelineSpec"]["deploymentSpec"]["executors"]["exec-model-upload"]
+    )
+
+    requirements = (tmp_path / "bundle" / "requirements.txt").read_text().split()
+    assert requirements == report.requirements
+    assert all("==" in requirement for requirement in requirements)
+    assert {r.split("==")[0] for r in requirements} >= {"kfp", "numpy", "pyarrow"}
+    assert "FROM python:3.9" in (tmp_path / "bundle" / "Dockerfile").read_text()
+    assert sum(report.estimated_seconds_saved_per_task.values()) > 0
+
+
+def test_image_uri_is_content_addressed() -> None:
+    first = bundle.image_uri(
+        _repository, ["kfp==1.8.22", "numpy==1.23.0"], "python:3.9"
+    )
+    assert first == bundle.image_uri(
+        _repository, ["kfp==1.8.22", "numpy==1.23.0"], "python:3.9"
+    )
+    assert first != bundle.image_uri(
+        _repository, ["kfp==1.8.22", "numpy==1.24.0"], "python:3.9"
+    )
+
+
+def test_pin_prefers_lock_file() -> None:
+    requirements = bundle.bundle_requirements(
+        {"a": ["google-cloud-aiplatform", "kfp==1.8.22"], "b": ["kfp"]},
+        locked={"google-cloud-aiplatform": "1.15.1", "kfp": "1.8.13"},
+    )
+    assert requirements == ["google-cloud-aiplatform==1.15.1", "kfp==1.8.22"]
+
+
+def test_pin_rejects_unlocked_requirement() -> None:
+    with pytest.raises(ValueError, match="tensorflow-cpu"):
+        bundle.bundle_requirements(
+            {"a": ["kfp", "tensorflow-cpu"]}, locked={"kfp": "1.8.13"}
+        )
+    # an explicit pin does not need the lock
+    assert bundle.bundle_requirements(
+        {"a": ["kfp", "tensorflow-cpu==2.6.5"]}, locked={"kfp": "1.8.13"}
+    ) == ["kfp==1.8.13", "tensorflow-cpu==2.6.5"]
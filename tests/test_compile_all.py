@@ -0,0 +1,38 @@
+import json
+import pathlib
+
+from src.pipelines.trigger import compile_all
+
+
+def test_discover_pipeline_modules() -> None:
+    modules = compile_all.discover_pipeline_modules()
+    assert "src.pipelines.forecasting.bqml.pipeline" in modules
+    assert "src.pipelines.tabular_classification.automl_evaluation.pipeline" in modules
+    assert not [m for m in modules if ".trigger." in m]
+
+
+def test_compile_all(tmp_path: pathlib.Path) -> None:
+    results = compile_all.compile_all(
+        str(tmp_path),
+        modules=[
+            "src.pipelines.tabular_regression.bqml.pipeline",
+            "src.pipelines.tabular_classification.custom.pipeline",
+            "src.pipelines.does_not.exist.pipeline",
+        ],
+        max_workers=2,
+    )
+
+    by_module = {r.module: r for r in results}
+    assert by_module["src.pipelines.does_not.exist.pipeline"].error
+    regression = by_module["src.pipelines.tabular_regression.bqml.pipeline"]
+    assert regression.error is None
+    assert regression.pipeline == "TabularRegressionBQMLPipeline"
+    template = json.loads((tmp_path / "tabular_regression_bqml.json").read_text())
+    assert template["pipelineSpec"]["pipelineInfo"]["name"] == (
+        "tabular-regression-bqml-pipeline"
+    )
+    assert (tmp_path / "tabular_classification_custom.json").is_file()
+
+    report = compile_all.format_report(results)
+    assert "TabularRegressionBQMLPipeline" in report
+    assert "FAILED" in report
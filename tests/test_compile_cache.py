@@ -0,0 +1,63 @@
+import pathlib
+
+import pytest
+import pytest_mock
+
+from src.pipelines.tabular_classification.automl.pipeline import (
+    TabularClassificationAutoMLPipeline,
+)
+from src.pipelines.tabular_classification.bqml.pipeline import (
+    TabularClassificationBQMLPipeline,
+)
+from src.pipelines.tabular_regression.automl.pipeline import (
+    TabularRegressionAutoMLPipeline,
+)
+from src.pipelines.trigger import compile_cache
+
+
+def test_cache_key_is_stable() -> None:
+    key = compile_cache.cache_key(TabularRegressionAutoMLPipeline())
+    assert key == compile_cache.cache_key(TabularRegressionAutoMLPipeline())
+    assert key != compile_cache.cache_key(TabularClassificationAutoMLPipeline())
+
+
+# a component module, and a helper only reached through src.pipelines.trigger
+@pytest.mark.parametrize("changed", ["sample.py", "schema_cache.py"])
+def test_cache_key_tracks_imported_sources(
+    mocker: pytest_mock.MockerFixture, changed: str
+) -> None:
+    key = compile_cache.cache_key(TabularRegressionAutoMLPipeline())
+    read_text = pathlib.Path.read_text
+
+    def patched_read_text(path: pathlib.Path, *args: str, **kwargs: str) -> str:
+        source = read_text(path, *args, **kwargs)
+        if path.name == changed:
+            source += "\n# changed\n"
+        return source
+
+    mocker.patch.object(pathlib.Path, "read_text", patched_read_text)
+    assert compile_cache.cache_key(TabularRegressionAutoMLPipeline()) != key
+
+
+def test_cache_key_tracks_pipeline_settings() -> None:
+    pipeline = TabularClassificationBQMLPipeline()
+    key = compile_cache.cache_key(pipeline)
+    pipeline.search_parallelism = 8
+    assert compile_cache.cache_key(pipeline) != key
+
+
+def test_compile_hits_cache(
+    tmp_path: pathlib.Path, mocker: pytest_mock.MockerFixture
+) -> None:
+    pipeline = TabularRegressionAutoMLPipeline()
+    pipeline.compile_pipeline(str(tmp_path / "first.json"))
+
+    compile_spy = mocker.patch("kfp.v2.compiler.Compiler.compile")
+    pipeline.compile_pipeline(str(tmp_path / "second.json"))
+    compile_spy.assert_not_called()
+    assert (tmp_path / "second.json").read_text() == (
+        tmp_path / "first.json"
+    ).read_text()
+
+    pipeline.compile_pipeline(str(tmp_path / "third.json"), use_cache=False)
+    compile_spy.assert_called_once()
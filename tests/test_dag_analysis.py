@@ -0,0 +1,160 @@
+import importlib
+import json
+import pathlib
+from typing import Any, Dict, List, Sequence
+
+import pytest
+
+from src.pipelines.trigger import compile_all, dag_analysis
+
+# Explicit dependencies that are needed although no data flows along them
+_intentional = {
+    # the importer reads the model files written by the export job
+    ("tabular_classification_bqml", "bigquery-export-model-job", "importer"),
+    # the champion is selected from the leaderboard the candidates write to
+    ("tabular_classification_bqml", "for-loop-1", "select-bqml-champion"),
+    ("tabular_regression_bqml", "for-loop-1", "select-bqml-champion"),
+    # the merge reads the tables written by the batch prediction shards
+    ("forecasting_automl", "for-loop-1", "merge-batch-predictions"),
+    ("forecasting_automl", "for-loop-2", "merge-batch-predictions"),
+    # training waits for the validation of its input table
+    (
+        "tabular_classification_automl",
+        "profile-bigquery-table",
+        "sample-training-table",
+    ),
+    ("tabular_regression_automl", "profile-bigquery-table", "sample-training-table"),
+    ("forecasting_automl", "profile-bigquery-table", "time-series-dataset-create"),
+    ("tabular_classification_bqml", "profile-bigquery-table", "materialize-features"),
+    ("tabular_regression_bqml", "profile-bigquery-table", "materialize-features"),
+    ("forecasting_bqml", "profile-bigquery-table", "materialize-features"),
+}
+
+
+def _task(
+    component: str, after: Sequence[str] = (), data_from: Sequence[str] = ()
+) -> dict:
+    return {
+        "componentRef": {"name": f"comp-{component}"},
+        "dependentTasks": sorted(set(after) | set(data_from)),
+        "inputs": {
+            "artifacts": {
+                f"input_{producer}": {
+                    "taskOutputArtifact": {
+                        "producerTask": producer,
+                        "outputArtifactKey": "output",
+                    }
+                }
+                for producer in data_from
+            }
+        },
+    }
+
+
+def _spec(tasks: Dict[str, Any]) -> Dict[str, Any]:
+    return {"pipelineSpec": {"root": {"dag": {"tasks": tasks}}}}
+
+
+def test_false_serialization_on_critical_path() -> None:
+    spec = _spec(
+        {
+            "train": _task("train"),
+            "upload": _task("upload", data_from=["train"]),
+            "endpoint": _task("endpoint", after=["upload"]),
+            "deploy": _task("deploy", data_from=["upload", "endpoint"]),
+        }
+    )
+    durations: Dict[str, float] = {
+        "train": 100,
+        "upload": 10,
+        "endpoint": 30,
+        "deploy": 50,
+    }
+
+    analysis = dag_analysis.analyze(spec, durations)
+
+    assert analysis.makespan == 190
+    assert analysis.critical_path == ["train", "upload", "endpoint", "deploy"]
+    [edge] = analysis.false_serialization()
+    assert (edge.upstream, edge.downstream) == ("upload", "endpoint")
+    # without the edge the endpoint is created during training
+    assert edge.savings == 30
+
+
+def test_explicit_edge_off_critical_path() -> None:
+    spec = _spec(
+        {
+            "train": _task("train"),
+            "evaluate": _task("evaluate", after=["train"]),
+            "report": _task("report", after=["evaluate"]),
+            "predict": _task("predict", data_from=["train"]),
+        }
+    )
+    analysis = dag_analysis.analyze(
+        spec, {"train": 100, "evaluate": 5, "report": 5, "predict": 60}
+    )
+    assert analysis.critical_path == ["train", "predict"]
+    assert not analysis.false_serialization()
+    assert len(analysis.explicit_edges) == 2
+
+
+def test_durations_by_task_then_component() -> None:
+    tasks = {
+        "create": _task("bigquery-create-model-job"),
+        "create-2": {"componentRef": {"name": "comp-bigquery-create-model-job-2"}},
+        "other": _task("something-else"),
+    }
+    durations = dag_analysis.task_durations(tasks, {"create": 7.0})
+    assert durations == {
+        "create": 7.0,
+        "create-2": dag_analysis.DEFAULT_DURATIONS["bigquery-create-model-job"],
+        "other": dag_analysis._default_duration,
+    }
+
+
+def test_loop_takes_its_sub_dag_critical_path() -> None:
+    spec = _spec(
+        {
+            "train": _task("train"),
+            "for-loop-1": _task("for-loop-1", data_from=["train"]),
+        }
+    )
+    spec["pipelineSpec"]["components"] = {
+        "comp-for-loop-1": {
+            "dag": {
+                "tasks": {
+                    "predict": _task("predict"),
+                    "merge": _task("merge", data_from=["predict"]),
+                }
+            }
+        }
+    }
+
+    analysis = dag_analysis.analyze(spec, {"train": 100, "predict": 60, "merge": 5})
+
+    assert analysis.durations["for-loop-1"] == 65
+    assert analysis.makespan == 165
+
+
+def _pipelines() -> List[Any]:
+    return [
+        pytest.param(cls, id=compile_all._template_name(module, cls.__name__, 1)[:-5])
+        for module in compile_all.discover_pipeline_modules()
+        for cls in compile_all.pipeline_classes(importlib.import_module(module))
+    ]
+
+
+@pytest.mark.parametrize("pipeline_cls", _pipelines())
+def test_no_false_serialization(pipeline_cls: type, tmp_path: pathlib.Path) -> None:
+    template_path = tmp_path / "pipeline.json"
+    pipeline_cls().compile_pipeline(str(template_path))
+    name = compile_all._template_name(pipeline_cls.__module__, pipeline_cls.__name__, 1)
+
+    analysis = dag_analysis.analyze(json.loads(template_path.read_text()))
+
+    unexpected = [
+        (e.upstream, e.downstream)
+        for e in analysis.false_serialization()
+        if (name[: -len(".json")], e.upstream, e.downstream) not in _intentional
+    ]
+    assert not unexpected, analysis.format()
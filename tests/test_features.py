@@ -0,0 +1,152 @@
+import datetime
+import types
+from typing import Any, Iterable, List
+
+from google.cloud import bigquery
+import pytest
+
+from src.components.bigquery.features import materialize_features
+from tests.conftest import artifact, FakeBigQuery
+
+_schema = [
+    bigquery.SchemaField("length", "FLOAT"),
+    bigquery.SchemaField("sex", "STRING"),
+    bigquery.SchemaField("ingested_at", "TIMESTAMP"),
+    bigquery.SchemaField("Rings", "INTEGER"),
+]
+_source_id = "project.dataset.abalone"
+
+
+@pytest.fixture
+def fake_bigquery(fake_bigquery: FakeBigQuery) -> FakeBigQuery:
+    """A source table, and the feature tables its queries create"""
+    fake_bigquery.tables["project.dataset.abalone"] = types.SimpleNamespace(
+        project="project",
+        dataset_id="dataset",
+        table_id="abalone",
+        table_type="TABLE",
+        location="US",
+        modified=datetime.datetime(2022, 7, 21, tzinfo=datetime.timezone.utc),
+        schema=_schema,
+    )
+
+    def on_query(sql: str, job_config: Any) -> List[Any]:
+        fake_bigquery.tables[sql.split("`")[1]] = types.SimpleNamespace(expires=None)
+        return []
+
+    fake_bigquery.on_query = on_query
+    return fake_bigquery
+
+
+def _materialize(**kwargs: Any) -> Any:
+    features = artifact()
+    (feature_table,) = materialize_features.python_func(
+        project="project",
+        bq_table="project.dataset.abalone",
+        features=features,
+        **kwargs,
+    )
+    return feature_table, features
+
+
+_transforms = {
+    "length": "ML.STANDARD_SCALER(length) OVER ()",
+    "is_male": "sex = 'M'",
+}
+
+
+def test_features_are_materialized_once_per_snapshot(
+    fake_bigquery: FakeBigQuery,
+) -> None:
+    feature_table, features = _materialize(
+        transforms=_transforms,
+        drop_columns="sex",
+        partition_column="ingested_at",
+        cluster_columns="Rings",
+    )
+
+    ((sql, _),) = fake_bigquery.queries
+    assert sql == (
+        f"CREATE TABLE IF NOT EXISTS `{feature_table}`\n"
+        "PARTITION BY DATE(`ingested_at`)\n"
+        "CLUSTER BY `Rings`\n"
+        "AS SELECT * EXCEPT (`sex`) "
+        "REPLACE (ML.STANDARD_SCALER(length) OVER () AS `length`), "
+        "sex = 'M' AS `is_male`\n"
+        # modified long ago: beyond time travel, the current table is read
+        "FROM `project.dataset.abalone`"
+    )
+    assert feature_table.startswith("project.features.abalone_")
+    assert not features.metadata["reused"]
+    ((table, fields),) = fake_bigquery.updated
+    assert fields == ["expires"] and table.expires
+
+    # another model type trained on the same snapshot
+    again, features = _materialize(
+        transforms=_transforms,
+        drop_columns="sex",
+        partition_column="ingested_at",
+        cluster_columns="Rings",
+    )
+    assert again == feature_table
+    assert features.metadata["reused"]
+    assert len(fake_bigquery.queries) == 1
+
+    # a new snapshot is a new version
+    fake_bigquery.tables["project.dataset.abalone"].modified += datetime.timedelta(
+        days=1
+    )
+    newer, _ = _materialize(
+        transforms=_transforms,
+        drop_columns="sex",
+        partition_column="ingested_at",
+        cluster_columns="Rings",
+    )
+    assert newer != feature_table
+    assert len(fake_bigquery.queries) == 2
+
+
+def test_no_transformation_trains_on_the_source(fake_bigquery: FakeBigQuery) -> None:
+    feature_table, features = _materialize()
+    assert feature_table == "project.dataset.abalone"
+    assert features.uri == "bq://project.dataset.abalone"
+    assert not fake_bigquery.queries
+
+
+def test_unknown_column(fake_bigquery: FakeBigQuery) -> None:
+    with pytest.raises(ValueError, match="No column day"):
+        _materialize(transforms=_transforms, partition_column="day")
+
+
+def test_recent_snapshots_are_read_with_time_travel(
+    fake_bigquery: FakeBigQuery,
+) -> None:
+    modified = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=2)
+    fake_bigquery.tables[_source_id].modified = modified
+    _materialize(transforms=_transforms)
+    ((sql, _),) = fake_bigquery.queries
+    assert sql.endswith(f"FOR SYSTEM_TIME AS OF TIMESTAMP '{modified.isoformat()}'")
+
+
+def test_source_modified_while_materialized(fake_bigquery: FakeBigQuery) -> None:
+    materialize = fake_bigquery.on_query
+
+    def modify_source(sql: str, job_config: Any) -> Iterable[Any]:
+        source = fake_bigquery.tables[_source_id]
+        fake_bigquery.tables[_source_id] = types.SimpleNamespace(
+            **{**vars(source), "modified": datetime.datetime.now(datetime.timezone.utc)}
+        )
+        return materialize(sql, job_config)
+
+    fake_bigquery.on_query = modify_source
+    with pytest.raises(RuntimeError, match="was modified"):
+        _materialize(transforms=_transforms)
+    assert list(fake_bigquery.tables) == [_source_id]
+
+
+def test_integer_partition_column(fake_bigquery: FakeBigQuery) -> None:
+    with pytest.raises(
+        ValueError, match="Cannot partition by Rings: its type is INTEGER"
+    ):
+        _materialize(transforms=_transforms, partition_column="Rings")
+    assert not fake_bigquery.queries
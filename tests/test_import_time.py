@@ -0,0 +1,42 @@
+from typing import List, Set
+
+import pytest
+
+from src.pipelines.trigger import compile_all, importtime
+
+# Each of these costs about a second to import: they must stay lazy.
+_lazy_packages = ["google.cloud.aiplatform", "google_cloud_pipeline_components"]
+
+
+def _loaded(packages: List[str], modules: Set[str]) -> List[str]:
+    return [
+        package
+        for package in packages
+        if any(m == package or m.startswith(f"{package}.") for m in modules)
+    ]
+
+
+def test_parse_importtime() -> None:
+    stderr = "\n".join(
+        [
+            "import time: self [us] | cumulative | imported package",
+            "import time:       120 |        120 |   json.decoder",
+            "import time:       380 |        500 | json",
+        ]
+    )
+    profile = importtime.parse_importtime("json", stderr)
+    assert profile.total_us == 500
+    assert profile.modules["json.decoder"] == 120
+
+
+def test_trigger_imports_lazily() -> None:
+    modules = importtime.imported_modules("src.pipelines.trigger.pipeline")
+    assert "src.pipelines.trigger.pipeline" in modules
+    assert _loaded(["kfp"] + _lazy_packages, modules) == []
+
+
+@pytest.mark.parametrize("module", compile_all.discover_pipeline_modules())
+def test_pipeline_imports_lazily(module: str) -> None:
+    modules = importtime.imported_modules(module)
+    assert module in modules
+    assert _loaded(_lazy_packages, modules) == []
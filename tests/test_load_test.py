@@ -0,0 +1,124 @@
+import json
+import pathlib
+import threading
+import time
+from typing import Any, List
+
+import pytest
+
+from src.pipelines.trigger import load_test
+
+
+def _slow_model(seconds: float, slots: int) -> load_test.PredictFn:
+    """A model that handles `slots` requests at a time, like a small replica"""
+    semaphore = threading.Semaphore(slots)
+
+    def predict(instances: List[Any]) -> List[Any]:
+        with semaphore:
+            time.sleep(seconds)
+        return [{"value": instance["x"] * 2} for instance in instances]
+
+    return predict
+
+
+def test_load_test_local_server(tmp_path: pathlib.Path) -> None:
+    instances = [{"x": i} for i in range(10)]
+    with load_test.serve(_slow_model(0.01, slots=2)) as url:
+        predict = load_test.http_predictor(url)
+        assert predict(instances[:2]) == [{"value": 0}, {"value": 2}]
+        result = load_test.load_test(
+            predict,
+            instances,
+            target=url,
+            machine_type="n1-standard-2",
+            concurrency_levels=[1, 4],
+            requests_per_level=20,
+        )
+
+    one, four = result.levels
+    assert one.errors == four.errors == 0
+    assert 10 <= one.p50_ms <= one.p95_ms <= one.p99_ms
+    # two slots: queueing beyond concurrency 2, throughput capped around 2x
+    assert four.p95_ms > one.p95_ms
+    assert four.throughput > one.throughput * 1.3
+
+    load_test.save_result(result, str(tmp_path / "result.json"))
+    assert load_test.load_result(str(tmp_path / "result.json")) == result
+
+
+def test_errors_are_counted() -> None:
+    def failing(instances: List[Any]) -> Any:
+        if instances[0]["x"] % 2:
+            raise RuntimeError("503")
+        return []
+
+    level = load_test.run_level(failing, [{"x": i} for i in range(4)], 2, 8)
+    assert level.errors == 4
+    assert load_test.LoadTestResult("t", "m", 1, [level]).capacity(1e6) == 0
+
+
+def test_percentile() -> None:
+    values = [float(v) for v in range(1, 101)]
+    assert load_test.percentile(values, 50) == 50
+    assert load_test.percentile(values, 99) == 99
+    assert load_test.percentile([], 50) == 0
+
+
+def _result(machine_type: str, *levels: Any) -> load_test.LoadTestResult:
+    return load_test.LoadTestResult(
+        target="endpoint",
+        machine_type=machine_type,
+        batch_size=1,
+        levels=[
+            load_test.LevelResult(c, int(qps * 10), 0, 10.0, p95 / 2, p95, p95 * 2)
+            for c, qps, p95 in levels
+        ],
+    )
+
+
+def test_recommend_cheapest_at_peak(tmp_path: pathlib.Path) -> None:
+    results = [
+        # 10 req/s within 100 ms, 20 req/s above it
+        _result("n1-standard-2", (1, 5, 50), (4, 10, 90), (8, 20, 300)),
+        # 25 req/s within 100 ms, at twice the price
+        _result("n1-standard-4", (1, 6, 40), (8, 25, 80)),
+    ]
+    recommendation = load_test.recommend(
+        results, peak_qps=70, p95_ms=100, min_qps=5, target_utilization=0.5
+    )
+    # n1-standard-2: 70 / 5 = 14 replicas, n1-standard-4: 70 / 12.5 = 6
+    assert recommendation.machine_type == "n1-standard-4"
+    assert recommendation.max_replica_count == 6
+    assert recommendation.min_replica_count == 1
+    assert recommendation.replica_capacity == 25
+
+    params = tmp_path / "params.json"
+    params.write_text(json.dumps({"project": "p"}))
+    results_path = tmp_path / "n1-standard-2.json"
+    load_test.save_result(results[0], str(results_path))
+    load_test.main(
+        load_test.parse_args(
+            [
+                "recommend",
+                "--results",
+                str(results_path),
+                "--peak_qps",
+                "20",
+                "--p95_ms",
+                "100",
+                "--update_params",
+                str(params),
+            ]
+        )
+    )
+    assert json.loads(params.read_text()) == {
+        "project": "p",
+        "deploy_machine_type": "n1-standard-2",
+        "deploy_min_replica_count": 1,
+        "deploy_max_replica_count": 3,
+    }
+
+
+def test_recommend_without_any_level_in_objective() -> None:
+    with pytest.raises(ValueError, match="p95 latency of 10"):
+        load_test.recommend([_result("n1-standard-2", (1, 5, 50))], 10, p95_ms=10)
@@ -0,0 +1,327 @@
+import json
+import pathlib
+import threading
+
+import pyarrow.parquet as pq
+import pytest
+
+from src.pipelines.forecasting.automl.pipeline import TabularForecastingAutoMLPipeline
+from src.pipelines.tabular_classification.bqml.pipeline import (
+    TabularClassificationBQMLPipeline,
+)
+from src.pipelines.tabular_classification.custom.pipeline import (
+    TabularClassificationCustomPipeline,
+)
+from src.pipelines.tabular_regression.bqml.pipeline import (
+    TabularRegressionBQMLPipeline,
+)
+from src.pipelines.trigger import local_runner, stand_ins
+
+_bqml_params = json.loads(
+    (
+        pathlib.Path(__file__).parents[1]
+        / "src/pipelines/tabular_classification/bqml/params.json"
+    ).read_text()
+)
+
+
+def test_bqml_pipeline_runs_locally(tmp_path: pathlib.Path) -> None:
+    local_run = TabularClassificationBQMLPipeline().run_local(
+        str(tmp_path), _bqml_params
+    )
+
+    assert local_run.succeeded, local_runner.format_report(local_run)
+    tasks = local_run.tasks
+    [candidate] = tasks["for-loop-1"].iterations
+    assert candidate.tasks["bigquery-create-model-job"].mode == "stand-in"
+    assert tasks["model-upload"].mode == "placeholder"
+    assert tasks["importer"].mode == "importer"
+    interpret = candidate.tasks["interpret-bqml-evaluation-metrics"]
+    assert interpret.mode == "in-process"
+    assert interpret.artifacts["metrics"]["metadata"]["framework"] == "BQML"
+    table_uri = interpret.artifacts["evaluation_table"]["uri"]
+    assert pq.read_table(table_uri[len("file://") :]).num_rows == 1
+    model = candidate.tasks["bigquery-create-model-job"].artifacts["model"]
+    assert model["metadata"]["modelType"] == "dnn_classifier"
+    champion = tasks["select-bqml-champion"].artifacts["champion"]["metadata"]
+    assert champion["modelId"] == "beans_model"
+    # no scoring_input_uri: the offline scoring condition does not hold
+    assert tasks["condition-offline-scoring-2"].state == local_runner.NOT_TRIGGERED
+
+
+def test_report_notes_the_placeholder_champion(tmp_path: pathlib.Path) -> None:
+    candidates = [
+        {"model_type": "dnn_classifier", "name": "dnn"},
+        {"model_type": "boosted_tree_classifier", "name": "gbt"},
+    ]
+    local_run = TabularClassificationBQMLPipeline().run_local(
+        str(tmp_path), {**_bqml_params, "candidates": candidates}
+    )
+
+    assert local_run.succeeded, local_runner.format_report(local_run)
+    assert len(local_run.tasks["for-loop-1"].iterations) == 2
+    [note] = local_run.tasks["select-bqml-champion"].notes
+    assert "placeholders" in note and "not the best by f1_score" in note
+    assert f"note: select-bqml-champion: {note}" in local_runner.format_report(
+        local_run
+    )
+
+
+def test_csv_import_into_local_warehouse(tmp_path: pathlib.Path) -> None:
+    bucket = tmp_path / "gcs" / "bucket"
+    bucket.mkdir(parents=True)
+    (bucket / "abalone.csv").write_text("length,rings,sex\n0.4,7,M\n0.6,12,F\n")
+
+    local_run = TabularClassificationCustomPipeline().run_local(
+        str(tmp_path),
+        {
+            "project": "project",
+            "bq_location": "US",
+            "region": "us-central1",
+            "bq_dataset": "dataset",
+            "gcs_input_file_uri": "gs://bucket/abalone.csv",
+        },
+    )
+
+    assert local_run.succeeded, local_runner.format_report(local_run)
+    raw_dataset = local_run.tasks["import-csv-to-bigquery"].artifacts["raw_dataset"]
+    assert raw_dataset["uri"] == "bq://project.dataset.abalone_raw"
+    assert [f["type"] for f in raw_dataset["metadata"]["schema"]] == [
+        "FLOAT",
+        "INTEGER",
+        "STRING",
+    ]
+    warehouse = stand_ins.LocalWarehouse(str(tmp_path / "warehouse.sqlite"))
+    rows = warehouse.execute(
+        "SELECT sex FROM `project.dataset.abalone_raw` WHERE rings > 10"
+    )
+    assert [row["sex"] for row in rows] == ["F"]
+
+
+def test_independent_tasks_run_concurrently(tmp_path: pathlib.Path) -> None:
+    # the three candidates, then predict and export (which only depend on the
+    # champion) can only pass their barrier if they run at the same time
+    candidates = threading.Barrier(3, timeout=10)
+    champion_users = threading.Barrier(2, timeout=10)
+
+    def create_model(ctx: stand_ins.TaskContext) -> None:
+        candidates.wait()
+        stand_ins.bigquery_create_model_job(ctx)
+
+    def waits_for_sibling(ctx: stand_ins.TaskContext) -> None:
+        champion_users.wait()
+        stand_ins.placeholder(ctx)
+
+    local_run = TabularClassificationBQMLPipeline().run_local(
+        str(tmp_path),
+        {
+            **_bqml_params,
+            "candidates": [
+                {"model_type": "dnn_classifier"},
+                {"model_type": "boosted_tree_classifier", "options": {"max_depth": 4}},
+                {"model_type": "logistic_reg", "name": "logistic"},
+            ],
+        },
+        stand_ins={
+            **stand_ins.DEFAULT_STAND_INS,
+            "bigquery-create-model-job": create_model,
+            "predict-bqml-incremental": waits_for_sibling,
+            "bigquery-export-model-job": waits_for_sibling,
+        },
+    )
+    assert local_run.succeeded, local_runner.format_report(local_run)
+    assert "for-loop-1/2/bigquery-create-model-job" in local_runner.format_report(
+        local_run
+    )
+    champion = local_run.tasks["select-bqml-champion"].artifacts["metrics"]
+    assert champion["metadata"]["candidates"] == 3
+
+
+def test_failure_skips_downstream_tasks(tmp_path: pathlib.Path) -> None:
+    def fails(ctx: stand_ins.TaskContext) -> None:
+        raise RuntimeError("quota exceeded")
+
+    local_run = TabularClassificationBQMLPipeline().run_local(
+        str(tmp_path),
+        _bqml_params,
+        stand_ins={**stand_ins.DEFAULT_STAND_INS, "bigquery-export-model-job": fails},
+    )
+
+    tasks = local_run.tasks
+    assert not local_run.succeeded
+    assert tasks["bigquery-export-model-job"].state == local_runner.FAILED
+    assert "quota exceeded" in tasks["bigquery-export-model-job"].error
+    for name in ("importer", "model-upload", "model-deploy"):
+        assert tasks[name].state == local_runner.SKIPPED
+    assert "failed:" in local_runner.format_report(local_run)
+
+
+def test_missing_pipeline_parameter(tmp_path: pathlib.Path) -> None:
+    with pytest.raises(ValueError, match="display_name"):
+        TabularClassificationBQMLPipeline().run_local(
+            str(tmp_path),
+            {k: v for k, v in _bqml_params.items() if k != "display_name"},
+        )
+
+
+def test_incremental_prediction_appends_new_rows(tmp_path: pathlib.Path) -> None:
+    warehouse = stand_ins.LocalWarehouse(str(tmp_path / "warehouse.sqlite"))
+    csv = tmp_path / "abalone.csv"
+    params = {
+        "project": "project",
+        "bq_location": "US",
+        "region": "us-central1",
+        "bq_table": "project.dataset.abalone",
+        "label": "rings",
+        "model": "dataset.abalone_model",
+        "predictions_table": "project.dataset.predictions",
+        "watermark_column": "day",
+    }
+
+    def run(rows: str) -> local_runner.LocalRun:
+        csv.write_text("day,rings\n" + rows)
+        warehouse.load_file(str(csv), "project.dataset.abalone")
+        local_run = TabularRegressionBQMLPipeline().run_local(str(tmp_path), params)
+        assert local_run.succeeded, local_runner.format_report(local_run)
+        return local_run
+
+    run("1,7\n2,12\n")
+    local_run = run("1,7\n2,12\n3,9\n")
+
+    predict = local_run.tasks["predict-bqml-incremental"]
+    assert predict.artifacts["predictions"]["metadata"]["rows_scored"] == 1
+    assert warehouse.num_rows("project.dataset.predictions") == 3
+    profile = local_run.tasks["profile-bigquery-table"].artifacts["profile"]
+    assert profile["metadata"]["rows"] == 3
+    assert profile["metadata"]["columns"]["rings"]["nulls"] == 0
+
+
+def test_parallel_for_runs_every_shard(tmp_path: pathlib.Path) -> None:
+    params = json.loads(
+        (
+            pathlib.Path(__file__).parents[1]
+            / "src/pipelines/forecasting/automl/params.json"
+        ).read_text()
+    )
+    predicted = []
+
+    def shard(ctx: stand_ins.TaskContext) -> None:
+        shards = [
+            {"source": f"bq://p.staging.shard_{i}", "destination": f"bq://p.out_{i}"}
+            for i in range(ctx.parameters["num_shards"])
+        ]
+        ctx.output_parameters.update(
+            shards=json.dumps(shards[1:]),
+            explained_shards=json.dumps(shards[:1]),
+            staging_dataset="p.staging",
+        )
+
+    def batch_predict(ctx: stand_ins.TaskContext) -> None:
+        assert ctx.inputs["model"].metadata["resourceName"]
+        predicted.append(
+            (
+                ctx.parameters["bigquery_source_input_uri"],
+                ctx.parameters["generate_explanation"],
+            )
+        )
+        stand_ins.placeholder(ctx)
+
+    local_run = TabularForecastingAutoMLPipeline().run_local(
+        str(tmp_path),
+        {**params, "num_shards": 3},
+        stand_ins={
+            "shard-batch-prediction-input": shard,
+            "model-batch-predict": batch_predict,
+        },
+    )
+
+    assert local_run.succeeded, local_runner.format_report(local_run)
+    assert sorted(predicted) == [
+        ("bq://p.staging.shard_0", 1),
+        ("bq://p.staging.shard_1", 0),
+        ("bq://p.staging.shard_2", 0),
+    ]
+    assert local_run.tasks["merge-batch-predictions"].state == local_runner.SUCCEEDED
+    assert (tmp_path / "for-loop-1" / "1" / "model-batch-predict").is_dir()
+
+
+def test_condition_runs_its_tasks_when_it_holds(tmp_path: pathlib.Path) -> None:
+    scored = []
+
+    def score(ctx: stand_ins.TaskContext) -> None:
+        scored.append(ctx.parameters["input_uri"])
+        stand_ins.placeholder(ctx)
+
+    local_run = TabularClassificationBQMLPipeline().run_local(
+        str(tmp_path),
+        {**_bqml_params, "scoring_input_uri": "gs://bucket/to_score"},
+        stand_ins={**stand_ins.DEFAULT_STAND_INS, "score-saved-model": score},
+    )
+
+    assert local_run.succeeded, local_runner.format_report(local_run)
+    condition = local_run.tasks["condition-offline-scoring-2"]
+    assert condition.mode == "condition"
+    [scoring] = condition.iterations
+    assert scoring.tasks["score-saved-model"].mode == "stand-in"
+    assert scored == ["gs://bucket/to_score"]
+
+
+def test_dependents_of_an_untriggered_condition(tmp_path: pathlib.Path) -> None:
+    template = tmp_path / "pipeline.json"
+    TabularClassificationBQMLPipeline().compile_pipeline(str(template))
+    spec = json.loads(template.read_text())
+    tasks = spec["pipelineSpec"]["root"]["dag"]["tasks"]
+    tasks["model-upload"]["dependentTasks"].append("condition-offline-scoring-2")
+    template.write_text(json.dumps(spec))
+
+    local_run = local_runner.run(
+        str(template),
+        _bqml_params,
+        str(tmp_path / "run"),
+        stand_ins=stand_ins.DEFAULT_STAND_INS,
+    )
+
+    assert local_run.succeeded, local_runner.format_report(local_run)
+    for name in ("condition-offline-scoring-2", "model-upload", "model-deploy"):
+        assert local_run.tasks[name].state == local_runner.NOT_TRIGGERED
+    assert local_run.tasks["importer"].state == local_runner.SUCCEEDED
+
+
+def test_loop_iterations_share_the_warehouse(tmp_path: pathlib.Path) -> None:
+    warehouses = []
+
+    def create_model(ctx: stand_ins.TaskContext) -> None:
+        warehouses.append(ctx.warehouse)
+        stand_ins.bigquery_create_model_job(ctx)
+
+    local_run = TabularClassificationBQMLPipeline().run_local(
+        str(tmp_path),
+        {
+            **_bqml_params,
+            "candidates": [
+                {"model_type": "dnn_classifier"},
+                {"model_type": "logistic_reg", "name": "logistic"},
+            ],
+        },
+        stand_ins={
+            **stand_ins.DEFAULT_STAND_INS,
+            "bigquery-create-model-job": create_model,
+        },
+    )
+
+    assert local_run.succeeded, local_runner.format_report(local_run)
+    assert len(warehouses) == 2
+    assert all(warehouse is warehouses[0] for warehouse in warehouses)
+
+
+def test_condition_terms() -> None:
+    parameters = {"uri": "gs://b", "n": 3, "rate": "0.5"}
+    assert local_runner._holds(
+        "inputs.parameters['uri'].string_value != ''", parameters
+    )
+    assert local_runner._holds(
+        "(inputs.parameters['n'].int_value > 2) && "
+        "(inputs.parameters['rate'].double_value <= 0.5)",
+        parameters,
+    )
+    assert not local_runner._holds("inputs.parameters['n'].int_value == 4", parameters)
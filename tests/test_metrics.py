@@ -0,0 +1,316 @@
+import json
+import math
+import pathlib
+import types
+from typing import Any, Dict, List
+
+from google.protobuf import json_format, struct_pb2
+from kfp.v2.dsl import Artifact, ClassificationMetrics, Metrics
+import pyarrow.parquet as pq
+import pytest
+import pytest_mock
+
+from src.components.metrics.automl import (
+    interpret_automl_classification_metrics,
+    interpret_automl_regression_metrics,
+)
+from src.components.metrics.bqml import interpret_bqml_evaluation_metrics
+
+
+def classification_payload(n_thresholds: int) -> Dict[str, Any]:
+    """AutoML classification metrics with a smooth ROC curve of AUC 0.95"""
+    confidence_metrics = []
+    for i in range(n_thresholds):
+        threshold = i / max(n_thresholds - 1, 1)
+        fpr = (1 - threshold) ** 3
+        recall = 1 - threshold**3
+        confidence_metrics.append(
+            {
+                "confidenceThreshold": threshold,
+                "falsePositiveRate": fpr,
+                "recall": recall,
+                "precision": 0.9,
+            }
+        )
+    return {
+        "auRoc": 0.92,
+        "logLoss": 0.3,
+        "confidenceMetrics": confidence_metrics,
+        "confusionMatrix": {
+            "annotationSpecs": [{"displayName": "a"}, {"displayName": "b"}],
+            "rows": [[90, 10], [5, 95]],
+        },
+    }
+
+
+def regression_payload() -> Dict[str, Any]:
+    return {
+        "meanAbsoluteError": 1.5,
+        "meanAbsolutePercentageError": 15.0,
+        "rSquared": 0.6,
+        "rootMeanSquaredError": 2.1,
+        "rootMeanSquaredLogError": 0.2,
+    }
+
+
+def bqml_arima_payload(n_series: int) -> Dict[str, Any]:
+    """BigQuery rows of ML.ARIMA_EVALUATE: one row per time series"""
+    fields = [
+        {"name": "store_name", "type": "STRING"},
+        {"name": "has_drift", "type": "BOOLEAN"},
+        {"name": "log_likelihood", "type": "FLOAT"},
+        {"name": "AIC", "type": "FLOAT"},
+        {"name": "variance", "type": "FLOAT"},
+    ]
+    rows = [
+        {
+            "f": [
+                {"v": f"store_{i}"},
+                {"v": "true" if i % 2 else "false"},
+                {"v": str(-float(i))},
+                {"v": str(float(i))},
+                {"v": None if i == 0 else str(i / 10)},
+            ]
+        }
+        for i in range(n_series)
+    ]
+    return {"schema": {"fields": fields}, "rows": rows}
+
+
+def fake_evaluation(
+    payload: Dict[str, Any], evaluation_id: str = "1"
+) -> types.SimpleNamespace:
+    metrics = json_format.ParseDict(payload, struct_pb2.Value())
+    return types.SimpleNamespace(
+        name=f"projects/p/locations/l/models/1/evaluations/{evaluation_id}",
+        metrics_schema_uri="gs://schema",
+        _pb=types.SimpleNamespace(metrics=metrics),
+    )
+
+
+class FakeModelService:
+    """Pages of one evaluation each, counting the pages actually fetched"""
+
+    def __init__(self) -> None:
+        self.evaluations: List[types.SimpleNamespace] = []
+        self.calls = 0
+        self.pages_fetched = 0
+
+    def list_model_evaluations(self, request: Dict[str, Any]) -> Any:
+        self.calls += 1
+        assert request["page_size"] == 1
+        for evaluation in self.evaluations:
+            self.pages_fetched += 1
+            yield evaluation
+
+    def get_model_evaluation(self, name: str) -> types.SimpleNamespace:
+        self.calls += 1
+        return next(e for e in self.evaluations if e.name == name)
+
+
+@pytest.fixture
+def service(mocker: pytest_mock.MockerFixture) -> FakeModelService:
+    service = FakeModelService()
+    mocker.patch("google.cloud.aiplatform.init")
+    mocker.patch(
+        "google.cloud.aiplatform.gapic.ModelServiceClient", return_value=service
+    )
+    return service
+
+
+def _model() -> Artifact:
+    model = Artifact()
+    model.metadata["resourceName"] = "projects/p/locations/l/models/1"
+    return model
+
+
+def test_classification_metrics_downsamples_roc_curve(
+    service: FakeModelService, capsys: pytest.CaptureFixture
+) -> None:
+    service.evaluations.append(fake_evaluation(classification_payload(5_000)))
+    metrics, classification_metrics = Metrics(), ClassificationMetrics()
+    interpret_automl_classification_metrics.python_func(
+        "l", _model(), metrics, classification_metrics, max_roc_points=100
+    )
+
+    roc = classification_metrics.metadata["confidenceMetrics"]
+    assert 50 <= len(roc) <= 100
+    fpr = [point["falsePositiveRate"] for point in roc]
+    tpr = [point["recall"] for point in roc]
+    assert fpr == sorted(fpr)
+    assert (fpr[0], fpr[-1]) == (0.0, 1.0)
+    # area preserved
+    auc = sum(
+        (x1 - x0) * (y0 + y1) / 2 for x0, x1, y0, y1 in zip(fpr, fpr[1:], tpr, tpr[1:])
+    )
+    assert math.isclose(auc, 0.95, abs_tol=1e-3)
+
+    assert classification_metrics.metadata["confusionMatrix"]["rows"] == [
+        {"row": [90, 10]},
+        {"row": [5, 95]},
+    ]
+    assert "confidenceMetrics" not in metrics.metadata
+    assert metrics.metadata["logLoss"] == "0.3"
+    # no full array dumps
+    assert len(capsys.readouterr().out) < 1_000
+
+
+def test_classification_metrics_small_curve_kept(
+    service: FakeModelService,
+) -> None:
+    service.evaluations.append(fake_evaluation(classification_payload(10)))
+    classification_metrics = ClassificationMetrics()
+    interpret_automl_classification_metrics.python_func(
+        "l", _model(), Metrics(), classification_metrics
+    )
+    assert len(classification_metrics.metadata["confidenceMetrics"]) == 10
+
+
+def test_regression_metrics_fetch_first_evaluation_only(
+    service: FakeModelService,
+) -> None:
+    service.evaluations.extend(
+        fake_evaluation(regression_payload(), str(i)) for i in range(5)
+    )
+    metrics = Metrics()
+    interpret_automl_regression_metrics.python_func("l", _model(), metrics)
+    assert metrics.metadata["rSquared"] == 0.6
+    assert service.pages_fetched == 1
+
+
+def test_evaluation_cache(
+    service: FakeModelService,
+    tmp_path: pathlib.Path,
+    mocker: pytest_mock.MockerFixture,
+) -> None:
+    service.evaluations.append(fake_evaluation(regression_payload(), "1"))
+    service.evaluations.append(
+        fake_evaluation({**regression_payload(), "rSquared": 0.7}, "2")
+    )
+
+    for _ in range(2):
+        metrics = Metrics()
+        interpret_automl_regression_metrics.python_func(
+            "l", _model(), metrics, evaluation_id="2", cache_dir=str(tmp_path)
+        )
+        assert metrics.metadata["rSquared"] == 0.7
+    assert service.calls == 1
+
+    # the default (first listed) evaluation is listed every time, but its
+    # metrics are only converted once
+    convert = mocker.spy(json_format, "MessageToDict")
+    for evaluation_id, points in (("3", 10), ("3", 10), ("4", 20)):
+        service.evaluations[0] = fake_evaluation(
+            classification_payload(points), evaluation_id
+        )
+        classification_metrics = ClassificationMetrics()
+        interpret_automl_classification_metrics.python_func(
+            "l", _model(), Metrics(), classification_metrics, cache_dir=str(tmp_path)
+        )
+        assert len(classification_metrics.metadata["confidenceMetrics"]) == points
+    assert service.calls == 4
+    assert convert.call_count == 2
+
+
+def test_regression_metrics_skip_missing_metrics(service: FakeModelService) -> None:
+    payload = regression_payload()
+    del payload["meanAbsolutePercentageError"]
+    service.evaluations.append(fake_evaluation(payload))
+    metrics = Metrics()
+    interpret_automl_regression_metrics.python_func("l", _model(), metrics)
+    assert "meanAbsolutePercentageError" not in metrics.metadata
+    assert metrics.metadata["rSquared"] == 0.6
+
+
+def test_components_ship_the_shared_helper() -> None:
+    for component_op in (
+        interpret_automl_classification_metrics,
+        interpret_automl_regression_metrics,
+    ):
+        program = component_op.component_spec.implementation.container.command[-1]
+        assert program.count("\ndef get_eval_info(") == 1
+        assert program.index("def get_eval_info(") < program.index(
+            f"def {component_op.python_func.__name__}("
+        )
+
+
+def _bqml_evaluation(payload: Dict[str, Any]) -> Artifact:
+    artifact = Artifact()
+    artifact.metadata.update(payload)
+    return artifact
+
+
+def _local_dataset(tmp_path: pathlib.Path) -> types.SimpleNamespace:
+    # kfp only maps gs:// URIs to local paths
+    return types.SimpleNamespace(path=str(tmp_path / "evaluation"), metadata={})
+
+
+def test_bqml_single_row_metrics(tmp_path: pathlib.Path) -> None:
+    payload = {
+        "schema": {
+            "fields": [
+                {"name": "mean_absolute_error", "type": "FLOAT"},
+                {"name": "mean_squared_error", "type": "FLOAT"},
+            ]
+        },
+        "rows": [{"f": [{"v": "1.5"}, {"v": "4.0"}]}],
+    }
+    metrics = Metrics()
+    interpret_bqml_evaluation_metrics.python_func(
+        _bqml_evaluation(payload), metrics, _local_dataset(tmp_path)
+    )
+    assert metrics.metadata == {
+        "mean_absolute_error": 1.5,
+        "mean_squared_error": 4.0,
+        "root_mean_squared_error": 2.0,
+        "framework": "BQML",
+    }
+
+
+def test_bqml_multi_row_summary(tmp_path: pathlib.Path) -> None:
+    evaluation_table = _local_dataset(tmp_path)
+    metrics = Metrics()
+    interpret_bqml_evaluation_metrics.python_func(
+        _bqml_evaluation(bqml_arima_payload(1_001)),
+        metrics,
+        evaluation_table,
+        worst_k=3,
+    )
+
+    assert metrics.metadata["num_rows"] == 1_001
+    assert metrics.metadata["AIC_mean"] == 500.0
+    assert metrics.metadata["AIC_p50"] == 500.0
+    assert metrics.metadata["AIC_max"] == 1_000.0
+    assert "AIC" not in metrics.metadata
+    worst = json.loads(metrics.metadata["worst_3_by_AIC"])
+    assert [w["store_name"] for w in worst] == ["store_1000", "store_999", "store_998"]
+
+    table = pq.read_table(evaluation_table.path)
+    assert table.num_rows == 1_001
+    assert table.column("store_name")[1].as_py() == "store_1"
+    assert math.isnan(table.column("variance")[0].as_py())
+
+
+def test_bqml_worst_rows_of_a_score_are_the_lowest(tmp_path: pathlib.Path) -> None:
+    payload = {
+        "schema": {
+            "fields": [
+                {"name": "segment", "type": "STRING"},
+                {"name": "r2_score", "type": "FLOAT"},
+            ]
+        },
+        "rows": [
+            {"f": [{"v": name}, {"v": value}]}
+            for name, value in [("a", "0.9"), ("b", "0.2"), ("c", None), ("d", "0.5")]
+        ],
+    }
+    metrics = Metrics()
+    interpret_bqml_evaluation_metrics.python_func(
+        _bqml_evaluation(payload),
+        metrics,
+        _local_dataset(tmp_path),
+        worst_k=3,
+        worst_by="r2_score",
+    )
+    worst = json.loads(metrics.metadata["worst_3_by_r2_score"])
+    assert [w["segment"] for w in worst] == ["b", "d", "a"]
@@ -0,0 +1,124 @@
+import enum
+import random
+import threading
+from typing import Any, Dict, List, Optional
+
+import pytest
+import pytest_mock
+
+from src.pipelines.tabular_regression.bqml.pipeline import TabularRegressionBQMLPipeline
+from src.pipelines.trigger import monitor
+
+
+class FakeState(enum.Enum):
+    PIPELINE_STATE_PENDING = 2
+    PIPELINE_STATE_RUNNING = 3
+    PIPELINE_STATE_SUCCEEDED = 4
+    PIPELINE_STATE_FAILED = 5
+
+
+class FakePipelineJobService:
+    """Stands in for the Vertex PipelineJob API: jobs finish after a few polls"""
+
+    def __init__(self, polls_to_finish: int = 3) -> None:
+        self.polls_to_finish = polls_to_finish
+        self.jobs: List[Any] = []
+        self.lock = threading.Lock()
+        service = self
+
+        class Job:
+            def __init__(self, parameter_values: Dict[str, Any], **kwargs: Any) -> None:
+                self.parameter_values = parameter_values
+                self.kwargs = kwargs
+                self.resource_name: Optional[str] = None
+                self.polls = 0
+                self.blocking_run = False
+
+            def submit(self) -> None:
+                with service.lock:
+                    service.jobs.append(self)
+                    self.resource_name = f"pipelineJobs/{len(service.jobs)}"
+
+            def run(self) -> None:
+                self.blocking_run = True
+                self.submit()
+
+            @property
+            def state(self) -> FakeState:
+                self.polls += 1
+                if self.polls < service.polls_to_finish:
+                    return FakeState.PIPELINE_STATE_RUNNING
+                if self.parameter_values.get("fail"):
+                    return FakeState.PIPELINE_STATE_FAILED
+                return FakeState.PIPELINE_STATE_SUCCEEDED
+
+        self.Job = Job
+
+
+@pytest.fixture
+def service(mocker: pytest_mock.MockerFixture) -> FakePipelineJobService:
+    service = FakePipelineJobService()
+    mocker.patch("google.cloud.aiplatform.init")
+    mocker.patch("google.cloud.aiplatform.PipelineJob", service.Job)
+    return service
+
+
+_fast_polling = monitor.PollConfig(initial_delay=0.001, max_delay=0.002)
+_job_args: Dict[str, Any] = dict(
+    template_path="pipeline.json",
+    pipeline_root="gs://bucket/root",
+    project="project",
+    region="us-central1",
+)
+
+
+def test_backoff_delays() -> None:
+    config = monitor.PollConfig(initial_delay=1, max_delay=8, jitter=0.1)
+    delays = monitor.backoff_delays(config, random.Random(0))  # noqa: S311
+    values = [next(delays) for _ in range(6)]
+    for value, expected in zip(values, [1, 2, 4, 8, 8, 8]):
+        assert expected * 0.9 <= value <= expected * 1.1
+
+
+def test_expand_grid() -> None:
+    params = monitor.expand_grid({"label": "Rings"}, {"a": [1, 2], "b": ["x", "y"]})
+    assert len(params) == 4
+    assert {"label": "Rings", "a": 2, "b": "x"} in params
+
+
+def test_run_job_submit_only(service: FakePipelineJobService) -> None:
+    job = TabularRegressionBQMLPipeline().run_job(**_job_args, sync=False)
+    assert job.resource_name == "pipelineJobs/1"
+    assert not job.blocking_run
+
+
+def test_run_jobs(service: FakePipelineJobService) -> None:
+    params: List[Dict[str, Any]] = [
+        {"model": "m1"},
+        {"model": "m2", "fail": True},
+        {"model": "m3"},
+    ]
+    summaries = TabularRegressionBQMLPipeline().run_jobs(
+        **_job_args, pipeline_params_list=params, poll_config=_fast_polling
+    )
+
+    assert len(service.jobs) == 3
+    assert [s.parameter_values for s in summaries] == params
+    assert [s.state for s in summaries] == [
+        "PIPELINE_STATE_SUCCEEDED",
+        "PIPELINE_STATE_FAILED",
+        "PIPELINE_STATE_SUCCEEDED",
+    ]
+    assert all(s.polls == service.polls_to_finish for s in summaries)
+    assert "2/3 jobs succeeded" in monitor.format_summary(summaries)
+
+
+def test_run_jobs_reports_submit_errors(
+    service: FakePipelineJobService, mocker: pytest_mock.MockerFixture
+) -> None:
+    mocker.patch.object(service.Job, "submit", side_effect=RuntimeError("quota"))
+    summaries = TabularRegressionBQMLPipeline().run_jobs(
+        **_job_args, pipeline_params_list=[{}, {}], poll_config=_fast_polling
+    )
+    assert [s.state for s in summaries] == ["ERROR", "ERROR"]
+    assert summaries[0].error == "RuntimeError: quota"
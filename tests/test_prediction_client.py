@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+from typing import Any, List
+
+import pytest
+import pytest_mock
+
+from src.pipelines.trigger.load_test import serve
+from src.serving.prediction_client import (
+    Histogram,
+    HttpTransport,
+    MicroBatchingClient,
+    PredictionError,
+)
+
+
+class FakeModel:
+    """Doubles its inputs, recording batch sizes and concurrent requests"""
+
+    def __init__(self, delay: float = 0.0, failures: int = 0) -> None:
+        self.delay = delay
+        self.failures = failures
+        self.batches: List[int] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, instances: List[Any]) -> List[Any]:
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError("unavailable")
+            self.batches.append(len(instances))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.delay)
+        with self.lock:
+            self.in_flight -= 1
+        return [2 * x for x in instances]
+
+
+def _run(model: FakeModel, instances: List[int], **kwargs: Any) -> Any:
+    async def predict(url: str) -> Any:
+        async with MicroBatchingClient(HttpTransport(url), **kwargs) as client:
+            predictions = await client.predict_many(instances)
+        return predictions, client.stats()
+
+    with serve(model) as url:
+        return asyncio.run(predict(url))
+
+
+def test_predictions_are_batched_in_order() -> None:
+    model = FakeModel()
+    predictions, stats = _run(
+        model, list(range(50)), max_batch_size=16, max_latency_ms=50
+    )
+
+    assert predictions == [2 * x for x in range(50)]
+    assert sum(model.batches) == 50
+    assert max(model.batches) == 16
+    assert len(model.batches) < 50
+    assert stats["batch_size"]["count"] == len(model.batches)
+    assert stats["prediction_latency_ms"]["count"] == 50
+
+
+def test_in_flight_requests_are_limited() -> None:
+    model = FakeModel(delay=0.05)
+    _run(model, list(range(40)), max_batch_size=2, max_latency_ms=1, max_in_flight=3)
+
+    assert model.max_in_flight <= 3
+    assert len(model.batches) >= 20
+
+
+def test_transient_errors_are_retried() -> None:
+    model = FakeModel(failures=2)
+    predictions, stats = _run(model, [1], retries=3, backoff_ms=1)
+
+    assert predictions == [2]
+    assert stats["retries"] == 2
+    assert stats["failed_requests"] == 0
+
+
+def test_request_latency_excludes_backoff(mocker: pytest_mock.MockerFixture) -> None:
+    mocker.patch("src.serving.prediction_client.random.uniform", return_value=0.5)
+    model = FakeModel(failures=1)
+    predictions, stats = _run(model, [1], retries=1, backoff_ms=500)
+
+    assert predictions == [2]
+    assert stats["request_latency_ms"]["count"] == 2
+    assert stats["request_latency_ms"]["p99"] < 500
+    assert stats["prediction_latency_ms"]["p99"] >= 500
+
+
+def test_errors_reach_every_caller_of_the_batch() -> None:
+    model = FakeModel(failures=10)
+    with pytest.raises(PredictionError, match="500"):
+        _run(model, [1, 2, 3], retries=1, backoff_ms=1, max_latency_ms=50)
+
+
+def test_histogram_percentiles() -> None:
+    histogram = Histogram([1, 10, 100])
+    for value in (0.5, 5, 5, 50, 500):
+        histogram.observe(value)
+
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.percentile(50) == 10
+    assert histogram.percentile(99) == float("inf")
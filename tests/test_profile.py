@@ -0,0 +1,161 @@
+import argparse
+import copy
+import pathlib
+from typing import Any, Dict
+
+import pytest
+
+from src.pipelines.tabular_classification.automl.pipeline import (
+    TabularClassificationAutoMLPipeline,
+)
+from src.pipelines.trigger import profile
+
+_fixture = (
+    pathlib.Path(__file__).parent / "fixtures/tabular_classification_automl_job.json"
+)
+
+
+@pytest.fixture
+def recorded() -> Dict[str, Any]:
+    return profile.load_job(str(_fixture))
+
+
+def _slower_run(recorded: Dict[str, Any], minutes: int) -> Dict[str, Any]:
+    """The same job with model-deploy, and so the job, `minutes` longer"""
+    slower = copy.deepcopy(recorded)
+    job = slower["job"]
+    job["name"] += "-slower"
+    job[
+        "endTime"
+    ] = f"2022-07-21T{11 + (52 + minutes) // 60}:{(52 + minutes) % 60:02}:10Z"
+    for task in job["jobDetail"]["taskDetails"]:
+        if task["taskName"] == "model-deploy":
+            task["endTime"] = job["endTime"]
+    return slower
+
+
+def test_task_phases_and_critical_path(recorded: Dict[str, Any]) -> None:
+    job_profile = profile.profile_job(recorded)
+
+    assert job_profile.pipeline == "tabular_classification_automl_pipeline"
+    assert job_profile.seconds == pytest.approx(112 * 60 + 10, abs=1)
+    # the root DAG task is not a task of the timeline
+    assert len(job_profile.tasks) == 5
+    training = job_profile.tasks["automl-tabular-training-job"]
+    assert training.queue == pytest.approx(30, abs=1)
+    assert training.start == pytest.approx(45, abs=1)
+    assert training.execution == pytest.approx(91 * 60 + 30, abs=1)
+    assert job_profile.critical_path == [
+        "tabular-dataset-create",
+        "automl-tabular-training-job",
+        "model-deploy",
+    ]
+    # 5s before each of the three critical tasks is created
+    assert job_profile.orchestration == pytest.approx(15, abs=1)
+
+    gantt = profile.format_gantt(job_profile)
+    assert "*automl-tabular-training-job" in gantt
+    assert " endpoint-create" in gantt
+    assert gantt.splitlines()[-1].startswith("critical path: tabular-dataset-create")
+
+
+def test_critical_path_through_a_parallel_for(recorded: Dict[str, Any]) -> None:
+    # model-deploy, the last task to end, now runs in a loop
+    job = recorded["job"]
+    spec = job["pipelineSpec"]
+    deploy = spec["root"]["dag"]["tasks"].pop("model-deploy")
+    spec["root"]["dag"]["tasks"]["for-loop-1"] = {
+        "componentRef": {"name": "comp-for-loop-1"},
+        "dependentTasks": deploy.pop("dependentTasks"),
+    }
+    deploy.pop("inputs", None)
+    spec.setdefault("components", {})["comp-for-loop-1"] = {
+        "dag": {"tasks": {"model-deploy": deploy}}
+    }
+    details = job["jobDetail"]["taskDetails"]
+    details.append(
+        {
+            "createTime": "2022-07-21T11:35:02Z",
+            "endTime": "2022-07-21T11:52:05Z",
+            "parentTaskId": "100",
+            "startTime": "2022-07-21T11:35:03Z",
+            "state": "SUCCEEDED",
+            "taskId": "205",
+            "taskName": "for-loop-1",
+        }
+    )
+    next(t for t in details if t["taskName"] == "model-deploy")["parentTaskId"] = "205"
+
+    job_profile = profile.profile_job(recorded)
+
+    assert job_profile.critical_path == [
+        "tabular-dataset-create",
+        "automl-tabular-training-job",
+        "model-deploy",
+    ]
+    assert job_profile.orchestration == pytest.approx(15, abs=1)
+
+
+def test_parallel_for_iterations_are_merged(recorded: Dict[str, Any]) -> None:
+    original = profile.profile_job(recorded).tasks["model-deploy"]
+    tasks = recorded["job"]["jobDetail"]["taskDetails"]
+    deploy = next(t for t in tasks if t["taskName"] == "model-deploy")
+    iteration = {
+        **deploy,
+        "taskId": "iteration-2",
+        "endTime": recorded["job"]["endTime"],
+        "state": "FAILED",
+    }
+    tasks.append(iteration)
+
+    job_profile = profile.profile_job(recorded)
+    merged = job_profile.tasks["model-deploy"]
+    assert merged.iterations == 2
+    assert merged.state == "FAILED"
+    assert merged.created == original.created
+    assert merged.ended > original.ended
+    assert "model-deploy x2" in profile.format_gantt(job_profile)
+
+
+def test_history_and_regressions(
+    recorded: Dict[str, Any], tmp_path: pathlib.Path
+) -> None:
+    history_path = tmp_path / "history.jsonl"
+    baseline = profile.profile_job(recorded)
+    assert profile.append_history(baseline, history_path)
+    assert not profile.append_history(baseline, history_path)
+
+    history = profile.load_history(history_path, baseline.pipeline)
+    assert len(history) == 1
+    assert profile.compare_to_history(baseline, history) == []
+
+    slower = profile.profile_job(_slower_run(recorded, 20))
+    regressions = profile.compare_to_history(slower, history)
+    # 20 minutes is below the relative threshold for the job as a whole
+    assert [r.split(":")[0] for r in regressions] == ["model-deploy"]
+    slightly_slower = profile.profile_job(_slower_run(recorded, 1))
+    assert profile.compare_to_history(slightly_slower, history) == []
+
+    durations = profile.median_durations(history)
+    assert durations["model-deploy"] == baseline.tasks["model-deploy"].total
+
+
+def test_profile_subcommand_offline(
+    tmp_path: pathlib.Path, capsys: pytest.CaptureFixture
+) -> None:
+    history_path = tmp_path / "history.jsonl"
+    args = argparse.Namespace(
+        command="profile",
+        job=None,
+        job_json=str(_fixture),
+        project=None,
+        region=None,
+        record=None,
+        history=str(history_path),
+    )
+    TabularClassificationAutoMLPipeline().main(args)
+
+    output = capsys.readouterr().out
+    assert "critical path:" in output
+    assert "REGRESSION" not in output
+    assert len(profile.load_history(history_path)) == 1
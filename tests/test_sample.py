@@ -0,0 +1,84 @@
+import types
+from typing import Any
+
+from google.cloud import bigquery
+import pytest
+
+from src.components.bigquery.sample import sample_training_table
+from tests.conftest import artifact, FakeBigQuery, QueryResult
+
+_schema = [
+    bigquery.SchemaField("length", "FLOAT"),
+    bigquery.SchemaField("Class", "STRING"),
+    bigquery.SchemaField("day", "DATE"),
+]
+
+
+@pytest.fixture
+def fake_bigquery(fake_bigquery: FakeBigQuery) -> FakeBigQuery:
+    """A 1M row source table in the EU"""
+    fake_bigquery.location = "EU"
+    fake_bigquery.tables["source.beans.beans1"] = types.SimpleNamespace(
+        project="source",
+        dataset_id="beans",
+        table_id="beans1",
+        num_rows=1_000_000,
+        schema=_schema,
+    )
+    fake_bigquery.on_query = lambda sql, job_config: QueryResult(total_rows=10_500)
+    return fake_bigquery
+
+
+def _sample(**kwargs: Any) -> Any:
+    sample = artifact()
+    kwargs.setdefault("label", "Class")
+    outputs = sample_training_table.python_func(
+        project="project",
+        bq_table="bq://source.beans.beans1",
+        run_id="run-1",
+        sample=sample,
+        **kwargs,
+    )
+    return outputs, sample
+
+
+def test_small_tables_are_not_sampled(fake_bigquery: FakeBigQuery) -> None:
+    outputs, sample = _sample(target_rows=2_000_000)
+
+    assert outputs.bq_source == "bq://source.beans.beans1"
+    assert outputs.fraction == 1.0
+    assert not fake_bigquery.queries
+
+
+def test_stratified_sample(fake_bigquery: FakeBigQuery) -> None:
+    outputs, sample = _sample(target_rows=10_000)
+
+    sql, job_config = fake_bigquery.queries[-1]
+    assert "SELECT *, `Class` AS _sample_stratum FROM `source.beans.beans1`" in sql
+    assert "quantiles" not in sql
+    parameters = {p.name: p.value for p in job_config.query_parameters}
+    assert parameters == {"seed": "0", "fraction": 0.01, "min_rows": 1000}
+    assert job_config.destination.table_id == "beans1_sample_run_1"
+    (dataset,) = fake_bigquery.datasets
+    assert dataset.dataset_id == "automl_staging" and dataset.location == "EU"
+
+    assert outputs.bq_source == "bq://project.automl_staging.beans1_sample_run_1"
+    assert outputs.fraction == 0.0105
+    assert outputs.labels == {"sampling": "stratified", "sampling_ppm": "10500"}
+    assert sample.metadata["sample_rows"] == 10_500
+
+
+def test_label_bins_and_time_strata(fake_bigquery: FakeBigQuery) -> None:
+    _sample(target_rows=10_000, label="length", label_bins=10)
+    sql, _ = fake_bigquery.queries[-1]
+    assert "APPROX_QUANTILES(`length`, 10)" in sql
+    assert "RANGE_BUCKET(`length`, (SELECT bounds FROM quantiles))" in sql
+
+    _sample(target_rows=10_000, method="time", time_column="day")
+    sql, _ = fake_bigquery.queries[-1]
+    assert "DATE(`day`) AS _sample_stratum" in sql
+
+
+def test_unknown_time_column(fake_bigquery: FakeBigQuery) -> None:
+    with pytest.raises(ValueError, match="No time column"):
+        _sample(target_rows=10_000, method="time")
@@ -0,0 +1,20 @@
+import json
+import pathlib
+
+from src.pipelines.trigger import schema_cache
+
+
+def test_with_cached_schema(tmp_path: pathlib.Path) -> None:
+    params_path = str(tmp_path / "params.json")
+    params = {"project": "svc-demo-vertex"}
+    assert schema_cache.with_cached_schema(params, params_path) == params
+
+    schema = [{"name": "Rings", "type": "INTEGER", "mode": "NULLABLE"}]
+    assert schema_cache.save(params_path, schema) == tmp_path / "schema.json"
+    assert schema_cache.load(params_path) == schema
+
+    params_with_schema = schema_cache.with_cached_schema(params, params_path)
+    assert json.loads(params_with_schema["schema_json"]) == schema
+
+    explicit = {**params, "schema_json": "[]"}
+    assert schema_cache.with_cached_schema(explicit, params_path) == explicit
@@ -0,0 +1,143 @@
+import pathlib
+import sys
+import types
+from typing import Any
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+import pytest_mock
+
+from src.components.scoring.saved_model import score_saved_model
+
+
+def _tensor(values: np.ndarray) -> Any:
+    return types.SimpleNamespace(numpy=lambda: values)
+
+
+def _spec(dtype: type, rank: int) -> Any:
+    return types.SimpleNamespace(
+        dtype=types.SimpleNamespace(as_numpy_dtype=dtype),
+        shape=types.SimpleNamespace(rank=rank),
+    )
+
+
+class FakeSignature:
+    """Stands in for the serving signature of an exported BQML classifier"""
+
+    structured_input_signature = (
+        (),
+        {"length": _spec(np.float32, 2), "sex": _spec(object, 1)},
+    )
+
+    def __call__(self, length: Any, sex: Any) -> dict:
+        length, sex = length.numpy(), sex.numpy()
+        assert length.dtype == np.float32 and length.shape[1] == 1
+        probs = np.hstack([length, 1 - length])
+        return {
+            "predicted_label": _tensor((sex.astype(str) + "!").astype(object)),
+            "label_probs": _tensor(probs),
+        }
+
+
+@pytest.fixture(autouse=True)
+def fake_tensorflow(mocker: pytest_mock.MockerFixture) -> None:
+    tf = types.SimpleNamespace(
+        constant=_tensor,
+        config=types.SimpleNamespace(
+            threading=types.SimpleNamespace(
+                set_intra_op_parallelism_threads=lambda threads: None
+            )
+        ),
+        saved_model=types.SimpleNamespace(
+            load=lambda uri: types.SimpleNamespace(
+                signatures={"serving_default": FakeSignature()}
+            )
+        ),
+    )
+    mocker.patch.dict(sys.modules, {"tensorflow": tf})
+
+
+def _write_input(path: pathlib.Path, files: int = 2) -> None:
+    path.mkdir()
+    for i in range(files):
+        table = pa.table(
+            {
+                "id": [f"{i}-{j}" for j in range(100)],
+                "length": [j / 100 for j in range(100)],
+                "sex": ["M", "F", None, "I"] * 25,
+            }
+        )
+        pq.write_table(table, path / f"{i}.parquet", row_group_size=30)
+
+
+def _score(tmp_path: pathlib.Path, **kwargs: Any) -> Any:
+    predictions = types.SimpleNamespace(uri=None, metadata={})
+    score_saved_model.python_func(
+        model_uri="gs://bucket/model",
+        input_uri=str(tmp_path / "input"),
+        output_uri=str(tmp_path / "output"),
+        predictions=predictions,
+        passthrough_columns="id",
+        **kwargs,
+    )
+    return predictions
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_every_row_is_scored(tmp_path: pathlib.Path, workers: int) -> None:
+    _write_input(tmp_path / "input")
+    predictions = _score(tmp_path, batch_size=16, workers=workers)
+
+    assert predictions.metadata["rows_scored"] == 200
+    assert predictions.metadata["workers"] == workers
+    parts = sorted((tmp_path / "output").iterdir())
+    assert len(parts) == workers
+    scored = pa.concat_tables(pq.read_table(p) for p in parts).sort_by("id")
+    assert scored.column_names == ["id", "label_probs", "predicted_label"]
+    assert scored.num_rows == 200
+    row = scored.slice(1, 1).to_pylist()[0]
+    assert row["id"] == "0-1"
+    assert row["predicted_label"] == "F!"
+    assert row["label_probs"] == pytest.approx([0.01, 0.99])
+    assert scored.column("predicted_label").to_pylist()[2] == "!"
+
+
+def test_default_workers_follow_the_cpu_limit(
+    tmp_path: pathlib.Path, mocker: pytest_mock.MockerFixture
+) -> None:
+    # a 64-core node, a container limited to 2 CPUs by its cgroup (v2)
+    cgroup = {"/sys/fs/cgroup/cpu.max": "200000 100000\n"}
+    is_file, read_text = pathlib.Path.is_file, pathlib.Path.read_text
+    mocker.patch("os.sched_getaffinity", return_value=set(range(64)))
+    mocker.patch.object(
+        pathlib.Path,
+        "is_file",
+        lambda self: str(self) in cgroup or is_file(self),
+    )
+    mocker.patch.object(
+        pathlib.Path,
+        "read_text",
+        lambda self, *args: cgroup.get(str(self)) or read_text(self, *args),
+    )
+    _write_input(tmp_path / "input")
+    predictions = _score(tmp_path)
+
+    assert predictions.metadata["workers"] == 2
+    assert predictions.metadata["rows_scored"] == 200
+
+
+def test_missing_model_inputs(tmp_path: pathlib.Path) -> None:
+    (tmp_path / "input").mkdir()
+    pq.write_table(pa.table({"id": ["a"]}), tmp_path / "input/0.parquet")
+    with pytest.raises(ValueError, match=r"\['length', 'sex'\]"):
+        _score(tmp_path, workers=1)
+
+
+def test_nothing_to_score_without_input() -> None:
+    predictions = types.SimpleNamespace(uri=None, metadata={})
+    score_saved_model.python_func(
+        model_uri="", input_uri="", output_uri="", predictions=predictions
+    )
+    assert predictions.metadata["rows_scored"] == 0
@@ -0,0 +1,167 @@
+from concurrent.futures import Future
+import pathlib
+import sys
+import threading
+import time
+import types
+from typing import Any, List
+
+import pyarrow as pa
+import pytest
+import pytest_mock
+
+from src.components.bigquery import stream_import
+
+
+class SlowSink(stream_import.Sink):
+    """Records peak Arrow memory while uploads are in flight"""
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.peak_allocated_bytes = 0
+        self.lock = threading.Lock()
+
+    def write(self, batch: pa.RecordBatch) -> None:
+        time.sleep(0.001)
+        with self.lock:
+            self.rows += batch.num_rows
+            self.peak_allocated_bytes = max(
+                self.peak_allocated_bytes, pa.total_allocated_bytes()
+            )
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def csv_path(tmp_path: pathlib.Path) -> pathlib.Path:
+    path = tmp_path / "abalone.csv"
+    with open(path, "w") as f:
+        f.write("Sex,Length,Rings\n")
+        f.writelines(
+            f"{'MFI'[i % 3]},{i / 1000:.3f},{i % 29}\n" for i in range(1_000_000)
+        )
+    return path
+
+
+def test_stream_csv_with_bounded_memory(csv_path: pathlib.Path) -> None:
+    chunk_bytes = 64 * 1024
+    sink = SlowSink()
+    stats = stream_import.stream_to_sink(
+        stream_import.iter_file_batches(str(csv_path), chunk_bytes=chunk_bytes),
+        sink,
+        max_in_flight=3,
+    )
+
+    assert sink.rows == stats.rows == 1_000_000
+    assert stats.batches > 100
+    assert stats.max_in_flight <= 3
+    # a few chunks plus the CSV reader buffers, never the ~12 MB file
+    assert sink.peak_allocated_bytes < csv_path.stat().st_size / 2
+
+
+def test_stream_rows_to_arrow_file(tmp_path: pathlib.Path) -> None:
+    rows = ({"id": i, "label": f"row{i}"} for i in range(1_000))
+    path = tmp_path / "rows.arrow"
+    stats = stream_import.stream_to_sink(
+        stream_import.iter_row_batches(rows, chunk_rows=128),
+        stream_import.ArrowFileSink(str(path)),
+    )
+    assert stats.batches == 8
+
+    table = pa.ipc.open_file(str(path)).read_all()
+    assert table.num_rows == 1_000
+    assert sorted(table.column("id").to_pylist()) == list(range(1_000))
+
+    roundtrip = list(stream_import.iter_file_batches(str(path), "ARROW"))
+    assert sum(batch.num_rows for batch in roundtrip) == 1_000
+
+
+def test_stream_surfaces_sink_errors() -> None:
+    class FailingSink(stream_import.Sink):
+        closed = False
+
+        def write(self, batch: pa.RecordBatch) -> None:
+            raise RuntimeError("quota exceeded")
+
+        def close(self) -> None:
+            self.closed = True
+
+    rows = ({"id": i} for i in range(10))
+    sink = FailingSink()
+    with pytest.raises(RuntimeError, match="quota exceeded"):
+        stream_import.stream_to_sink(
+            stream_import.iter_row_batches(rows, chunk_rows=2), sink
+        )
+    assert sink.closed
+
+
+def test_proto_rows_match_arrow_schema() -> None:
+    schema = pa.schema([("id", pa.int64()), ("label", pa.string())])
+    message_class, descriptor = stream_import._proto_message_class(schema)
+    assert [field.name for field in descriptor.field] == ["id", "label"]
+    assert message_class(id=1, label="a").SerializeToString()
+
+    with pytest.raises(TypeError):
+        stream_import._proto_message_class(pa.schema([("ts", pa.timestamp("s"))]))
+
+
+class FakeAppendRowsStream:
+    """Acknowledges every request; records what was sent on the connection"""
+
+    opened: List["FakeAppendRowsStream"] = []
+
+    def __init__(self, client: Any, template: Any) -> None:
+        self.template = template
+        self.requests: List[Any] = []
+        self.closed = False
+        FakeAppendRowsStream.opened.append(self)
+
+    def send(self, request: Any) -> Future:
+        self.requests.append(request)
+        future: Future = Future()
+        future.set_result(
+            types.SimpleNamespace(row_errors=[], error=types.SimpleNamespace(code=0))
+        )
+        return future
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeAppendRowsRequest(types.SimpleNamespace):
+    ProtoData = types.SimpleNamespace
+
+
+@pytest.fixture
+def fake_storage_write(mocker: pytest_mock.MockerFixture) -> None:
+    FakeAppendRowsStream.opened = []
+    request_types = types.SimpleNamespace(
+        AppendRowsRequest=FakeAppendRowsRequest,
+        ProtoRows=lambda: types.SimpleNamespace(serialized_rows=[]),
+        ProtoSchema=types.SimpleNamespace,
+    )
+    module = types.SimpleNamespace(
+        BigQueryWriteClient=lambda: types.SimpleNamespace(
+            table_path=lambda *parts: "/".join(parts)
+        ),
+        types=request_types,
+        writer=types.SimpleNamespace(AppendRowsStream=FakeAppendRowsStream),
+    )
+    mocker.patch.dict(sys.modules, {"google.cloud.bigquery_storage_v1": module})
+
+
+@pytest.mark.usefixtures("fake_storage_write")
+def test_write_sink_reuses_one_append_stream() -> None:
+    rows = ({"id": i, "label": str(i)} for i in range(1_000))
+    stats = stream_import.stream_to_sink(
+        stream_import.iter_row_batches(rows, chunk_rows=100),
+        stream_import.BigQueryWriteSink("project.dataset.table"),
+    )
+    assert stats.batches == 10
+
+    (stream,) = FakeAppendRowsStream.opened
+    assert stream.template.write_stream == "project/dataset/table/streams/_default"
+    assert len(stream.requests) == 10
+    assert sum(len(r.proto_rows.rows.serialized_rows) for r in stream.requests) == 1_000
+    assert stream.closed
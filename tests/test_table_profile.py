@@ -0,0 +1,133 @@
+import datetime
+import types
+from typing import Any, List
+
+from google.cloud import bigquery
+import pytest
+
+from src.components.bigquery.table_profile import profile_bigquery_table
+from tests.conftest import artifact, FakeBigQuery
+
+_schema = [
+    bigquery.SchemaField("length", "FLOAT"),
+    bigquery.SchemaField("sex", "STRING"),
+    bigquery.SchemaField("day", "DATE"),
+    bigquery.SchemaField("tags", "STRING", mode="REPEATED"),
+]
+_profile_row = {
+    "_rows": 100,
+    "c0_nulls": 0,
+    "c0_distinct": 80,
+    "c0_quantiles": [0.1, 0.3, 0.5, 0.7, 0.9],
+    "c0_mean": 0.5,
+    "c1_nulls": 10,
+    "c1_distinct": 3,
+    "c1_top": [{"value": "M", "count": 40}, {"value": "F", "count": 30}],
+    "c2_nulls": 0,
+    "c2_distinct": 100,
+    "c2_quantiles": [datetime.date(2022, 1, 1), datetime.date(2022, 4, 10)],
+    "c3_nulls": 0,
+}
+
+
+class _Row(dict):
+    """A bigquery.Row: a mapping with keys()"""
+
+
+@pytest.fixture
+def fake_bigquery(fake_bigquery: FakeBigQuery) -> FakeBigQuery:
+    """A source table and a profile cache"""
+    fake_bigquery.tables["project.dataset.abalone"] = types.SimpleNamespace(
+        project="project",
+        dataset_id="dataset",
+        table_id="abalone",
+        location="US",
+        modified=datetime.datetime(2022, 7, 21, tzinfo=datetime.timezone.utc),
+        schema=_schema,
+    )
+
+    def on_query(sql: str, job_config: Any) -> List[Any]:
+        if sql.startswith("SELECT profile"):
+            key = {p.name: p.value for p in job_config.query_parameters}
+            cache = fake_bigquery.loaded.get("project.data_profiles.profiles", [])
+            return [row for row in cache if all(row[k] == v for k, v in key.items())][
+                :1
+            ]
+        return [_Row(_profile_row)]
+
+    fake_bigquery.on_query = on_query
+    return fake_bigquery
+
+
+def _profile_queries(fake_bigquery: FakeBigQuery) -> List[str]:
+    return [
+        sql for sql, _ in fake_bigquery.queries if not sql.startswith("SELECT profile")
+    ]
+
+
+def _profile(**kwargs: Any) -> Any:
+    profile = artifact()
+    statistics = artifact()
+    statistics.log_metric = statistics.metadata.__setitem__
+    profile_bigquery_table.python_func(
+        project="project",
+        bq_table="bq://project.dataset.abalone",
+        profile=profile,
+        statistics=statistics,
+        **kwargs,
+    )
+    return profile, statistics
+
+
+def test_one_query_profiles_every_column(fake_bigquery: FakeBigQuery) -> None:
+    profile, statistics = _profile(label="length")
+
+    (sql,) = _profile_queries(fake_bigquery)
+    assert "APPROX_QUANTILES(`length`, 4) AS c0_quantiles" in sql
+    assert "AVG(`length`) AS c0_mean" in sql
+    assert "APPROX_TOP_COUNT(`length`" not in sql
+    assert "APPROX_TOP_COUNT(`sex`, 5) AS c1_top" in sql
+    assert "COUNTIF(`tags` IS NULL) AS c3_nulls" in sql
+    assert "c3_distinct" not in sql
+
+    columns = profile.metadata["columns"]
+    assert columns["sex"]["null_rate"] == 0.1
+    assert columns["sex"]["top"][0] == {"value": "M", "count": 40}
+    assert columns["day"]["quantiles"] == ["2022-01-01", "2022-04-10"]
+    assert statistics.metadata == pytest.approx(
+        {"rows": 100, "columns": 4, "cached": False, "violations": 0}
+    )
+
+
+def test_unchanged_tables_are_not_profiled_again(fake_bigquery: FakeBigQuery) -> None:
+    first, _ = _profile()
+    second, statistics = _profile()
+    assert len(_profile_queries(fake_bigquery)) == 1
+    assert statistics.metadata["cached"]
+    assert second.metadata == first.metadata
+
+    fake_bigquery.tables["project.dataset.abalone"].modified += datetime.timedelta(
+        hours=1
+    )
+    _profile()
+    assert len(_profile_queries(fake_bigquery)) == 2
+
+
+def test_broken_rules_fail(fake_bigquery: FakeBigQuery) -> None:
+    with pytest.raises(ValueError) as error:
+        _profile(
+            label="sex",
+            rules={
+                "min_rows": 1000,
+                "required_columns": ["rings"],
+                "max_null_rate": 0.05,
+                "min_distinct": {"length": 90},
+            },
+        )
+    # the label allows no nulls, whatever max_null_rate says
+    assert str(error.value).splitlines()[1:] == [
+        "- 100 rows, fewer than 1000",
+        "- no column rings",
+        "- length: 80 distinct values < 90",
+        "- sex: null rate 0.1000 > 0.0",
+    ]